@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, Iterable
+
+import numpy as np
+
+# File layout shared by the per-NodeRun array stores (trajectories, plate reads):
+#   header:   magic, format version, node run id, then the format's own header fields
+#   chunks:   zlib-compressed, laid out as the format decides
+#   metadata: JSON, empty if the format has none
+#   index:    one entry of the format's index dtype per chunk, which must have the fields `offset` and `length`
+#   footer:   metadata offset, metadata length, index offset, number of chunks, magic
+HEADER_PREFIX = "<4sHq"
+FOOTER = struct.Struct("<QIQI4s")
+
+
+class ChunkedFileFormat:
+    """
+    A kind of chunked file: its magic, version, header fields and chunk index. Files of a format are stored one per
+    NodeRun, see `path_for`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        magic: bytes,
+        version: int,
+        header_fields: str,
+        index_dtype: np.dtype,
+        suffix: str,
+    ):
+        """
+        :param name: What the files hold, used in errors
+        :param magic: 4 bytes identifying the format
+        :param version: Version of the format; files of other versions aren't read
+        :param header_fields: struct format of the format's own header fields, without byte order
+        :param index_dtype: dtype of a chunk index entry
+        :param suffix: File name suffix
+        """
+        self.name = name
+        self.magic = magic
+        self.version = version
+        self.header = struct.Struct(HEADER_PREFIX + header_fields)
+        self.index_dtype = index_dtype
+        self.suffix = suffix
+
+    def path_for(self, directory: Path, node_run_id: int) -> Path:
+        # Spread files over subdirectories so no directory grows huge
+        return directory / f"{node_run_id // 1000:06d}" / f"{node_run_id}{self.suffix}"
+
+    def write(
+        self,
+        path: Path,
+        node_run_id: int,
+        header: tuple,
+        chunks: Iterable[tuple[bytes, dict[str, Any]]],
+        num_chunks: int,
+        metadata: dict | None = None,
+    ) -> int:
+        """
+        Write a file, compressing each chunk.
+
+        :param path: Path of the file
+        :param node_run_id: NodeRun the file belongs to
+        :param header: Values of the format's own header fields
+        :param chunks: Each chunk's uncompressed data, and its index entry's fields other than offset and length
+        :param num_chunks: Number of chunks
+        :param metadata: JSON-serializable metadata
+        :return: Size of the file in bytes
+        """
+        tmp_path = path.with_suffix(".tmp")
+        index = np.zeros(num_chunks, dtype=self.index_dtype)
+        with open(tmp_path, "wb") as f:
+            f.write(self.header.pack(self.magic, self.version, node_run_id, *header))
+            for i, (data, fields) in enumerate(chunks):
+                chunk = zlib.compress(data)
+                for field, value in fields.items():
+                    index[field][i] = value
+                index["offset"][i] = f.tell()
+                index["length"][i] = len(chunk)
+                f.write(chunk)
+            metadata_offset = f.tell()
+            encoded = b"" if metadata is None else json.dumps(metadata).encode()
+            f.write(encoded)
+            index_offset = f.tell()
+            f.write(index.tobytes())
+            f.write(
+                FOOTER.pack(
+                    metadata_offset, len(encoded), index_offset, num_chunks, self.magic
+                )
+            )
+            size = f.tell()
+        # Readers never see a partly written file
+        os.replace(tmp_path, path)
+        return size
+
+
+class ChunkedFile:
+    """
+    A chunked file, memory-mapped. Chunks are only decompressed when read.
+    """
+
+    def __init__(self, path: Path, file_format: ChunkedFileFormat):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.node_run_id, *self.header = file_format.header.unpack_from(
+            self.mm, 0
+        )
+        if magic != file_format.magic or version != file_format.version:
+            self.mm.close()
+            raise ValueError(
+                f"{path} is not a version {file_format.version} {file_format.name} file"
+            )
+        metadata_offset, metadata_length, index_offset, num_chunks, _ = (
+            FOOTER.unpack_from(self.mm, len(self.mm) - FOOTER.size)
+        )
+        self.metadata: dict | None = (
+            json.loads(self.mm[metadata_offset : metadata_offset + metadata_length])
+            if metadata_length
+            else None
+        )
+        self.index = np.frombuffer(
+            self.mm,
+            dtype=file_format.index_dtype,
+            count=num_chunks,
+            offset=index_offset,
+        ).copy()
+
+    def chunk(self, entry: np.void) -> bytes:
+        """
+        Decompress the chunk of an index entry.
+        """
+        offset = int(entry["offset"])
+        return zlib.decompress(self.mm[offset : offset + int(entry["length"])])
+
+    def close(self) -> None:
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
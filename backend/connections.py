@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from os import getenv
+from typing import TYPE_CHECKING
+
+from backend.devices.supervisor import (
+    INSTRUMENT_CONNECT_TIMEOUT,
+    INSTRUMENT_RECONNECT_INITIAL,
+    INSTRUMENT_RECONNECT_MAX,
+)
+
+if TYPE_CHECKING:
+    from backend.devices.device_abc import AbstractConnector
+
+logger = logging.getLogger(__name__)
+
+# Connect to each instrument on its first use instead of at startup
+INSTRUMENT_LAZY_CONNECT = getenv("INSTRUMENT_LAZY_CONNECT", "0") == "1"
+
+
+class InstrumentUnavailable(ConnectionError):
+    """
+    Raised when a node needs an instrument that isn't connected.
+    """
+
+
+class InstrumentConnection:
+    """
+    Connects one instrument, retrying with exponential backoff until `connect_device()` succeeds.
+
+    Every attempt is limited to INSTRUMENT_CONNECT_TIMEOUT. Once connected, keeping the connection up is the
+    instrument's job (see ConnectionSupervisor).
+    """
+
+    def __init__(self, name: str, instrument: AbstractConnector):
+        self.name = name
+        self.instrument = instrument
+        self.task: asyncio.Task | None = None
+        self.connected = asyncio.Event()
+        # set when the first attempt has finished, whether it succeeded or not
+        self.attempted = asyncio.Event()
+
+        # "idle", "connecting", "connected" or "backoff"
+        self.state = "idle"
+        self.attempts = 0
+        self.failed_attempts = 0
+        self.last_error: str | None = None
+        self.connected_at: float | None = None
+        # seconds from the first attempt until connected
+        self.connect_seconds: float | None = None
+
+    @property
+    def available(self) -> bool:
+        return self.connected.is_set()
+
+    def start(self) -> None:
+        """
+        Start connecting in the background, if not started yet.
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def ensure(self) -> None:
+        """
+        Make sure the instrument is connected, connecting it now if that hasn't been tried yet.
+
+        :raises InstrumentUnavailable: if the instrument isn't connected after its first attempt. Attempts go on
+            in the background.
+        """
+        if self.available:
+            return
+        self.start()
+        await self.attempted.wait()
+        if not self.available:
+            raise InstrumentUnavailable(
+                f"{self.name} is unavailable ({self.state}, {self.failed_attempts} failed attempts): "
+                f"{self.last_error}"
+            )
+
+    async def _run(self) -> None:
+        started_at = time.monotonic()
+        delay = INSTRUMENT_RECONNECT_INITIAL
+        while True:
+            self.state = "connecting"
+            self.attempts += 1
+            try:
+                await asyncio.wait_for(
+                    self.instrument.connect_device(), INSTRUMENT_CONNECT_TIMEOUT
+                )
+            except Exception as e:
+                self.failed_attempts += 1
+                self.last_error = str(e) or type(e).__name__
+                self.state = "backoff"
+                self.attempted.set()
+                # Jitter, so instruments that went down together don't retry together
+                wait = delay * random.uniform(0.8, 1.2)
+                logger.warning(
+                    f"{self.name}: connecting failed ({self.last_error}), retrying in {wait:.1f} s"
+                )
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, INSTRUMENT_RECONNECT_MAX)
+                continue
+
+            self.connected_at = time.monotonic()
+            self.connect_seconds = self.connected_at - started_at
+            self.state = "connected"
+            self.connected.set()
+            self.attempted.set()
+            logger.info(
+                f"{self.name}: connected after {self.attempts} attempts, {self.connect_seconds:.2f} s"
+            )
+            return
+
+    def metrics(self) -> dict:
+        return {
+            "state": self.state,
+            "connects": 1 if self.available else 0,
+            "failed_attempts": self.failed_attempts,
+            "last_error": self.last_error,
+            "connected_seconds": (
+                time.monotonic() - self.connected_at
+                if self.connected_at is not None
+                else None
+            ),
+        }
+
+    def __repr__(self) -> str:
+        return f"<InstrumentConnection {self.name} state={self.state} attempts={self.attempts}>"
+
+
+class InstrumentConnections:
+    """
+    Connects instruments concurrently, so an unreachable one doesn't hold up the others or the server.
+
+    At startup (unless INSTRUMENT_LAZY_CONNECT), every instrument starts connecting at once and `connect_all` waits
+    only for each instrument's first attempt. Instruments that fail it are unavailable: nodes that use them fail
+    immediately with InstrumentUnavailable, while attempts go on in the background.
+    """
+
+    def __init__(self):
+        # key: instrument id
+        self.connections: dict[int, InstrumentConnection] = {}
+
+    def add(self, instrument_id: int, name: str, instrument: AbstractConnector) -> None:
+        self.connections[instrument_id] = InstrumentConnection(name, instrument)
+
+    async def connect_all(self, lazy: bool = INSTRUMENT_LAZY_CONNECT) -> None:
+        """
+        Start connecting every instrument, and wait for their first attempts.
+
+        :param lazy: Don't connect now; each instrument connects when it's first used (see `ensure`)
+        """
+        if lazy:
+            logger.info(f"Connecting {len(self.connections)} instruments on first use")
+            return
+
+        start = time.monotonic()
+        for connection in self.connections.values():
+            connection.start()
+        await asyncio.gather(
+            *(connection.attempted.wait() for connection in self.connections.values())
+        )
+        unavailable = [
+            connection.name
+            for connection in self.connections.values()
+            if not connection.available
+        ]
+        logger.info(
+            f"Connected {len(self.connections) - len(unavailable)} of {len(self.connections)} instruments "
+            f"in {time.monotonic() - start:.2f} s"
+            + (f", unavailable: {unavailable}" if unavailable else "")
+        )
+
+    async def ensure(self, instrument_id: int) -> None:
+        """
+        Make sure an instrument is connected, see `InstrumentConnection.ensure`.
+        """
+        await self.connections[instrument_id].ensure()
+
+    async def stop(self) -> None:
+        for connection in self.connections.values():
+            await connection.stop()
+            try:
+                await connection.instrument.disconnect_device()
+            except Exception as e:
+                logger.warning(f"{connection.name}: disconnecting failed: {e!r}")
+
+    def __getitem__(self, instrument_id: int) -> InstrumentConnection:
+        return self.connections[instrument_id]
+
+    def __repr__(self) -> str:
+        available = sum(
+            connection.available for connection in self.connections.values()
+        )
+        return f"<InstrumentConnections available={available}/{len(self.connections)}>"
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import zlib
+from os import getenv
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Directory payload blobs are stored in
+BLOB_DIR = getenv("BLOB_DIR") or str(Path.home() / ".vestra" / "blobs")
+# NodeRun inputs and outputs whose JSON is larger than this many bytes are stored as blobs instead of in node_runs
+PAYLOAD_BLOB_THRESHOLD = int(getenv("PAYLOAD_BLOB_THRESHOLD", "65536"))
+
+
+class BlobStore:
+    """
+    Content-addressed store of JSON payloads: a blob is named by the SHA-256 of its JSON, so a payload stored twice
+    (e.g. the same result of every run of a flow) is kept once. Blobs are zlib-compressed, and never change once
+    written.
+    """
+
+    def __init__(self, directory: str = BLOB_DIR):
+        self.directory = Path(directory)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.deduplicated = 0
+        self.bytes_written = 0
+        self.reads = 0
+
+    def path_for(self, digest: str) -> Path:
+        # Spread blobs over subdirectories so no directory grows huge
+        return self.directory / digest[:2] / digest
+
+    def put(self, data: bytes) -> str:
+        """
+        Store a blob, unless it's stored already.
+
+        :return: Its digest
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+        if path.exists():
+            with self.lock:
+                self.deduplicated += 1
+            return digest
+        path.parent.mkdir(parents=True, exist_ok=True)
+        compressed = zlib.compress(data)
+        # Unique per writer, so concurrent writers of the same blob don't clash
+        tmp_path = path.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(compressed)
+        # Readers never see a partly written blob
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.written += 1
+            self.bytes_written += len(compressed)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        """
+        :raises FileNotFoundError: if there's no such blob
+        """
+        data = zlib.decompress(self.path_for(digest).read_bytes())
+        with self.lock:
+            self.reads += 1
+        return data
+
+    def __repr__(self) -> str:
+        return (
+            f"<BlobStore {self.directory} written={self.written} deduplicated={self.deduplicated} "
+            f"bytes={self.bytes_written} reads={self.reads}>"
+        )
+
+
+blob_store = BlobStore()
+
+
+class Payload:
+    """
+    How a NodeRun input or output is stored: its JSON in the row, or, above PAYLOAD_BLOB_THRESHOLD, a reference to a
+    blob. Either way the row records the JSON's size.
+    """
+
+    def __init__(self, data: Any, threshold: int = PAYLOAD_BLOB_THRESHOLD):
+        self.data = data
+        # Sorted keys, so equal payloads get the same digest (JSONB doesn't keep the order anyway)
+        self.encoded = json.dumps(data, sort_keys=True).encode()
+        self.size = len(self.encoded)
+        self.offloaded = self.size > threshold
+        # Digest of the blob, once stored
+        self.ref: str | None = None
+
+    def store(self) -> Payload:
+        """
+        Store the payload as a blob if it's too large for the row. Blocks; see `astore`.
+        """
+        if self.offloaded and self.ref is None:
+            self.ref = blob_store.put(self.encoded)
+        return self
+
+    async def astore(self) -> Payload:
+        """
+        Store the payload as a blob if it's too large for the row, on a thread.
+        """
+        if self.offloaded and self.ref is None:
+            self.ref = await asyncio.to_thread(blob_store.put, self.encoded)
+        return self
+
+
+def load_payload(ref: str) -> Any:
+    """
+    Load a payload stored as a blob.
+    """
+    return json.loads(blob_store.get(ref))
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+
+from psycopg import AsyncConnection, OperationalError
+
+from backend.db.conn import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY channel for each table, see the triggers in migrations/0002_change_feed.sql
+CHANNELS = {
+    "instruments_changed": "instruments",
+    "node_runs_changed": "node_runs",
+    "flow_runs_changed": "flow_runs",
+}
+
+# Queries used to rebuild subscriber state after a reconnect, since notifications sent while
+# the listener was disconnected are lost.
+RESYNC_QUERIES = {
+    "instruments": "SELECT json_build_object('id', id, 'in_use_by', in_use_by) FROM instruments",
+    "node_runs": "SELECT json_build_object('id', id, 'flow_run_id', flow_run_id, 'node_id', node_id, 'status', status) "
+    "FROM node_runs WHERE status IN ('waiting', 'in-progress')",
+    "flow_runs": "SELECT json_build_object('id', id, 'current_node_id', current_node_id, 'status', status) "
+    "FROM flow_runs WHERE status IN ('waiting', 'in-progress', 'paused')",
+}
+
+
+class ChangeEvent:
+    """
+    A state transition on one row of `instruments`, `node_runs` or `flow_runs`.
+
+    `data` only holds the row's id and the state columns, not the whole row. `resync` is set on events
+    synthesized from a fresh snapshot after the listener reconnected.
+    """
+
+    def __init__(self, table: str, data: dict, resync: bool = False):
+        self.table = table
+        self.data = data
+        self.resync = resync
+
+    def __repr__(self) -> str:
+        return f"<ChangeEvent table={self.table} data={self.data} resync={self.resync}>"
+
+
+class Subscription:
+    """
+    In-process subscriber to the change feed. Iterate over it with `async for` to receive ChangeEvents.
+    """
+
+    def __init__(self, feed: ChangeFeed, tables: set[str] | None, maxsize: int):
+        self.feed = feed
+        self.tables = tables
+        self.queue: asyncio.Queue[ChangeEvent] = asyncio.Queue(maxsize)
+        # Number of events dropped because the subscriber fell behind
+        self.dropped = 0
+
+    def wants(self, event: ChangeEvent) -> bool:
+        return self.tables is None or event.table in self.tables
+
+    def put(self, event: ChangeEvent) -> None:
+        if self.queue.full():
+            # Drop the oldest event rather than blocking the listener
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self) -> ChangeEvent:
+        return await self.queue.get()
+
+    def close(self) -> None:
+        self.feed.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> ChangeEvent:
+        return await self.get()
+
+
+class ChangeFeed:
+    """
+    Listens for the change feed's NOTIFYs on a dedicated connection and fans them out to in-process subscribers.
+
+    The listener only runs while there are subscribers: the first `subscribe` starts it, and the last `close`
+    stops it, so no connection is held open for notifications nobody reads.
+
+    If the connection drops, the listener reconnects with backoff and sends subscribers a snapshot of the current
+    state (as `resync` events), so nothing that happened while it was disconnected is missed.
+    """
+
+    def __init__(self, dsn: str = DATABASE_URL, max_backoff: float = 30):
+        self.dsn = dsn
+        self.max_backoff = max_backoff
+        self.subscribers: set[Subscription] = set()
+        self.connected = asyncio.Event()
+        self.reconnects = 0
+        # Listener task, while there are subscribers
+        self.task: asyncio.Task | None = None
+
+    def subscribe(
+        self, tables: set[str] | None = None, maxsize: int = 1000
+    ) -> Subscription:
+        """
+        Subscribe to change events, starting the listener if it isn't running. Must be called from the event loop.
+
+        :param tables: Tables to receive events for (`instruments`, `node_runs`, `flow_runs`). All if None.
+        :param maxsize: Number of unread events to buffer before the oldest are dropped.
+        :return: Subscription to iterate over
+        """
+        subscription = Subscription(self, tables, maxsize)
+        self.subscribers.add(subscription)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+            self.task.add_done_callback(self._on_listener_done)
+        return subscription
+
+    def _on_listener_done(self, task: asyncio.Task) -> None:
+        # So the next `subscribe` starts a new listener, should this one ever end
+        if self.task is task:
+            self.task = None
+            self.connected.clear()
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscribers.discard(subscription)
+        if not self.subscribers:
+            self.stop()
+
+    def stop(self) -> None:
+        """
+        Stop the listener, closing its connection.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.connected.clear()
+
+    def publish(self, event: ChangeEvent) -> None:
+        for subscription in self.subscribers:
+            if subscription.wants(event):
+                subscription.put(event)
+
+    async def run(self) -> None:
+        """
+        Listen until cancelled. Started by `subscribe`.
+        """
+        backoff = 0.5
+        first_connect = True
+        while True:
+            try:
+                async with await AsyncConnection.connect(
+                    self.dsn, autocommit=True
+                ) as aconn:
+                    for channel in CHANNELS:
+                        await aconn.execute(f"LISTEN {channel}")
+                    logger.info("Change feed listening")
+
+                    # LISTEN is active before the snapshot is taken, so no change can fall in between
+                    if not first_connect:
+                        self.reconnects += 1
+                        await self._resync(aconn)
+                    first_connect = False
+                    backoff = 0.5
+                    self.connected.set()
+
+                    async for notify in aconn.notifies():
+                        try:
+                            data = json.loads(notify.payload)
+                        except ValueError as e:
+                            logger.warning(
+                                f"Change feed skipped a malformed {notify.channel} payload: {e}"
+                            )
+                            continue
+                        self.publish(ChangeEvent(CHANNELS[notify.channel], data))
+            except OperationalError as e:
+                self.connected.clear()
+                logger.warning(
+                    f"Change feed connection lost ({e}), reconnecting in {backoff}s"
+                )
+            except Exception:
+                # Anything else would end the listener for good, leaving subscribers waiting forever
+                self.connected.clear()
+                logger.exception(f"Change feed failed, reconnecting in {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def _resync(self, aconn: AsyncConnection) -> None:
+        logger.info("Change feed resynchronizing")
+        for table, query in RESYNC_QUERIES.items():
+            cur = await aconn.execute(query)
+            for (data,) in await cur.fetchall():
+                self.publish(ChangeEvent(table, data, resync=True))
+
+
+change_feed = ChangeFeed()
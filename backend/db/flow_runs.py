@@ -1,9 +1,13 @@
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import datetime, timezone
 
 from backend.node_connector_pb2.ui_pb2 import FlowRun as ProtoFlowRun
 from backend.db.conn import conn
+from backend.db.pool import acursor
+
+FLOW_RUN_COLUMNS = "id, name, start_flow_node_id, current_node_id, started_at, status, priority, deadline"
+ORDER_BY_OPTIONS = {"id", "id ASC", "id DESC", "started_at ASC", "started_at DESC"}
 
 
 class FlowRun:
@@ -15,6 +19,8 @@ class FlowRun:
         current_node_id: str,
         started_at: datetime,
         status: str,
+        priority: int = 0,
+        deadline: datetime | None = None,
     ):
         self.id = id
         self.name = name
@@ -22,29 +28,54 @@ class FlowRun:
         self.current_node_id = current_node_id
         self.started_at = started_at
         self.status = status
+        # Scheduling hints for the FlowRun's nodes; higher priority is more urgent
+        self.priority = priority
+        self.deadline = deadline
 
     @classmethod
     def fetch_from_id(cls, id: int) -> FlowRun:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT id, name, start_flow_node_id, current_node_id, started_at, status FROM flow_runs WHERE id = %s",
+                f"SELECT {FLOW_RUN_COLUMNS} FROM flow_runs WHERE id = %s",
                 (id,),
             )
             row = cur.fetchone()
             return cls(*row)
 
+    @classmethod
+    async def afetch_from_id(cls, id: int) -> FlowRun:
+        async with acursor() as cur:
+            await cur.execute(
+                f"SELECT {FLOW_RUN_COLUMNS} FROM flow_runs WHERE id = %s",
+                (id,),
+            )
+            row = await cur.fetchone()
+            return cls(*row)
+
     @classmethod
     def create(
-        cls, name: str, start_flow_node_id: str, status="in-progress"
+        cls,
+        name: str,
+        start_flow_node_id: str,
+        status="in-progress",
+        priority: int = 0,
+        deadline_seconds: float | None = None,
     ) -> FlowRun:
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO flow_runs (name, status, start_flow_node_id, current_node_id) "
-                "VALUES (%s, %s, %s, %s) "
-                "RETURNING id, started_at",
-                (name, status, start_flow_node_id, start_flow_node_id),
+                "INSERT INTO flow_runs (name, status, start_flow_node_id, current_node_id, priority, deadline) "
+                "VALUES (%s, %s, %s, %s, %s, NOW() + make_interval(secs => %s)) "
+                "RETURNING id, started_at, deadline",
+                (
+                    name,
+                    status,
+                    start_flow_node_id,
+                    start_flow_node_id,
+                    priority,
+                    deadline_seconds,
+                ),
             )
-            [flow_run_id, started_at] = cur.fetchone()
+            [flow_run_id, started_at, deadline] = cur.fetchone()
             return cls(
                 flow_run_id,
                 name,
@@ -52,18 +83,73 @@ class FlowRun:
                 start_flow_node_id,
                 started_at,
                 status,
+                priority,
+                deadline,
             )
 
+    @classmethod
+    async def acreate(
+        cls,
+        name: str,
+        start_flow_node_id: str,
+        status="in-progress",
+        priority: int = 0,
+        deadline_seconds: float | None = None,
+    ) -> FlowRun:
+        """
+        Create a FlowRun.
+
+        :param name: Name of the flow
+        :param start_flow_node_id: ID of the flow's start node
+        :param status: Initial status
+        :param priority: Priority of the FlowRun's nodes on their instruments, higher is more urgent
+        :param deadline_seconds: Seconds from now by which the FlowRun's nodes should be admitted, if any
+        :return: The new FlowRun
+        """
+        async with acursor() as cur:
+            await cur.execute(
+                "INSERT INTO flow_runs (name, status, start_flow_node_id, current_node_id, priority, deadline) "
+                "VALUES (%s, %s, %s, %s, %s, NOW() + make_interval(secs => %s)) "
+                "RETURNING id, started_at, deadline",
+                (
+                    name,
+                    status,
+                    start_flow_node_id,
+                    start_flow_node_id,
+                    priority,
+                    deadline_seconds,
+                ),
+            )
+            [flow_run_id, started_at, deadline] = await cur.fetchone()
+            return cls(
+                flow_run_id,
+                name,
+                start_flow_node_id,
+                start_flow_node_id,
+                started_at,
+                status,
+                priority,
+                deadline,
+            )
+
+    def seconds_to_deadline(self) -> float | None:
+        """
+        Seconds left until the FlowRun's deadline (negative if it passed), or None if it has none.
+        """
+        if self.deadline is None:
+            return None
+        return (self.deadline - datetime.now(timezone.utc)).total_seconds()
+
     @staticmethod
-    def query(
+    def _build_query(
         run_id: int | None = None,
         status: str | None = None,
         start_node_id: str | None = None,
         current_node_id: str | None = None,
         limit: int | None = None,
         order_by: str | None = None,
-    ) -> list[FlowRun]:
-        query = "SELECT * FROM flow_runs WHERE 1 = 1"
+    ) -> tuple[str, list]:
+        query = f"SELECT {FLOW_RUN_COLUMNS} FROM flow_runs WHERE 1 = 1"
         params = []
 
         if run_id is not None:
@@ -79,8 +165,10 @@ class FlowRun:
             query += " AND current_node_id = %s"
             params.append(current_node_id)
         if order_by is not None:
-            query += " ORDER BY %s"
-            params.append(order_by)
+            # ORDER BY can't be parameterized, so only allow known orderings
+            if order_by not in ORDER_BY_OPTIONS:
+                raise ValueError(f"Unsupported order_by: {order_by}")
+            query += f" ORDER BY {order_by}"
 
         if limit is not None:
             query += " LIMIT %s"
@@ -88,18 +176,60 @@ class FlowRun:
         else:
             query += " LIMIT 100"
 
+        return query, params
+
+    @staticmethod
+    def query(
+        run_id: int | None = None,
+        status: str | None = None,
+        start_node_id: str | None = None,
+        current_node_id: str | None = None,
+        limit: int | None = None,
+        order_by: str | None = None,
+    ) -> list[FlowRun]:
+        query, params = FlowRun._build_query(
+            run_id, status, start_node_id, current_node_id, limit, order_by
+        )
         with conn.cursor() as cur:
             cur.execute(query, params)
             rows = cur.fetchall()
 
             return [FlowRun(*row) for row in rows]
 
+    @staticmethod
+    async def aquery(
+        run_id: int | None = None,
+        status: str | None = None,
+        start_node_id: str | None = None,
+        current_node_id: str | None = None,
+        limit: int | None = None,
+        order_by: str | None = None,
+    ) -> list[FlowRun]:
+        query, params = FlowRun._build_query(
+            run_id, status, start_node_id, current_node_id, limit, order_by
+        )
+        async with acursor() as cur:
+            await cur.execute(query, params)
+            rows = await cur.fetchall()
+
+            return [FlowRun(*row) for row in rows]
+
     def update_node(self, current_node_id: str, status: str | None) -> None:
         new_status = status if status is not None else self.status
         with conn.cursor() as cur:
             cur.execute(
                 "UPDATE flow_runs SET current_node_id = %s, status = %s WHERE id = %s",
-                (current_node_id, status, self.id),
+                (current_node_id, new_status, self.id),
+            )
+        self.current_node_id = current_node_id
+        self.status = new_status
+
+    async def aupdate_node(self, current_node_id: str, status: str | None) -> None:
+        new_status = status if status is not None else self.status
+        async with acursor() as cur:
+            await cur.execute(
+                "UPDATE flow_runs SET current_node_id = %s, status = %s WHERE id = %s",
+                (current_node_id, new_status, self.id),
             )
         self.current_node_id = current_node_id
         self.status = new_status
@@ -112,4 +242,5 @@ class FlowRun:
             current_node_id=self.current_node_id,
             started_at=self.started_at,
             status=self.status,
+            priority=self.priority,
         )
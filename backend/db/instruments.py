@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from backend.db.node_runs import NodeRun
 from backend.db.conn import conn
+from backend.db.pool import acursor
 import datetime as dt
 
 
@@ -35,6 +36,13 @@ class Instrument:
             row = cur.fetchone()
             return cls(*row)
 
+    @classmethod
+    async def afetch_from_id(cls, id: int) -> Instrument:
+        async with acursor() as cur:
+            await cur.execute("SELECT * FROM instruments WHERE id = %s", (id,))
+            row = await cur.fetchone()
+            return cls(*row)
+
     @classmethod
     def fetch_all(cls) -> list[Instrument]:
         with conn.cursor() as cur:
@@ -42,6 +50,13 @@ class Instrument:
             rows = cur.fetchall()
             return [cls(*row) for row in rows]
 
+    @classmethod
+    async def afetch_all(cls) -> list[Instrument]:
+        async with acursor() as cur:
+            await cur.execute("SELECT * FROM instruments")
+            rows = await cur.fetchall()
+            return [cls(*row) for row in rows]
+
     @classmethod
     def create(
         cls,
@@ -51,7 +66,7 @@ class Instrument:
     ) -> Instrument:
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO instruments (name, type, connection_method, created_at, updated_at, enabled) "
+                "INSERT INTO instruments (name, type, connection_method, created_at, updated_at) "
                 "VALUES (%s, %s, %s, %s, %s) "
                 "RETURNING id, name, type, connection_method, connection_info, in_use_by, created_at, updated_at, enabled",
                 (
@@ -85,6 +100,28 @@ class Instrument:
                 enabled,
             )
 
+    @classmethod
+    async def acreate(
+        cls,
+        name: str = "xpeel_1",
+        type: str = "xpeel",
+        connection_method: str = "serial",
+    ) -> Instrument:
+        async with acursor() as cur:
+            await cur.execute(
+                "INSERT INTO instruments (name, type, connection_method, created_at, updated_at) "
+                "VALUES (%s, %s, %s, %s, %s) "
+                "RETURNING id, name, type, connection_method, connection_info, in_use_by, created_at, updated_at, enabled",
+                (
+                    name,
+                    type,
+                    connection_method,
+                    f"{dt.datetime.now()}",
+                    f"{dt.datetime.now()}",
+                ),
+            )
+            return cls(*(await cur.fetchone()))
+
     def set_in_use_by(self, node_run_id: int | None, node_run: NodeRun | None = None):
         if node_run is not None:
             node_run_id = node_run.id
@@ -95,8 +132,27 @@ class Instrument:
                 (node_run_id, self.id),
             )
 
+    async def aset_in_use_by(
+        self, node_run_id: int | None, node_run: NodeRun | None = None
+    ):
+        if node_run is not None:
+            node_run_id = node_run.id
+
+        async with acursor() as cur:
+            await cur.execute(
+                "UPDATE instruments SET in_use_by = %s WHERE id = %s",
+                (node_run_id, self.id),
+            )
+        self.in_use_by = node_run_id
+
     def get_user(self) -> NodeRun | None:
         if self.in_use_by is None:
             return None
 
         return NodeRun.fetch_from_id(self.in_use_by)
+
+    async def aget_user(self) -> NodeRun | None:
+        if self.in_use_by is None:
+            return None
+
+        return await NodeRun.afetch_from_id(self.in_use_by)
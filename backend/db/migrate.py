@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import argparse
+import logging
+import re
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from psycopg import Connection
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+# Migrations starting with this line run outside a transaction, one statement at a time
+# (needed for e.g. CREATE INDEX CONCURRENTLY)
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+# Arbitrary key for the advisory lock that keeps two processes from migrating at once
+MIGRATION_LOCK_KEY = 7_211_001
+
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d+)_(\w+)\.sql$")
+# Name of the index a statement builds concurrently, if it does
+CONCURRENT_INDEX_PATTERN = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)",
+    re.IGNORECASE,
+)
+
+
+class Migration:
+    def __init__(self, version: int, name: str, path: Path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    @property
+    def sql(self) -> str:
+        return self.path.read_text()
+
+    @property
+    def no_transaction(self) -> bool:
+        return self.sql.startswith(NO_TRANSACTION_MARKER)
+
+    def statements(self) -> list[str]:
+        """
+        Split the migration into statements. Only used for no-transaction migrations,
+        which must not contain semicolons other than statement terminators.
+        """
+        return [stmt.strip() for stmt in self.sql.split(";") if _has_code(stmt)]
+
+    def __repr__(self) -> str:
+        return f"<Migration {self.version:04d}_{self.name}>"
+
+
+def _has_code(sql: str) -> bool:
+    return any(
+        line.strip() and not line.strip().startswith("--") for line in sql.splitlines()
+    )
+
+
+def drop_invalid_index(connection: Connection, statement: str) -> None:
+    """
+    If `statement` builds an index concurrently and a failed earlier build left that index INVALID, drop it, so the
+    statement builds it again instead of skipping it because it exists.
+
+    :param connection: Autocommit connection to the database
+    :param statement: Statement of a no-transaction migration
+    """
+    match = CONCURRENT_INDEX_PATTERN.search(statement)
+    if match is None:
+        return
+    index = match.group(1)
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)",
+            (index,),
+        )
+        row = cur.fetchone()
+        if row is not None and row[0]:
+            logger.warning(f"Dropping invalid index {index} left by a failed build")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+
+
+def load_migrations() -> list[Migration]:
+    migrations = []
+    for path in MIGRATIONS_DIR.iterdir():
+        match = MIGRATION_FILE_PATTERN.match(path.name)
+        if match is None:
+            continue
+        migrations.append(Migration(int(match.group(1)), match.group(2), path))
+
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {MIGRATIONS_DIR}")
+    return migrations
+
+
+def applied_versions(connection: Connection) -> set[int]:
+    with connection.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations
+            (
+                version    INTEGER PRIMARY KEY,
+                name       TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT NOW()
+            )
+            """
+        )
+        cur.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cur.fetchall()}
+
+
+def migrate(connection: Connection, target: int | None = None) -> list[Migration]:
+    """
+    Apply all pending migrations up to and including `target` (all if None).
+
+    :param connection: Autocommit connection to the database
+    :param target: Highest migration version to apply
+    :return: Migrations that were applied
+    """
+    applied = []
+    with connection.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+    try:
+        done = applied_versions(connection)
+        for migration in load_migrations():
+            if migration.version in done:
+                continue
+            if target is not None and migration.version > target:
+                break
+
+            logger.info(f"Applying migration {migration}")
+            if migration.no_transaction:
+                with connection.cursor() as cur:
+                    for statement in migration.statements():
+                        drop_invalid_index(connection, statement)
+                        cur.execute(statement)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (migration.version, migration.name),
+                    )
+            else:
+                with connection.transaction(), connection.cursor() as cur:
+                    cur.execute(migration.sql)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (migration.version, migration.name),
+                    )
+            applied.append(migration)
+    finally:
+        with connection.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+
+    if applied:
+        logger.info(f"Applied {len(applied)} migration(s)")
+    else:
+        logger.info("Database schema is up to date")
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply database migrations")
+    parser.add_argument("--target", type=int, help="Highest migration version to apply")
+    parser.add_argument(
+        "--status", action="store_true", help="List migrations and exit"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from backend.db.conn import conn
+
+    if args.status:
+        done = applied_versions(conn)
+        for migration in load_migrations():
+            state = "applied" if migration.version in done else "pending"
+            print(f"{migration.version:04d}_{migration.name}: {state}")
+        return
+
+    migrate(conn, args.target)
+
+
+if __name__ == "__main__":
+    main()
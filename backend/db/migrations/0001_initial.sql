@@ -1,13 +1,21 @@
-CREATE TYPE run_status AS ENUM (
-    'in-progress',
-    'waiting',
-    'completed',
-    'failed',
-    'paused'
-    );
+-- Initial schema. Written to be safe against databases created before migrations existed.
+DO
+$$
+    BEGIN
+        CREATE TYPE run_status AS ENUM (
+            'in-progress',
+            'waiting',
+            'completed',
+            'failed',
+            'paused'
+            );
+    EXCEPTION
+        WHEN duplicate_object THEN NULL;
+    END
+$$;
 
 -- Flow Runs
-CREATE TABLE flow_runs
+CREATE TABLE IF NOT EXISTS flow_runs
 (
     id                 SERIAL PRIMARY KEY,
     name               TEXT       NOT NULL,
@@ -18,7 +26,7 @@ CREATE TABLE flow_runs
 );
 
 -- Node Runs
-CREATE TABLE node_runs
+CREATE TABLE IF NOT EXISTS node_runs
 (
     id          SERIAL PRIMARY KEY,
     flow_run_id INTEGER    NOT NULL REFERENCES flow_runs (id),
@@ -31,21 +39,21 @@ CREATE TABLE node_runs
 );
 
 -- Instruments
-CREATE TABLE instruments
+CREATE TABLE IF NOT EXISTS instruments
 (
     id                SERIAL PRIMARY KEY,
     name              TEXT NOT NULL,
     type              TEXT NOT NULL,
-    enabled           BOOLEAN DEFAULT FALSE,
     connection_method TEXT NOT NULL,
     connection_info   JSONB,
     in_use_by         INTEGER REFERENCES node_runs (id),
     created_at        TEXT NOT NULL,
-    updated_at        TIMESTAMP DEFAULT NOW()
+    updated_at        TIMESTAMP DEFAULT NOW(),
+    enabled           BOOLEAN DEFAULT FALSE
 );
 
 -- Plate Locations
-CREATE TABLE plate_locations
+CREATE TABLE IF NOT EXISTS plate_locations
 (
     id            TEXT UNIQUE PRIMARY KEY,
     type          TEXT, -- e.g. instrument, hotel, plate_holder, etc.
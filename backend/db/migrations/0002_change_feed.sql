@@ -0,0 +1,62 @@
+-- Change feed: NOTIFY on state transitions, consumed by backend/db/change_feed.py
+CREATE OR REPLACE FUNCTION notify_instrument_change() RETURNS trigger AS
+$$
+BEGIN
+    PERFORM pg_notify('instruments_changed',
+                      json_build_object('id', NEW.id, 'in_use_by', NEW.in_use_by)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_node_run_change() RETURNS trigger AS
+$$
+BEGIN
+    PERFORM pg_notify('node_runs_changed',
+                      json_build_object('id', NEW.id, 'flow_run_id', NEW.flow_run_id, 'node_id', NEW.node_id,
+                                        'status', NEW.status)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_flow_run_change() RETURNS trigger AS
+$$
+BEGIN
+    PERFORM pg_notify('flow_runs_changed',
+                      json_build_object('id', NEW.id, 'current_node_id', NEW.current_node_id,
+                                        'status', NEW.status)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER instruments_notify
+    AFTER UPDATE OF in_use_by
+    ON instruments
+    FOR EACH ROW
+    WHEN (OLD.in_use_by IS DISTINCT FROM NEW.in_use_by)
+EXECUTE FUNCTION notify_instrument_change();
+
+CREATE OR REPLACE TRIGGER node_runs_notify_insert
+    AFTER INSERT
+    ON node_runs
+    FOR EACH ROW
+EXECUTE FUNCTION notify_node_run_change();
+
+CREATE OR REPLACE TRIGGER node_runs_notify_update
+    AFTER UPDATE OF status
+    ON node_runs
+    FOR EACH ROW
+    WHEN (OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION notify_node_run_change();
+
+CREATE OR REPLACE TRIGGER flow_runs_notify_insert
+    AFTER INSERT
+    ON flow_runs
+    FOR EACH ROW
+EXECUTE FUNCTION notify_flow_run_change();
+
+CREATE OR REPLACE TRIGGER flow_runs_notify_update
+    AFTER UPDATE OF current_node_id, status
+    ON flow_runs
+    FOR EACH ROW
+    WHEN (OLD.current_node_id IS DISTINCT FROM NEW.current_node_id OR OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION notify_flow_run_change();
@@ -0,0 +1,24 @@
+-- migrate: no-transaction
+-- Indexes for the queries run on every node. Built concurrently so a large node_runs table stays writable.
+
+-- NodeRun.fetch_from_flowrun_and_node: WHERE flow_run_id = ? AND node_id = ? ORDER BY id DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS node_runs_flow_run_node_idx
+    ON node_runs (flow_run_id, node_id, id DESC);
+
+-- Node runs that are still queued or running (change feed resync, dashboards)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS node_runs_active_idx
+    ON node_runs (flow_run_id)
+    WHERE status IN ('waiting', 'in-progress');
+
+-- FlowRun.query(status=...)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS flow_runs_status_idx
+    ON flow_runs (status, id DESC);
+
+-- Flow runs that haven't finished (GetRunningFlows, change feed resync)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS flow_runs_active_idx
+    ON flow_runs (id DESC)
+    WHERE status IN ('waiting', 'in-progress', 'paused');
+
+-- PlateLocation.fetch_from_instrument_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS plate_locations_instrument_idx
+    ON plate_locations (instrument_id);
@@ -0,0 +1,5 @@
+-- Scheduling hints for a flow run's nodes, see backend/dispatcher.py.
+-- Higher priority is more urgent; the deadline is when its nodes should be admitted to their instruments by.
+ALTER TABLE flow_runs
+    ADD COLUMN IF NOT EXISTS priority INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS deadline TIMESTAMPTZ;
@@ -0,0 +1,7 @@
+-- NodeRun inputs and outputs larger than PAYLOAD_BLOB_THRESHOLD are kept in the blob store (backend/db/blobs.py):
+-- the row holds the blob's digest instead of the JSON. The size is that of the JSON, wherever it's stored.
+ALTER TABLE node_runs
+    ADD COLUMN IF NOT EXISTS input_ref   TEXT,
+    ADD COLUMN IF NOT EXISTS input_size  INTEGER,
+    ADD COLUMN IF NOT EXISTS output_ref  TEXT,
+    ADD COLUMN IF NOT EXISTS output_size INTEGER;
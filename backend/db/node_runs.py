@@ -1,13 +1,36 @@
 from __future__ import annotations
 
+import asyncio
 import datetime
 import json
+from typing import TYPE_CHECKING, Any
 from psycopg.types.json import Jsonb
 
+from backend.db.blobs import Payload, load_payload
 from backend.db.conn import conn
+from backend.db.pool import acursor
+from backend.db.write_behind import write_behind
+
+if TYPE_CHECKING:
+    from backend.db.flow_runs import FlowRun
+
+# Every column but the payloads, which are loaded when they're first used
+NODE_RUN_SUMMARY_COLUMNS = (
+    "id, flow_run_id, node_id, started_at, finished_at, status, "
+    "input_ref, input_size, output_ref, output_size"
+)
+
+# An input or output that hasn't been loaded yet
+_UNLOADED = object()
 
 
 class NodeRun:
+    """
+    A run of a node. Its input and output are JSON payloads: small ones are kept in node_runs, larger ones in the
+    blob store (see Payload), and either way they're only loaded when first used: `aload_input()` /
+    `aload_output()` load them off the event loop, and `input_data` / `output_data` only return them once loaded.
+    """
+
     def __init__(
         self,
         _id: int,
@@ -18,28 +41,110 @@ class NodeRun:
         started_at: datetime.datetime,
         finished_at: datetime.datetime,
         status: str,
+        input_ref: str | None = None,
+        input_size: int | None = None,
+        output_ref: str | None = None,
+        output_size: int | None = None,
     ):
         self.id = _id
         self.flow_run_id = flow_run_id
         self.node_id = node_id
-        self.input_data = input_data
-        self.output_data = output_data
         self.started_at = started_at
         self.finished_at = finished_at
         self.status = status
+        # Digests of the payloads stored as blobs, and the sizes of their JSON
+        self.input_ref = input_ref
+        self.input_size = input_size
+        self.output_ref = output_ref
+        self.output_size = output_size
+        self._input_data = _UNLOADED if input_ref is not None else input_data
+        self._output_data = _UNLOADED if output_ref is not None else output_data
+
+    @classmethod
+    def _from_summary(cls, row) -> NodeRun:
+        # A row of NODE_RUN_SUMMARY_COLUMNS
+        return cls(row[0], row[1], row[2], _UNLOADED, _UNLOADED, *row[3:])
+
+    @property
+    def input_data(self) -> Any:
+        """
+        :raises RuntimeError: if the input hasn't been loaded yet; load it with `aload_input()`
+        """
+        if self._input_data is _UNLOADED:
+            raise RuntimeError(
+                f"Input of NodeRun {self.id} isn't loaded, use `await aload_input()`"
+            )
+        return self._input_data
+
+    @input_data.setter
+    def input_data(self, input_data: Any) -> None:
+        self._input_data = input_data
+
+    @property
+    def output_data(self) -> Any:
+        """
+        :raises RuntimeError: if the output hasn't been loaded yet; load it with `aload_output()`
+        """
+        if self._output_data is _UNLOADED:
+            raise RuntimeError(
+                f"Output of NodeRun {self.id} isn't loaded, use `await aload_output()`"
+            )
+        return self._output_data
+
+    @output_data.setter
+    def output_data(self, output_data: Any) -> None:
+        self._output_data = output_data
+
+    async def aload_input(self) -> Any:
+        if self._input_data is _UNLOADED:
+            self._input_data = await self._aload("input", self.input_ref)
+        return self._input_data
+
+    async def aload_output(self) -> Any:
+        if self._output_data is _UNLOADED:
+            self._output_data = await self._aload("output", self.output_ref)
+        return self._output_data
+
+    async def _aload(self, kind: str, ref: str | None) -> Any:
+        if ref is not None:
+            return await asyncio.to_thread(load_payload, ref)
+        async with acursor() as cur:
+            await cur.execute(
+                f"SELECT {kind}_data FROM node_runs WHERE id = %s", (self.id,)
+            )
+            return (await cur.fetchone())[0]
+
+    def _set_output(self, payload: Payload) -> None:
+        self._output_data = payload.data
+        self.output_ref = payload.ref
+        self.output_size = payload.size
 
     @classmethod
     def fetch_from_id(cls, id: int) -> NodeRun:
         with conn.cursor() as cur:
-            cur.execute("SELECT * FROM node_runs WHERE id = %s", (id,))
+            cur.execute(
+                f"SELECT {NODE_RUN_SUMMARY_COLUMNS} FROM node_runs WHERE id = %s",
+                (id,),
+            )
             row = cur.fetchone()
-            return cls(*row)
+            return cls._from_summary(row)
+
+    @classmethod
+    async def afetch_from_id(cls, id: int) -> NodeRun:
+        async with acursor() as cur:
+            await cur.execute(
+                f"SELECT {NODE_RUN_SUMMARY_COLUMNS} FROM node_runs WHERE id = %s",
+                (id,),
+            )
+            row = await cur.fetchone()
+            return cls._from_summary(row)
 
     @classmethod
     def fetch_from_flowrun_and_node(cls, flow_run_id: int, node_id: str) -> NodeRun:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT * FROM node_runs WHERE flow_run_id = %s AND node_id = %s "
+                f"SELECT {NODE_RUN_SUMMARY_COLUMNS} FROM node_runs "
+                "WHERE flow_run_id = %s AND node_id = %s "
                 # get newest if there are multiple
                 "ORDER BY id DESC",
                 (flow_run_id, node_id),
@@ -47,24 +152,68 @@ class NodeRun:
             row = cur.fetchone()
             if row is None:
                 return None
-            return cls(*row)
+            return cls._from_summary(row)
+
+    @classmethod
+    async def afetch_from_flowrun_and_node(
+        cls, flow_run_id: int, node_id: str
+    ) -> NodeRun | None:
+        async with acursor() as cur:
+            await cur.execute(
+                f"SELECT {NODE_RUN_SUMMARY_COLUMNS} FROM node_runs "
+                "WHERE flow_run_id = %s AND node_id = %s "
+                # get newest if there are multiple
+                "ORDER BY id DESC",
+                (flow_run_id, node_id),
+            )
+            row = await cur.fetchone()
+            if row is None:
+                return None
+            return cls._from_summary(row)
 
     @classmethod
     def create(cls, flow_run_id: int, node_id: str, input_data=None) -> NodeRun:
         if input_data is None:
             input_data = {}
+        payload = Payload(input_data).store()
 
         with conn.cursor() as cur:
             cur.execute(
-                """
-                INSERT INTO node_runs (flow_run_id, node_id, input_data)
-                VALUES (%s, %s, %s)
-                RETURNING *
+                f"""
+                INSERT INTO node_runs (flow_run_id, node_id, input_data, input_ref, input_size)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING {NODE_RUN_SUMMARY_COLUMNS}
                 """,
-                (flow_run_id, node_id, Jsonb(input_data)),
+                (flow_run_id, node_id, _jsonb(payload), payload.ref, payload.size),
             )
             row = cur.fetchone()
-            return cls(*row)
+        return cls._created(row, payload)
+
+    @classmethod
+    async def acreate(cls, flow_run_id: int, node_id: str, input_data=None) -> NodeRun:
+        if input_data is None:
+            input_data = {}
+        payload = await Payload(input_data).astore()
+
+        async with acursor() as cur:
+            await cur.execute(
+                f"""
+                INSERT INTO node_runs (flow_run_id, node_id, input_data, input_ref, input_size)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING {NODE_RUN_SUMMARY_COLUMNS}
+                """,
+                (flow_run_id, node_id, _jsonb(payload), payload.ref, payload.size),
+            )
+            row = await cur.fetchone()
+        return cls._created(row, payload)
+
+    @classmethod
+    def _created(cls, row, input_payload: Payload) -> NodeRun:
+        # The new row's payloads are known; don't read them back
+        noderun = cls._from_summary(row)
+        noderun.input_data = input_payload.data
+        noderun.output_data = None
+        return noderun
 
     def set_status(self, status: str) -> None:
         # if status is "completed", set finished_at to now
@@ -77,13 +226,240 @@ class NodeRun:
                 (status, self.finished_at, self.id),
             )
 
+    async def aset_status(self, status: str) -> None:
+        if status == "completed":
+            raise ValueError("Use acomplete() method to set status to completed")
+
+        async with acursor() as cur:
+            await cur.execute(
+                "UPDATE node_runs SET status = %s, finished_at = %s WHERE id = %s",
+                (status, self.finished_at, self.id),
+            )
+        self.status = status
+
     def complete(self, output_data: dict | None = None) -> None:
-        self.output_data = output_data
+        payload = Payload(output_data).store()
+        self._set_output(payload)
         self.status = "completed"
         self.finished_at = datetime.datetime.now()
 
         with conn.cursor() as cur:
             cur.execute(
-                "UPDATE node_runs SET status = %s, output_data = %s, finished_at = NOW() WHERE id = %s",
-                ("completed", Jsonb(output_data), self.id),
+                "UPDATE node_runs SET status = %s, output_data = %s, output_ref = %s, output_size = %s, "
+                "finished_at = NOW() WHERE id = %s",
+                ("completed", _jsonb(payload), payload.ref, payload.size, self.id),
+            )
+
+    async def acomplete(self, output_data: dict | None = None) -> None:
+        payload = await Payload(output_data).astore()
+        self._set_output(payload)
+        self.status = "completed"
+        self.finished_at = datetime.datetime.now()
+
+        async with acursor() as cur:
+            await cur.execute(
+                "UPDATE node_runs SET status = %s, output_data = %s, output_ref = %s, output_size = %s, "
+                "finished_at = NOW() WHERE id = %s",
+                ("completed", _jsonb(payload), payload.ref, payload.size, self.id),
+            )
+
+    # State transitions used by the orchestrator. Each one is a single statement, so a node's state
+    # (node_runs, flow_runs and instruments) is consistent even if the process dies in between.
+
+    @classmethod
+    async def aenqueue(cls, flowrun: FlowRun, node_id: str, input_data=None) -> NodeRun:
+        """
+        Create a waiting NodeRun and point its FlowRun at it.
+        """
+        if input_data is None:
+            input_data = {}
+        payload = await Payload(input_data).astore()
+
+        async with acursor() as cur:
+            await cur.execute(
+                f"""
+                WITH fr AS (
+                    UPDATE flow_runs SET current_node_id = %s, status = 'waiting' WHERE id = %s
+                )
+                INSERT INTO node_runs (flow_run_id, node_id, input_data, input_ref, input_size, status)
+                VALUES (%s, %s, %s, %s, %s, 'waiting')
+                RETURNING {NODE_RUN_SUMMARY_COLUMNS}
+                """,
+                (
+                    node_id,
+                    flowrun.id,
+                    flowrun.id,
+                    node_id,
+                    _jsonb(payload),
+                    payload.ref,
+                    payload.size,
+                ),
+            )
+            row = await cur.fetchone()
+        flowrun.current_node_id = node_id
+        flowrun.status = "waiting"
+        return cls._created(row, payload)
+
+    async def arequeue(self, flowrun: FlowRun) -> None:
+        """
+        Put an existing, unfinished NodeRun back into the waiting state and point its FlowRun at it.
+        """
+        async with acursor() as cur:
+            await cur.execute(
+                """
+                WITH fr AS (
+                    UPDATE flow_runs SET current_node_id = %s, status = 'waiting' WHERE id = %s
+                )
+                UPDATE node_runs SET status = 'waiting' WHERE id = %s
+                """,
+                (self.node_id, flowrun.id, self.id),
+            )
+        self.status = "waiting"
+        flowrun.current_node_id = self.node_id
+        flowrun.status = "waiting"
+
+    async def aadmit(
+        self,
+        flowrun: FlowRun,
+        instrument_id: int | None,
+        plate_location_ids: list[str] | None = None,
+    ) -> None:
+        """
+        Mark the NodeRun (and its FlowRun) in-progress and record it as the user of the instrument and of the plate
+        locations it reserved. With write-behind enabled, the update is buffered instead of written immediately.
+
+        `instrument_id` is None for NodeRuns that share the instrument; they aren't recorded as its user.
+        """
+        plate_location_ids = sorted(plate_location_ids or [])
+        self.status = "in-progress"
+        flowrun.current_node_id = self.node_id
+        flowrun.status = "in-progress"
+
+        if write_behind.enabled:
+            write_behind.stage_node_run(self.id, "in-progress")
+            write_behind.stage_flow_run(flowrun.id, self.node_id, "in-progress")
+            if instrument_id is not None:
+                write_behind.stage_instrument(instrument_id, self.id)
+            write_behind.stage_plate_locations(plate_location_ids, self.id)
+            return
+
+        async with acursor() as cur:
+            await cur.execute(
+                """
+                WITH nr AS (
+                    UPDATE node_runs SET status = 'in-progress' WHERE id = %s
+                ),
+                fr AS (
+                    UPDATE flow_runs SET current_node_id = %s, status = 'in-progress' WHERE id = %s
+                ),
+                pl AS (
+                    -- lock the rows in id order, so concurrent admissions can't deadlock in the database
+                    UPDATE plate_locations SET in_use_by = %s
+                    WHERE id IN (SELECT id FROM plate_locations WHERE id = ANY(%s) ORDER BY id FOR UPDATE)
+                )
+                -- no row when instrument_id is NULL
+                UPDATE instruments SET in_use_by = %s WHERE id = %s
+                """,
+                (
+                    self.id,
+                    self.node_id,
+                    flowrun.id,
+                    self.id,
+                    plate_location_ids,
+                    self.id,
+                    instrument_id,
+                ),
+            )
+
+    async def afinish(
+        self,
+        flowrun: FlowRun,
+        instrument_id: int,
+        output_data: dict | None = None,
+        flow_completed: bool = False,
+        plate_location_ids: list[str] | None = None,
+    ) -> None:
+        """
+        Complete the NodeRun with `output_data`, release the instrument and plate locations and update the FlowRun
+        (marking it completed if `flow_completed`). Never buffered.
+        """
+        flow_status = "completed" if flow_completed else "in-progress"
+        write_behind.discard(self.id, flowrun.id, self.node_id, instrument_id)
+        payload = await Payload(output_data).astore()
+
+        async with acursor() as cur:
+            await cur.execute(
+                """
+                WITH nr AS (
+                    UPDATE node_runs
+                    SET status = 'completed', output_data = %s, output_ref = %s, output_size = %s,
+                        finished_at = NOW()
+                    WHERE id = %s
+                ),
+                fr AS (
+                    UPDATE flow_runs SET current_node_id = %s, status = %s WHERE id = %s
+                ),
+                pl AS (
+                    UPDATE plate_locations SET in_use_by = NULL WHERE id = ANY(%s) AND in_use_by = %s
+                )
+                UPDATE instruments SET in_use_by = NULL WHERE id = %s AND in_use_by = %s
+                """,
+                (
+                    _jsonb(payload),
+                    payload.ref,
+                    payload.size,
+                    self.id,
+                    self.node_id,
+                    flow_status,
+                    flowrun.id,
+                    sorted(plate_location_ids or []),
+                    self.id,
+                    instrument_id,
+                    self.id,
+                ),
             )
+        self._set_output(payload)
+        self.status = "completed"
+        self.finished_at = datetime.datetime.now()
+        flowrun.current_node_id = self.node_id
+        flowrun.status = flow_status
+
+    async def afail(
+        self, instrument_id: int, plate_location_ids: list[str] | None = None
+    ) -> None:
+        """
+        Mark the NodeRun failed and release the instrument and plate locations. Never buffered.
+        """
+        write_behind.discard(self.id, self.flow_run_id, self.node_id, instrument_id)
+
+        async with acursor() as cur:
+            await cur.execute(
+                """
+                WITH nr AS (
+                    UPDATE node_runs SET status = 'failed', finished_at = NOW() WHERE id = %s
+                ),
+                pl AS (
+                    UPDATE plate_locations SET in_use_by = NULL WHERE id = ANY(%s) AND in_use_by = %s
+                )
+                UPDATE instruments SET in_use_by = NULL WHERE id = %s AND in_use_by = %s
+                """,
+                (
+                    self.id,
+                    sorted(plate_location_ids or []),
+                    self.id,
+                    instrument_id,
+                    self.id,
+                ),
+            )
+        self.status = "failed"
+        self.finished_at = datetime.datetime.now()
+
+
+def _jsonb(payload: Payload) -> Jsonb | None:
+    """
+    Value of a payload's JSONB column: None when it's stored as a blob.
+    """
+    if payload.offloaded:
+        return None
+    # Already encoded; don't encode it again
+    return Jsonb(payload.data, dumps=lambda _: payload.encoded)
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from backend.db.node_runs import NodeRun
 from backend.db.conn import conn
+from backend.db.pool import acursor
 
 import uuid
 
@@ -35,6 +36,16 @@ class PlateLocation:
             rows = cur.fetchall()
             return [cls(*row) for row in rows]
 
+    @classmethod
+    async def afetch_from_ids(cls, ids: list[str]) -> list[PlateLocation]:
+        async with acursor() as cur:
+            await cur.execute(
+                "SELECT * FROM plate_locations WHERE id = ANY(%s)",
+                (ids,),
+            )
+            rows = await cur.fetchall()
+            return [cls(*row) for row in rows]
+
     @classmethod
     def fetch_from_instrument_id(cls, instrument_id: int) -> list[PlateLocation]:
         with conn.cursor() as cur:
@@ -45,6 +56,16 @@ class PlateLocation:
             rows = cur.fetchall()
             return [cls(*row) for row in rows]
 
+    @classmethod
+    async def afetch_from_instrument_id(cls, instrument_id: int) -> list[PlateLocation]:
+        async with acursor() as cur:
+            await cur.execute(
+                "SELECT * FROM plate_locations WHERE instrument_id = %s",
+                (instrument_id,),
+            )
+            rows = await cur.fetchall()
+            return [cls(*row) for row in rows]
+
     @classmethod
     def create(
         cls, instrument_id: int, x_capacity: int = 1, y_capacity: int = 1
@@ -70,6 +91,20 @@ class PlateLocation:
                 y_capacity,
             )
 
+    @classmethod
+    async def acreate(
+        cls, instrument_id: int, x_capacity: int = 1, y_capacity: int = 1
+    ) -> PlateLocation:
+        async with acursor() as cur:
+            new_id = str(uuid.uuid4())
+            await cur.execute(
+                "INSERT INTO plate_locations (id, instrument_id, x_capacity, y_capacity) "
+                "VALUES (%s, %s, %s, %s) "
+                "RETURNING id, type, in_use_by, instrument_id, parent_id, x_capacity, y_capacity",
+                (new_id, instrument_id, x_capacity, y_capacity),
+            )
+            return cls(*(await cur.fetchone()))
+
     def set_in_use_by(self, node_run_id: int | None, node_run: NodeRun | None = None):
         if node_run is not None:
             node_run_id = node_run.id
@@ -80,6 +115,19 @@ class PlateLocation:
                 (node_run_id, self.id),
             )
 
+    async def aset_in_use_by(
+        self, node_run_id: int | None, node_run: NodeRun | None = None
+    ):
+        if node_run is not None:
+            node_run_id = node_run.id
+
+        async with acursor() as cur:
+            await cur.execute(
+                "UPDATE plate_locations SET in_use_by = %s WHERE id = %s",
+                (node_run_id, self.id),
+            )
+        self.in_use_by = node_run_id
+
     @staticmethod
     def set_in_use_by_many(
         plate_locations: list[PlateLocation], node_run_id: int | None, node_run: NodeRun
@@ -93,12 +141,33 @@ class PlateLocation:
                 (node_run.id, [pl.id for pl in plate_locations]),
             )
 
+    @staticmethod
+    async def aset_in_use_by_many(
+        plate_locations: list[PlateLocation],
+        node_run_id: int | None,
+        node_run: NodeRun | None = None,
+    ):
+        if node_run is not None:
+            node_run_id = node_run.id
+
+        async with acursor() as cur:
+            await cur.execute(
+                "UPDATE plate_locations SET in_use_by = %s WHERE id = ANY(%s)",
+                (node_run_id, [pl.id for pl in plate_locations]),
+            )
+
     def get_user(self) -> NodeRun | None:
         if self.in_use_by is None:
             return None
 
         return NodeRun.fetch_from_id(self.in_use_by)
 
+    async def aget_user(self) -> NodeRun | None:
+        if self.in_use_by is None:
+            return None
+
+        return await NodeRun.afetch_from_id(self.in_use_by)
+
 
 class PlateLocationWithNodeRunStatus(PlateLocation):
     def __init__(
@@ -131,3 +200,20 @@ class PlateLocationWithNodeRunStatus(PlateLocation):
             )
             rows = cur.fetchall()
             return [cls(*row) for row in rows]
+
+    @classmethod
+    async def afetch_from_ids(
+        cls, ids: list[str]
+    ) -> list[PlateLocationWithNodeRunStatus]:
+        async with acursor() as cur:
+            await cur.execute(
+                """
+                SELECT pl.*, nr.status
+                FROM plate_locations pl
+                LEFT JOIN node_runs nr ON pl.id = nr.node_id
+                WHERE pl.id = ANY(%s)
+                """,
+                (ids,),
+            )
+            rows = await cur.fetchall()
+            return [cls(*row) for row in rows]
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from os import getenv
+from typing import AsyncIterator
+
+from psycopg import AsyncCursor
+from psycopg_pool import AsyncConnectionPool
+
+from backend.db.conn import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Pool sizing and timeouts, configurable through the environment
+DB_POOL_MIN_SIZE = int(getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(getenv("DB_POOL_MAX_SIZE", "10"))
+# Seconds to wait for a free connection from the pool
+DB_POOL_TIMEOUT = float(getenv("DB_POOL_TIMEOUT", "30"))
+# Seconds a single query may run before it is cancelled
+DB_QUERY_TIMEOUT = float(getenv("DB_QUERY_TIMEOUT", "10"))
+
+pool = AsyncConnectionPool(
+    DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    kwargs={
+        "autocommit": True,
+        # Server-side guard, in case a query outlives the client-side timeout
+        "options": f"-c statement_timeout={int(DB_QUERY_TIMEOUT * 1000)}",
+    },
+    open=False,
+)
+
+
+async def open_pool() -> None:
+    """
+    Open the connection pool and wait until `DB_POOL_MIN_SIZE` connections are ready.
+    Must be called from the running event loop before any async model method is used.
+    """
+    logger.info(
+        f"Opening database pool (min_size={DB_POOL_MIN_SIZE}, max_size={DB_POOL_MAX_SIZE})"
+    )
+    await pool.open(wait=True)
+    logger.info("Database pool open")
+
+
+async def close_pool() -> None:
+    await pool.close()
+    logger.info("Database pool closed")
+
+
+@asynccontextmanager
+async def acursor(timeout: float | None = None) -> AsyncIterator[AsyncCursor]:
+    """
+    Borrow a connection from the pool and open a cursor on it.
+
+    Everything executed inside the block shares one connection. Connections are in autocommit mode, so use
+    `async with cur.connection.transaction()` to group statements.
+
+    :param timeout: Seconds the block may run once it has a connection before it is cancelled.
+        Defaults to `DB_QUERY_TIMEOUT`. Waiting for a connection is bounded by `DB_POOL_TIMEOUT`.
+    """
+    async with pool.connection() as aconn:
+        async with aconn.cursor() as cur:
+            async with asyncio.timeout(
+                timeout if timeout is not None else DB_QUERY_TIMEOUT
+            ):
+                yield cur
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from os import getenv
+
+from backend.db.pool import acursor
+
+logger = logging.getLogger(__name__)
+
+# Set DB_WRITE_BEHIND=1 to coalesce status updates in memory and flush them in batches
+DB_WRITE_BEHIND = getenv("DB_WRITE_BEHIND", "0") == "1"
+# Seconds between flushes
+DB_WRITE_BEHIND_INTERVAL = float(getenv("DB_WRITE_BEHIND_INTERVAL", "0.5"))
+
+FLUSH_QUERY = """
+WITH nr AS (
+    UPDATE node_runs
+    SET status = v.status::run_status
+    FROM unnest(%s::int[], %s::text[]) AS v(id, status)
+    WHERE node_runs.id = v.id
+      -- don't revive a NodeRun that already finished
+      AND node_runs.status NOT IN ('completed', 'failed')
+),
+fr AS (
+    UPDATE flow_runs
+    SET current_node_id = v.current_node_id,
+        status          = v.status::run_status
+    FROM unnest(%s::int[], %s::text[], %s::text[]) AS v(id, current_node_id, status)
+    WHERE flow_runs.id = v.id
+      -- don't reopen a FlowRun that already completed
+      AND flow_runs.status <> 'completed'
+),
+pl AS (
+    UPDATE plate_locations
+    SET in_use_by = v.in_use_by
+    FROM unnest(%s::text[], %s::int[]) AS v(id, in_use_by)
+    WHERE plate_locations.id = v.id
+      AND NOT EXISTS (SELECT 1
+                      FROM node_runs
+                      WHERE node_runs.id = v.in_use_by
+                        AND node_runs.status IN ('completed', 'failed'))
+)
+UPDATE instruments
+SET in_use_by = v.in_use_by
+FROM unnest(%s::int[], %s::int[]) AS v(id, in_use_by)
+WHERE instruments.id = v.id
+  -- don't claim an instrument for a NodeRun that already finished
+  AND NOT EXISTS (SELECT 1
+                  FROM node_runs
+                  WHERE node_runs.id = v.in_use_by
+                    AND node_runs.status IN ('completed', 'failed'))
+"""
+
+
+class StatusWriteBehind:
+    """
+    Buffers NodeRun, FlowRun, instrument and plate location status updates in memory and writes them in one statement per flush.
+
+    Only the latest value per row is kept. Completions are never buffered: they are written immediately and
+    discard any buffered update they supersede. If the process dies before a flush, rows keep their previous
+    (still consistent) state, e.g. a NodeRun stays "waiting" instead of "in-progress".
+    """
+
+    def __init__(self, enabled: bool, interval: float):
+        self.enabled = enabled
+        self.interval = interval
+        self.node_runs: dict[int, str] = {}
+        self.flow_runs: dict[int, tuple[str, str]] = {}
+        self.instruments: dict[int, int | None] = {}
+        self.plate_locations: dict[str, int | None] = {}
+        # Arguments of the discard() calls made while a flush is in progress, or None
+        self.discarded: list[tuple] | None = None
+        self.flushes = 0
+
+    def stage_node_run(self, node_run_id: int, status: str) -> None:
+        self.node_runs[node_run_id] = status
+
+    def stage_flow_run(
+        self, flow_run_id: int, current_node_id: str, status: str
+    ) -> None:
+        self.flow_runs[flow_run_id] = (current_node_id, status)
+
+    def stage_instrument(self, instrument_id: int, in_use_by: int | None) -> None:
+        self.instruments[instrument_id] = in_use_by
+
+    def stage_plate_locations(
+        self, plate_location_ids: list[str], in_use_by: int | None
+    ) -> None:
+        for plate_location_id in plate_location_ids:
+            self.plate_locations[plate_location_id] = in_use_by
+
+    def discard(
+        self,
+        node_run_id: int,
+        flow_run_id: int | None = None,
+        node_id: str | None = None,
+        instrument_id: int | None = None,
+    ) -> None:
+        """
+        Drop buffered updates that a direct write for `node_run_id` supersedes.
+        FlowRun, instrument and plate location updates are only dropped if they still refer to this NodeRun.
+        """
+        if self.discarded is not None:
+            # The updates being flushed may have to be put back; they mustn't come back with these
+            self.discarded.append((node_run_id, flow_run_id, node_id, instrument_id))
+        self.node_runs.pop(node_run_id, None)
+        if flow_run_id in self.flow_runs and self.flow_runs[flow_run_id][0] == node_id:
+            del self.flow_runs[flow_run_id]
+        if self.instruments.get(instrument_id, -1) == node_run_id:
+            del self.instruments[instrument_id]
+        for plate_location_id, in_use_by in list(self.plate_locations.items()):
+            if in_use_by == node_run_id:
+                del self.plate_locations[plate_location_id]
+
+    async def flush(self) -> None:
+        if not (
+            self.node_runs or self.flow_runs or self.instruments or self.plate_locations
+        ):
+            return
+
+        node_runs, self.node_runs = self.node_runs, {}
+        flow_runs, self.flow_runs = self.flow_runs, {}
+        instruments, self.instruments = self.instruments, {}
+        plate_locations, self.plate_locations = self.plate_locations, {}
+        self.discarded = []
+
+        try:
+            async with acursor() as cur:
+                await cur.execute(
+                    FLUSH_QUERY,
+                    (
+                        list(node_runs.keys()),
+                        list(node_runs.values()),
+                        list(flow_runs.keys()),
+                        [current_node_id for current_node_id, _ in flow_runs.values()],
+                        [status for _, status in flow_runs.values()],
+                        list(plate_locations.keys()),
+                        list(plate_locations.values()),
+                        list(instruments.keys()),
+                        list(instruments.values()),
+                    ),
+                )
+        except BaseException:
+            # Put the updates back for the next flush, unless newer ones were staged meanwhile
+            for node_run_id, status in node_runs.items():
+                self.node_runs.setdefault(node_run_id, status)
+            for flow_run_id, update in flow_runs.items():
+                self.flow_runs.setdefault(flow_run_id, update)
+            for instrument_id, in_use_by in instruments.items():
+                self.instruments.setdefault(instrument_id, in_use_by)
+            for plate_location_id, in_use_by in plate_locations.items():
+                self.plate_locations.setdefault(plate_location_id, in_use_by)
+            # Except those superseded by a direct write during the flush
+            discarded, self.discarded = self.discarded, None
+            for args in discarded:
+                self.discard(*args)
+            raise
+        finally:
+            self.discarded = None
+        self.flushes += 1
+
+    async def run(self) -> None:
+        """
+        Flush every `interval` seconds forever. Run this as a task.
+        """
+        logger.info(f"Write-behind enabled, flushing every {self.interval}s")
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
+
+
+write_behind = StatusWriteBehind(DB_WRITE_BEHIND, DB_WRITE_BEHIND_INTERVAL)
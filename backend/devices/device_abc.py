@@ -1,11 +1,14 @@
 from __future__ import annotations
 
-from typing import TypedDict, Callable, NotRequired
+from typing import TypedDict, Callable, NotRequired, TYPE_CHECKING
 import logging
 from abc import ABC, abstractmethod
-from queue import Queue
 
-from backend.ipc.python_ipc_servicer import send_message_to_client
+from backend.ipc.python_ipc_servicer import generalized_function_input_helper
+from backend.ipc.worker_pool import WorkerPool
+
+if TYPE_CHECKING:
+    from backend.telemetry import Trajectory
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +27,35 @@ class ABCRobotCommand(TypedDict):
     sub_function_name: NotRequired[str]
 
 
+def cacheable(ttl: float):
+    """
+    Declare a device function read-only: its result may be reused for `ttl` seconds, and identical concurrent calls
+    may share one request to the device.
+    """
+
+    def decorator(function):
+        function.cache_ttl = ttl
+        return function
+
+    return decorator
+
+
+def shared(passive: bool = False):
+    """
+    Declare that calls to a device function may run alongside each other: it only reads from the device, so several
+    NodeRuns may hold the instrument for it at once. Functions are exclusive unless declared shared.
+
+    :param passive: The function doesn't talk to the device at all (e.g. it answers from state sampled in the
+        background), so it may also run while an exclusive call holds the instrument
+    """
+
+    def decorator(function):
+        function.access_mode = "passive" if passive else "shared"
+        return function
+
+    return decorator
+
+
 class AbstractConnector(ABC):
     """
     AbstractConnector is the base class for all device connectors.
@@ -34,15 +66,66 @@ class AbstractConnector(ABC):
     Children must implement connect_device() and all functions to be executed.
     """
 
+    # Whether a run of consecutive move nodes may be executed as one call to `move_path(waypoint_numbers,
+    # blend_radii)`, see CompiledGraph.motion_run
+    supports_blended_paths = False
+
     def __init__(self, ip_addr, port):
         self.ip_addr = ip_addr
         self.port = port
-        self.q = Queue()
 
     @abstractmethod
     def connect_device(self):
         pass
 
+    async def disconnect_device(self) -> None:
+        """
+        Release the device's connections and processes at shutdown.
+        """
+
+    def cache_ttl_for(self, function_name: str | None) -> float | None:
+        """
+        Seconds the result of a function may be reused for, or None if it must always run (see `cacheable`).
+        """
+        function = getattr(type(self), function_name, None) if function_name else None
+        return getattr(function, "cache_ttl", None)
+
+    def access_mode_for(self, function_name: str | None) -> str:
+        """
+        How a function holds the instrument (see `shared`): "exclusive", "shared" (alongside other shared calls) or
+        "passive" (alongside any call).
+        """
+        function = getattr(type(self), function_name, None) if function_name else None
+        return getattr(function, "access_mode", "exclusive")
+
+    def plate_locations_for(self, function_name: str, function_args: dict) -> list[str]:
+        """
+        IDs of the plate locations a call touches, other than the instrument's own. They are reserved together
+        with the instrument before the call runs.
+
+        :param function_name: Name of the function to be executed
+        :param function_args: Arguments it will be called with
+        :return: Plate location IDs
+        """
+        return []
+
+    def connection_metrics(self) -> dict | None:
+        """
+        State and counters of the device's connection (see ConnectionSupervisor.metrics), for devices whose
+        connection is supervised.
+        """
+        return None
+
+    def motion_trajectory(self, since: float) -> Trajectory | None:
+        """
+        The trajectory the device moved along since `since` (a time.monotonic() value), for devices that move and
+        record their state. It is archived for the NodeRun that made the move.
+
+        :param since: Start of the move
+        :return: The trajectory, or None if the device doesn't record one
+        """
+        return None
+
     def call_node_interface(self, node_name: str, relevant_data: ABCRobotCommand):
         """
         The method with which the orchestrator will call the robot. It will send an "action" to perform.
@@ -63,15 +146,44 @@ class AbstractConnector(ABC):
 
 class AbstractIPC(AbstractConnector):
     """
-    AbstractConnector that uses IPC to connect to the device.
+    AbstractConnector that uses IPC to connect to the device: it is driven by separate (e.g. 32-bit) driver
+    processes, kept running by a WorkerPool.
+
+    Children must implement worker_command().
     """
 
-    # OVERWRITE THIS
-    client_pid = None
+    def __init__(self, ip_addr, port):
+        super().__init__(ip_addr, port)
+        self.pool = WorkerPool(
+            f"{type(self).__name__}-{ip_addr}:{port}", self.worker_command()
+        )
 
-    def call_node_interface(self, node_name, command: ABCRobotCommand):
+    @abstractmethod
+    def worker_command(self) -> list[str]:
+        """
+        Command that starts a driver process, which connects to the IPC service (see python_ipc_32.py).
+        """
 
-        if self.client_pid:
-            send_message_to_client(self.client_pid, command)
-        else:
-            raise Exception("Invalid client process ID. Did the connection succeed?")
+    async def connect_device(self) -> None:
+        """
+        Start the driver processes, and wait until one is ready.
+        """
+        await self.pool.start()
+
+    async def disconnect_device(self) -> None:
+        await self.pool.stop()
+
+    def connection_metrics(self) -> dict | None:
+        return self.pool.metrics()
+
+    async def call_node_interface(
+        self, node_name, command: ABCRobotCommand, timeout: float | None = None
+    ):
+        """
+        Run `node_name` in an idle driver process and return its result.
+        """
+        return await self.pool.call(
+            node_name,
+            timeout=timeout,
+            function_input=generalized_function_input_helper(command),
+        )
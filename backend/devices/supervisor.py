@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from os import getenv
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a TCP connection to open
+INSTRUMENT_CONNECT_TIMEOUT = float(getenv("INSTRUMENT_CONNECT_TIMEOUT", "5"))
+# Seconds before the first reconnect attempt; doubles after every failed attempt, up to INSTRUMENT_RECONNECT_MAX
+INSTRUMENT_RECONNECT_INITIAL = float(getenv("INSTRUMENT_RECONNECT_INITIAL", "0.5"))
+INSTRUMENT_RECONNECT_MAX = float(getenv("INSTRUMENT_RECONNECT_MAX", "30"))
+# Seconds between heartbeats on an idle connection (0 disables them)
+INSTRUMENT_HEARTBEAT_INTERVAL = float(getenv("INSTRUMENT_HEARTBEAT_INTERVAL", "10"))
+# Seconds a heartbeat may take before the connection is considered dead
+INSTRUMENT_HEARTBEAT_TIMEOUT = float(getenv("INSTRUMENT_HEARTBEAT_TIMEOUT", "5"))
+
+
+class ConnectionSupervisor:
+    """
+    Keeps a TCP connection to an instrument up.
+
+    The supervisor owns the connection and its single reader task. Received bytes are passed to `on_data`. When the
+    peer closes the connection (EOF), a read or write fails, or a heartbeat goes unanswered, the connection is
+    closed, `on_down` is called (so pending requests fail instead of waiting for replies that won't come) and the
+    supervisor reconnects with exponential backoff. While the connection is down, `send` fails immediately.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        host: str,
+        port: int,
+        on_data: Callable[[bytes], None],
+        on_down: Callable[[Exception], None],
+        heartbeat: Callable[[], Awaitable[None]] | None = None,
+    ):
+        """
+        :param name: Name used in logs
+        :param host: Instrument address
+        :param port: Instrument port
+        :param on_data: Called with every chunk of received bytes
+        :param on_down: Called with the reason when the connection is lost
+        :param heartbeat: Checks that the instrument answers; raising (or taking longer than
+            INSTRUMENT_HEARTBEAT_TIMEOUT) drops the connection
+        """
+        self.name = name
+        self.host = host
+        self.port = port
+        self.on_data = on_data
+        self.on_down = on_down
+        self.heartbeat = heartbeat
+
+        self.writer: asyncio.StreamWriter | None = None
+        self.reader_task: asyncio.Task | None = None
+        self.task: asyncio.Task | None = None
+        self.connected = asyncio.Event()
+        # reason the current connection is being dropped, if it is
+        self.down_reason: Exception | None = None
+        # time.monotonic() of the last data received
+        self.last_received = 0.0
+
+        # "stopped", "connecting", "connected" or "backoff"
+        self.state = "stopped"
+        self.connects = 0
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.disconnects = 0
+        self.heartbeat_failures = 0
+        self.last_error: str | None = None
+        self.connected_at: float | None = None
+
+    async def start(self, timeout: float = INSTRUMENT_CONNECT_TIMEOUT) -> None:
+        """
+        Start supervising, and wait for the first connection.
+
+        :param timeout: Seconds to wait for the connection
+        :raises ConnectionError: if it isn't up in time. The supervisor keeps trying in the background.
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self.connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(
+                f"{self.name}: couldn't connect to {self.host}:{self.port}: {self.last_error}"
+            ) from None
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.state = "stopped"
+
+    async def send(self, data: bytes) -> None:
+        """
+        Write `data` to the instrument.
+
+        :raises ConnectionError: if the connection is down or the write fails
+        """
+        if not self.connected.is_set():
+            raise ConnectionError(f"{self.name}: not connected ({self.last_error})")
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+        except OSError as e:
+            self.drop(e)
+            raise ConnectionError(f"{self.name}: write failed: {e}") from e
+
+    def drop(self, reason: Exception) -> None:
+        """
+        Drop the current connection; the supervisor reconnects.
+        """
+        if self.down_reason is None:
+            self.down_reason = reason
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+
+    async def _run(self) -> None:
+        delay = INSTRUMENT_RECONNECT_INITIAL
+        while True:
+            self.state = "connecting"
+            try:
+                reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port),
+                    INSTRUMENT_CONNECT_TIMEOUT,
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                self.failed_attempts += 1
+                self.last_error = str(e) or type(e).__name__
+                self.state = "backoff"
+                # Jitter, so instruments behind one switch don't all retry at once
+                wait = delay * random.uniform(0.8, 1.2)
+                logger.warning(
+                    f"{self.name}: connecting to {self.host}:{self.port} failed ({self.last_error}), "
+                    f"retrying in {wait:.1f} s"
+                )
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, INSTRUMENT_RECONNECT_MAX)
+                continue
+
+            delay = INSTRUMENT_RECONNECT_INITIAL
+            if self.connects:
+                self.reconnects += 1
+            self.connects += 1
+            self.down_reason = None
+            self.last_received = time.monotonic()
+            self.connected_at = time.monotonic()
+            self.state = "connected"
+            self.connected.set()
+            logger.info(f"{self.name}: connected to {self.host}:{self.port}")
+
+            self.reader_task = asyncio.create_task(self._read_loop(reader))
+            heartbeat_task = (
+                asyncio.create_task(self._heartbeat_loop())
+                if self.heartbeat is not None and INSTRUMENT_HEARTBEAT_INTERVAL > 0
+                else None
+            )
+            try:
+                # wait() rather than awaiting the task, so a dropped (cancelled) reader doesn't cancel the supervisor
+                await asyncio.wait({self.reader_task})
+            finally:
+                self.connected.clear()
+                self.connected_at = None
+                if heartbeat_task is not None:
+                    heartbeat_task.cancel()
+                self.reader_task.cancel()
+                self.writer.close()
+
+            reason = self.down_reason
+            if reason is None and not self.reader_task.cancelled():
+                reason = self.reader_task.exception()
+            if reason is None:
+                reason = ConnectionError("connection closed by the instrument")
+            self.disconnects += 1
+            self.last_error = str(reason) or type(reason).__name__
+            logger.warning(
+                f"{self.name}: connection lost ({self.last_error}), reconnecting"
+            )
+            self.on_down(
+                reason
+                if isinstance(reason, ConnectionError)
+                else ConnectionError(f"{self.name}: connection lost: {self.last_error}")
+            )
+
+    async def _read_loop(self, reader: asyncio.StreamReader) -> None:
+        while True:
+            data = await reader.read(1024)
+            if not data:
+                # EOF: the instrument closed the connection
+                return
+            self.last_received = time.monotonic()
+            self.on_data(data)
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(INSTRUMENT_HEARTBEAT_INTERVAL)
+            if time.monotonic() - self.last_received < INSTRUMENT_HEARTBEAT_INTERVAL:
+                # Heard from the instrument recently enough
+                continue
+            try:
+                await asyncio.wait_for(self.heartbeat(), INSTRUMENT_HEARTBEAT_TIMEOUT)
+            except Exception as e:
+                self.heartbeat_failures += 1
+                logger.warning(f"{self.name}: heartbeat failed: {e!r}")
+                self.drop(ConnectionError(f"heartbeat failed: {e!r}"))
+                return
+
+    def metrics(self) -> dict:
+        return {
+            "state": self.state,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "failed_attempts": self.failed_attempts,
+            "disconnects": self.disconnects,
+            "heartbeat_failures": self.heartbeat_failures,
+            "last_error": self.last_error,
+            "connected_seconds": (
+                time.monotonic() - self.connected_at
+                if self.connected_at is not None
+                else None
+            ),
+        }
+
+    def __repr__(self) -> str:
+        return f"<ConnectionSupervisor {self.name} {self.host}:{self.port} state={self.state} reconnects={self.reconnects}>"
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Seconds a single move may take before it is stopped and fails
+UR3_MOVE_TIMEOUT = float(getenv("UR3_MOVE_TIMEOUT", "120"))
+# Seconds between checks of whether a move has finished
+UR3_MOVE_POLL_INTERVAL = float(getenv("UR3_MOVE_POLL_INTERVAL", "0.02"))
+# Joint deceleration (rad/s^2) used to stop a cancelled or timed out move
+UR3_STOP_DECELERATION = float(getenv("UR3_STOP_DECELERATION", "2.0"))
+
+# Threads connecting a robot. An abandoned attempt holds one until its RTDE constructor gives up.
+CONNECT_THREADS = 4
+
+
+class MotionError(Exception):
+    """
+    Raised when the robot refuses a move.
+    """
+
+
+class UrMotionExecutor:
+    """
+    Runs a UR robot's RTDE calls on a thread of its own, so the event loop never waits for the robot.
+
+    RTDE calls block until the controller answers, and a synchronous moveJ blocks until the arm stops. Every call on
+    the robot's control interface and on its receive interface goes through a single-thread executor (which also
+    keeps them, as RTDE interfaces aren't thread safe, on one thread; the state sampler reads from a receive
+    interface of its own), and moves are started in RTDE's asynchronous mode, so the executor is only busy for as long as it takes
+    to send a command. A move is awaited by polling the controller's progress for the asynchronous operation, and is
+    stopped with stopJ if the awaiting task is cancelled or the move times out.
+
+    Connecting runs on separate threads (see `connect`): RTDE constructors can't be interrupted, so one that hangs
+    must hold up neither the robot's calls nor the next attempt.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.connect_executor = ThreadPoolExecutor(
+            max_workers=CONNECT_THREADS, thread_name_prefix=f"{name}-connect"
+        )
+        # RTDEControlInterface, set once connected
+        self.control_interface = None
+        # one move at a time
+        self.move_lock = asyncio.Lock()
+        self.moves = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self.abandoned_connects = 0
+
+    async def connect(self, *constructors: Callable[[], Any]) -> list:
+        """
+        Construct RTDE interfaces, in order, on a connect thread.
+
+        If the awaiting task is cancelled (e.g. the attempt timed out), the constructors left are skipped, and the
+        interfaces constructed are disconnected once the running constructor returns, so an abandoned attempt
+        leaves no connection behind.
+
+        :param constructors: Each connects and returns an interface
+        :return: The interfaces
+        """
+        abandoned = threading.Event()
+
+        def construct() -> list | None:
+            interfaces = []
+            try:
+                for constructor in constructors:
+                    if abandoned.is_set():
+                        break
+                    interfaces.append(constructor())
+            except BaseException:
+                self._disconnect(interfaces)
+                raise
+            if abandoned.is_set():
+                self._disconnect(interfaces)
+                return None
+            return interfaces
+
+        future = asyncio.get_running_loop().run_in_executor(
+            self.connect_executor, construct
+        )
+        try:
+            # Shielded, so the result of a cancelled attempt is still seen and disconnected
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.abandoned_connects += 1
+            abandoned.set()
+            future.add_done_callback(self._disconnect_abandoned)
+            raise
+
+    def _disconnect_abandoned(self, future: asyncio.Future) -> None:
+        # The attempt was abandoned after its last check, so its interfaces are still connected
+        if not future.cancelled() and future.exception() is None and future.result():
+            self.connect_executor.submit(self._disconnect, future.result())
+
+    def _disconnect(self, interfaces: list) -> None:
+        for interface in interfaces:
+            try:
+                interface.disconnect()
+            except Exception as e:
+                logger.warning(f"{self.name}: disconnecting {interface} failed: {e}")
+
+    async def call(self, function: Callable[..., Any], *args) -> Any:
+        """
+        Run a blocking RTDE call on the robot's thread.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, function, *args
+        )
+
+    async def move_joint(
+        self,
+        q: list[float],
+        speed: float,
+        acceleration: float,
+        timeout: float | None = None,
+    ) -> None:
+        """
+        Move to joint positions `q`, returning once the arm has stopped there.
+
+        :param q: Joint positions (rad)
+        :param speed: Joint speed (rad/s)
+        :param acceleration: Joint acceleration (rad/s^2)
+        :param timeout: Seconds the move may take, UR3_MOVE_TIMEOUT by default
+        :return: None
+        """
+        await self._move(
+            f"move to {q}",
+            lambda: self.control_interface.moveJ(q, speed, acceleration, True),
+            timeout,
+        )
+
+    async def move_path(
+        self, path: list[list[float]], timeout: float | None = None
+    ) -> None:
+        """
+        Move along a joint path (see build_joint_path), returning once the arm has stopped at its end.
+
+        :param path: The path
+        :param timeout: Seconds the move may take, UR3_MOVE_TIMEOUT by default
+        :return: None
+        """
+        await self._move(
+            f"path of {len(path)} waypoints",
+            lambda: self.control_interface.moveJ(path, True),
+            timeout,
+        )
+
+    async def _move(
+        self, description: str, start: Callable[[], bool], timeout: float | None
+    ) -> None:
+        if timeout is None:
+            timeout = UR3_MOVE_TIMEOUT
+        async with self.move_lock:
+            if not await self.call(start):
+                raise MotionError(f"{self.name}: robot rejected {description}")
+            self.moves += 1
+            try:
+                await asyncio.wait_for(self._wait_until_stopped(), timeout)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                logger.warning(f"{self.name}: {description} cancelled, stopping")
+                # Shielded, so the robot is stopped even if the task is cancelled again
+                await asyncio.shield(self.stop())
+                raise
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                logger.error(f"{self.name}: {description} timed out, stopping")
+                await asyncio.shield(self.stop())
+                raise TimeoutError(
+                    f"{self.name}: {description} didn't finish within {timeout} s"
+                ) from None
+
+    async def _wait_until_stopped(self) -> None:
+        # The progress of an asynchronous operation is negative once none is running
+        while await self.call(self.control_interface.getAsyncOperationProgress) >= 0:
+            await asyncio.sleep(UR3_MOVE_POLL_INTERVAL)
+
+    async def stop(self) -> None:
+        """
+        Decelerate the arm to a stop, ending the current move.
+        """
+        await self.call(self.control_interface.stopJ, UR3_STOP_DECELERATION)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.connect_executor.shutdown(wait=False, cancel_futures=True)
+
+    def __repr__(self) -> str:
+        return (
+            f"<UrMotionExecutor {self.name} moves={self.moves} cancelled={self.cancelled} timeouts={self.timeouts} "
+            f"abandoned_connects={self.abandoned_connects}>"
+        )
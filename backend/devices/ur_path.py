@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from os import getenv
+
+# Defaults for UR joint moves. Speed in rad/s, acceleration in rad/s^2, blend radius in m.
+UR3_SPEED = float(getenv("UR3_SPEED", "1.0"))
+UR3_ACCELERATION = float(getenv("UR3_ACCELERATION", "1.4"))
+UR3_BLEND_RADIUS = float(getenv("UR3_BLEND_RADIUS", "0.05"))
+# Set UR3_PATH_MODE=1 to blend moves that don't pause between waypoints, including runs of consecutive move nodes
+UR3_PATH_MODE = getenv("UR3_PATH_MODE", "0") == "1"
+
+
+def build_joint_path(
+    joint_positions: list[list[float]],
+    blend_radii: list[float | None],
+    speed: float = UR3_SPEED,
+    acceleration: float = UR3_ACCELERATION,
+    default_blend_radius: float = UR3_BLEND_RADIUS,
+) -> list[list[float]]:
+    """
+    Build a path for RTDEControlInterface.moveJ(path): one entry per waypoint, each the 6 joint positions followed
+    by speed, acceleration and blend radius.
+
+    The robot blends through every waypoint but the last, where it stops (blend 0). A waypoint repeated back to back
+    (e.g. one move's destination is the next move's source) is only visited once.
+
+    :param joint_positions: Joint positions of each waypoint, in order
+    :param blend_radii: Blend radius at each waypoint, None for `default_blend_radius`
+    :param speed: Joint speed
+    :param acceleration: Joint acceleration
+    :param default_blend_radius: Blend radius used where `blend_radii` has None
+    :return: The path
+    """
+    if len(joint_positions) != len(blend_radii):
+        raise ValueError("Every waypoint needs a blend radius (or None)")
+
+    path = []
+    for q, blend_radius in zip(joint_positions, blend_radii):
+        if path and path[-1][:6] == list(q):
+            continue
+        blend = default_blend_radius if blend_radius is None else blend_radius
+        path.append([*q, speed, acceleration, blend])
+    if path:
+        path[-1][8] = 0.0
+    return path
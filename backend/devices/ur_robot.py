@@ -7,7 +7,16 @@ import rtde_receive
 
 import asyncio
 
-from backend.devices.device_abc import AbstractConnector, ABCRobotCommand
+from backend.devices.device_abc import AbstractConnector, ABCRobotCommand, shared
+from backend.devices.ur_path import (
+    build_joint_path,
+    UR3_SPEED,
+    UR3_ACCELERATION,
+    UR3_PATH_MODE,
+)
+from backend.devices.ur_motion import UrMotionExecutor
+from backend.devices.ur_state import UrStateSampler, UR3_WAYPOINT_EPSILON
+from backend.telemetry import Trajectory
 
 logger = logging.getLogger(__name__)
 
@@ -56,19 +65,87 @@ class UrRobot(AbstractConnector):
     # Plate location IDs corresponding to the waypoints defined above
     plate_locations = ["hotel-1", "hotel-2", "hotel-3", "xpeel-tray", "imaginary-instr"]
 
+    supports_blended_paths = UR3_PATH_MODE
+
+    def __init__(self, ip_addr, port):
+        super().__init__(ip_addr, port)
+        # Runs RTDE calls off the event loop
+        self.motion = UrMotionExecutor(f"ur3-{ip_addr}")
+        # Keeps the latest joint positions and TCP pose, read in the background
+        self.state = UrStateSampler(f"ur3-{ip_addr}", self._read_state)
+
+    def plate_locations_for(self, function_name: str, function_args: dict) -> list[str]:
+        if function_name == "move_to_joint_waypoint":
+            waypoint_numbers = [function_args["waypoint_number"]]
+        elif function_name == "move":
+            waypoint_numbers = [
+                function_args["source_waypoint_number"],
+                function_args["destination_waypoint_number"],
+            ]
+        elif function_name == "move_path":
+            waypoint_numbers = function_args["waypoint_numbers"]
+        else:
+            return []
+
+        return [
+            self.plate_locations[number]
+            for number in waypoint_numbers
+            if 0 <= number < len(self.plate_locations)
+        ]
+
     # connect device implementation
     async def connect_device(self):
-        logger.debug("ur3: attempting receive interface connection")
+        logger.debug("ur3: attempting interface connections")
         print("UR3 IP ADDRESS", self.ip_addr)
-        self.receive_interface = rtde_receive.RTDEReceiveInterface(self.ip_addr)
-
-        logger.debug("ur3: attempting control interface connection")
-        self.control_interface = rtde_control.RTDEControlInterface(self.ip_addr)
+        (
+            self.receive_interface,
+            self.control_interface,
+            # The state sampler reads from a thread of its own, so it gets a receive interface of its own
+            self.state_interface,
+        ) = await self.motion.connect(
+            lambda: rtde_receive.RTDEReceiveInterface(self.ip_addr),
+            lambda: rtde_control.RTDEControlInterface(self.ip_addr),
+            lambda: rtde_receive.RTDEReceiveInterface(self.ip_addr),
+        )
+        self.motion.control_interface = self.control_interface
         logger.debug("ur3: attempting interface connections OK")
+        self.state.start()
+
+    def _read_state(self) -> tuple[list[float], list[float]]:
+        # Only called on the state sampler's thread
+        return (
+            self.state_interface.getActualQ(),
+            self.state_interface.getActualTCPPose(),
+        )
+
+    def motion_trajectory(self, since: float) -> Trajectory | None:
+        # Recorded by the state sampler; a move longer than its buffer keeps only its end
+        times, q, tcp = self.state.buffer.window(since)
+        return Trajectory.from_monotonic(times, q, tcp)
+
+    @shared(passive=True)
+    async def wait_for_waypoint(
+        self,
+        waypoint_number: int,
+        epsilon: float = UR3_WAYPOINT_EPSILON,
+        timeout: float | None = None,
+    ) -> None:
+        """
+        Wait until the arm is within `epsilon` (rad, every joint) of a waypoint.
+        """
+        await self.state.wait_until_near(
+            self.waypoints[waypoint_number], epsilon, timeout
+        )
 
     # specific implementations
-    def retrieve_state_joint(self, _: ABCRobotCommand):
-        return self.receive_interface.getActualQ()
+    # Answered from the state sampler, so it doesn't wait for a move to finish
+    @shared(passive=True)
+    async def retrieve_state_joint(self, _: ABCRobotCommand | None = None):
+        q = self.state.latest_q()
+        if q is None:
+            # Not sampling (yet), ask the robot
+            return await self.motion.call(self.receive_interface.getActualQ)
+        return q.tolist()
 
     def general_control_call(self, general_input: ABCRobotCommand):
         # check if this works TODO
@@ -91,13 +168,43 @@ class UrRobot(AbstractConnector):
 
         return general_receive_function(self.control_interface)
 
-    def retrieve_state_linear(self, general_input: ABCRobotCommand):
-        return self.receive_interface.getActualTCPPose()
+    @shared(passive=True)
+    async def retrieve_state_linear(self, general_input: ABCRobotCommand | None = None):
+        tcp = self.state.latest_tcp()
+        if tcp is None:
+            # Not sampling (yet), ask the robot
+            return await self.motion.call(self.receive_interface.getActualTCPPose)
+        return tcp.tolist()
+
+    async def _move_point_to_point(self, waypoint_number: int) -> None:
+        await self.motion.move_joint(
+            self.waypoints[waypoint_number], UR3_SPEED, UR3_ACCELERATION
+        )
 
     # NODE
     async def move_to_joint_waypoint(self, waypoint_number: int):
         logger.info(f"ur3: moving to waypoint #{waypoint_number}")
-        self.control_interface.moveJ(waypoint_number, True)
+        await self._move_point_to_point(waypoint_number)
+
+    async def move_path(
+        self,
+        waypoint_numbers: list[int],
+        blend_radii: list[float | None] | None = None,
+    ) -> None:
+        """
+        Move through several waypoints as one blended joint path, without stopping at the intermediate ones.
+
+        :param waypoint_numbers: Waypoints to visit, in order
+        :param blend_radii: Blend radius (m) at each waypoint, None for the default
+        :return: None
+        """
+        if blend_radii is None:
+            blend_radii = [None] * len(waypoint_numbers)
+        path = build_joint_path(
+            [self.waypoints[number] for number in waypoint_numbers], blend_radii
+        )
+        logger.info(f"ur3: moving along blended path through {waypoint_numbers}")
+        await self.motion.move_path(path)
 
     async def move(
         self,
@@ -105,8 +212,13 @@ class UrRobot(AbstractConnector):
         destination_waypoint_number: int,
         delay_between_movements: float,
     ) -> None:
+        if self.supports_blended_paths and delay_between_movements <= 0:
+            # No pause needed at the source, so don't stop there either
+            await self.move_path([source_waypoint_number, destination_waypoint_number])
+            return
+
         logger.info(f"move: moving to source waypoint {source_waypoint_number}")
-        self.control_interface.moveJ(self.waypoints[source_waypoint_number], True)
+        await self._move_point_to_point(source_waypoint_number)
         logger.info(
             f"move: move to source ({source_waypoint_number}) completed, waiting {delay_between_movements} seconds..."
         )
@@ -114,4 +226,4 @@ class UrRobot(AbstractConnector):
         logger.info(
             f"move: moving to destination waypoint {destination_waypoint_number}"
         )
-        self.control_interface.moveJ(self.waypoints[destination_waypoint_number], True)
+        await self._move_point_to_point(destination_waypoint_number)
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from os import getenv
+from typing import Callable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Samples per second read from the RTDE receive interface
+UR3_SAMPLE_RATE = float(getenv("UR3_SAMPLE_RATE", "50"))
+# Number of samples kept
+UR3_STATE_BUFFER_SIZE = int(getenv("UR3_STATE_BUFFER_SIZE", "3000"))
+# Joint distance (rad) within which the arm counts as at a waypoint
+UR3_WAYPOINT_EPSILON = float(getenv("UR3_WAYPOINT_EPSILON", "0.01"))
+
+# Samples older than this many sample periods are stale: the sampler has stopped or fallen behind
+STALE_PERIODS = 5
+
+# Receives the latest joint positions and TCP pose, and returns whether the awaited condition holds
+StatePredicate = Callable[[np.ndarray, np.ndarray], bool]
+
+
+class StateRingBuffer:
+    """
+    Preallocated ring buffer of robot state samples: time, joint positions (6) and TCP pose (6).
+
+    Written by one thread, read by others. A write fills the slot first and only then advances the count, so readers
+    never see a half written latest sample.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.q = np.zeros((capacity, 6), dtype=np.float64)
+        self.tcp = np.zeros((capacity, 6), dtype=np.float64)
+        # total number of samples ever written
+        self.count = 0
+
+    def write(self, t: float, q: list[float], tcp: list[float]) -> None:
+        i = self.count % self.capacity
+        self.times[i] = t
+        self.q[i] = q
+        self.tcp[i] = tcp
+        self.count += 1
+
+    def latest(self) -> tuple[float, np.ndarray, np.ndarray] | None:
+        """
+        :return: Time, joint positions and TCP pose of the latest sample (copies), or None if there is none yet
+        """
+        count = self.count
+        if count == 0:
+            return None
+        i = (count - 1) % self.capacity
+        return float(self.times[i]), self.q[i].copy(), self.tcp[i].copy()
+
+    def window(self, since: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Samples taken at or after `since` (a time.monotonic() value), oldest first.
+
+        :return: Times, joint positions and TCP poses (copies)
+        """
+        count = self.count
+        n = min(count, self.capacity)
+        order = np.arange(count - n, count) % self.capacity
+        times = self.times[order]
+        keep = order[times >= since]
+        return self.times[keep], self.q[keep], self.tcp[keep]
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+
+class UrStateSampler:
+    """
+    Samples a UR robot's state in the background into a StateRingBuffer.
+
+    A thread reads the joint positions and TCP pose at UR3_SAMPLE_RATE, so state queries are answered from the latest sample without a round trip to the robot. Coroutines can wait for a
+    condition on the state (e.g. the arm being at a waypoint): conditions are checked on the event loop after each
+    new sample, and only while someone is waiting.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        read_state: Callable[[], tuple[list[float], list[float]]],
+        rate: float = UR3_SAMPLE_RATE,
+        capacity: int = UR3_STATE_BUFFER_SIZE,
+    ):
+        """
+        :param name: Name of the robot, used for the thread and logs
+        :param read_state: Reads the joint positions and TCP pose from the robot. Called only on the sampler's
+            thread, so it must not share an RTDE interface with other threads (they aren't thread safe).
+        :param rate: Samples per second
+        :param capacity: Number of samples kept
+        """
+        self.name = name
+        self.read_state = read_state
+        self.period = 1 / rate
+        self.buffer = StateRingBuffer(capacity)
+        self.thread: threading.Thread | None = None
+        self.stopped = threading.Event()
+        self.loop: asyncio.AbstractEventLoop | None = None
+        # Waiting conditions and the futures they resolve. Only touched on the event loop.
+        self.waiters: list[tuple[StatePredicate, asyncio.Future]] = []
+        self.read_errors = 0
+        self.overruns = 0
+
+    def start(self) -> None:
+        """
+        Start sampling. Must be called from the event loop waiters will run on.
+        """
+        if self.thread is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.stopped.clear()
+        self.thread = threading.Thread(
+            target=self._run, name=f"{self.name}-state", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self) -> None:
+        next_sample = time.monotonic()
+        while not self.stopped.is_set():
+            try:
+                q, tcp = self.read_state()
+            except Exception as e:
+                self.read_errors += 1
+                logger.warning(f"{self.name}: failed to read robot state: {e}")
+            else:
+                self.buffer.write(time.monotonic(), q, tcp)
+                if self.waiters:
+                    self.loop.call_soon_threadsafe(self._check_waiters)
+
+            next_sample += self.period
+            delay = next_sample - time.monotonic()
+            if delay < 0:
+                # Fell behind; skip the missed samples instead of bursting to catch up
+                self.overruns += 1
+                next_sample = time.monotonic()
+            else:
+                self.stopped.wait(delay)
+
+    def fresh_latest(self) -> tuple[float, np.ndarray, np.ndarray] | None:
+        """
+        The latest sample (see StateRingBuffer.latest), or None if it is stale
+        """
+        latest = self.buffer.latest()
+        if latest is None or time.monotonic() - latest[0] > STALE_PERIODS * self.period:
+            return None
+        return latest
+
+    def latest_q(self) -> np.ndarray | None:
+        """
+        Joint positions of the latest sample, or None if it is stale
+        """
+        latest = self.fresh_latest()
+        return None if latest is None else latest[1]
+
+    def latest_tcp(self) -> np.ndarray | None:
+        """
+        TCP pose of the latest sample, or None if it is stale
+        """
+        latest = self.fresh_latest()
+        return None if latest is None else latest[2]
+
+    async def wait_for(
+        self, predicate: StatePredicate, timeout: float | None = None
+    ) -> None:
+        """
+        Wait until `predicate(q, tcp)` holds for a sample.
+
+        :param predicate: Condition on the joint positions and TCP pose
+        :param timeout: Seconds to wait, forever if None
+        :return: None
+        :raises TimeoutError: if the condition didn't hold in time
+        """
+        latest = self.fresh_latest()
+        if latest is not None and predicate(latest[1], latest[2]):
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (predicate, future)
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    async def wait_until_near(
+        self,
+        q: list[float],
+        epsilon: float = UR3_WAYPOINT_EPSILON,
+        timeout: float | None = None,
+    ) -> None:
+        """
+        Wait until every joint is within `epsilon` (rad) of `q`.
+        """
+        target = np.asarray(q, dtype=np.float64)
+        await self.wait_for(
+            lambda actual_q, _: bool(np.max(np.abs(actual_q - target)) <= epsilon),
+            timeout,
+        )
+
+    def _check_waiters(self) -> None:
+        latest = self.buffer.latest()
+        if latest is None:
+            return
+        _, q, tcp = latest
+        for waiter in list(self.waiters):
+            predicate, future = waiter
+            if future.done():
+                self.waiters.remove(waiter)
+                continue
+            try:
+                matched = predicate(q, tcp)
+            except Exception as e:
+                self.waiters.remove(waiter)
+                future.set_exception(e)
+                continue
+            if matched:
+                self.waiters.remove(waiter)
+                future.set_result(None)
+
+    def __repr__(self) -> str:
+        return (
+            f"<UrStateSampler {self.name} samples={self.buffer.count} waiters={len(self.waiters)} "
+            f"read_errors={self.read_errors} overruns={self.overruns}>"
+        )
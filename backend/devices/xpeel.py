@@ -2,64 +2,76 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from typing import TypedDict
-
-from backend.devices.device_abc import AbstractConnector
+from os import getenv
+
+from backend.devices.device_abc import AbstractConnector, cacheable, shared
+from backend.devices.supervisor import ConnectionSupervisor
+from backend.devices.xpeel_protocol import (
+    XPeelDispatcher,
+    XPeelFramer,
+    XPeelMessage,
+    XPeelMessageDict,
+)
 from backend.node_connector_pb2.xpeel_pb2 import XPeelStatusResponse
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for the reply to a command; a peel takes well under a minute
+XPEEL_COMMAND_TIMEOUT = float(getenv("XPEEL_COMMAND_TIMEOUT", "300"))
+# Seconds status and seal check results are reused for
+XPEEL_CACHE_TTL = float(getenv("XPEEL_CACHE_TTL", "2"))
+# Seconds tape remaining results are reused for
+XPEEL_TAPE_CACHE_TTL = float(getenv("XPEEL_TAPE_CACHE_TTL", "30"))
+
 
 class XPeelConnector(AbstractConnector):
     def __init__(self, ip_addr, port):
         super().__init__(ip_addr, port)
-        self.recv_queue: asyncio.Queue[XPeelMessage] = asyncio.Queue()
-
-        self.reader: asyncio.StreamReader | None = None
-        self.writer: asyncio.StreamWriter | None = None
-        self.reader_task: asyncio.Task | None = None
+        self.framer = XPeelFramer()
+        self.dispatcher = XPeelDispatcher()
+        # The XPeel doesn't tag replies with the command they answer, so one command runs at a time
+        self.command_lock = asyncio.Lock()
+        # Owns the socket and its reader task, and reconnects when the link goes down
+        self.supervisor = ConnectionSupervisor(
+            f"xpeel-{ip_addr}:{port}",
+            ip_addr,
+            port,
+            self._on_data,
+            self._on_down,
+            self._heartbeat,
+        )
 
     async def connect_device(self) -> None:
         """
-        Connect to the XPeel by opening a TCP socket.
+        Connect to the XPeel by opening a TCP socket, kept open (and reopened) by the supervisor.
         :return: None
         """
-        self.reader, self.writer = await asyncio.open_connection(
-            self.ip_addr, self.port
-        )
+        await self.supervisor.start()
         logger.info(f"Connected to XPeel on {self.ip_addr}:{self.port}")
-        self.reader_task = asyncio.create_task(self._recv_loop())
 
-    async def _recv_loop(self):
-        """
-        Async loop to receive messages from the socket.
+    def connection_metrics(self) -> dict | None:
+        return self.supervisor.metrics()
 
-        Whenever data is ready on the socket, messages are split by CRLF,
-        then added to the queue, which is read from when `self.recv_type` is called.
-        :return: None
+    def _on_data(self, data: bytes) -> None:
         """
-        while True:
-            try:
-                data = await self.reader.read(1024)
-                if not data:
-                    logger.debug("No data received")
-                    continue
-
-                decoded = data.decode()
-                logger.debug(f"Raw data from XPeel: {decoded}")
-                msgs = decoded.split("\r\n")
-
-                for msg in msgs:
-                    stripped = msg.strip()
-                    if stripped:
-                        await self.recv_queue.put(XPeelMessage(stripped))
-                        logger.debug(f"XPeel message added to queue: {stripped}")
-            except (BrokenPipeError, ConnectionResetError):
-                logger.info("XPeel connection lost during read, reconnecting")
-                await self.connect_device()
-            except Exception as e:
-                logger.error(f"XPeel recv loop error: {e}")
-                break
+        Received bytes are framed into messages by CRLF (across reads), and each message is handed to
+        whoever waits for its type, see `self.recv_type`.
+        """
+        logger.debug(f"Raw data from XPeel: {data!r}")
+        for msg in self.framer.feed(data):
+            logger.debug(f"XPeel message received: {msg}")
+            self.dispatcher.dispatch(msg)
+
+    def _on_down(self, exc: ConnectionError) -> None:
+        # Replies to commands sent on the lost connection will never come
+        self.framer.reset()
+        self.dispatcher.fail_all(exc)
+
+    async def _heartbeat(self) -> None:
+        if self.command_lock.locked():
+            # A command is running; a status query now couldn't be told apart from its reply
+            return
+        await self.execute_command("*stat")
 
     async def send(self, data: str) -> None:
         """
@@ -67,35 +79,21 @@ class XPeelConnector(AbstractConnector):
 
         :param data: Command to send to the XPeel. Do not append newlines - this is done automatically.
         :return: None - use self.recv_type() to get a response.
+        :raises ConnectionError: if the XPeel isn't connected
         """
-        try:
-            logger.debug(f"Sending data to XPeel: {data}")
-            self.writer.write((data + "\r\n").encode())
-            await self.writer.drain()
-        except BrokenPipeError:
-            logger.info("XPeel connection lost during write, reconnecting")
-            await self.connect_device()
-            await self.send(data)
+        logger.debug(f"Sending data to XPeel: {data}")
+        await self.supervisor.send((data + "\r\n").encode())
 
     async def recv_type(self, cmd_type: str) -> XPeelMessage:
-        logger.debug(f"Attempting to receive command of type {cmd_type} from XPeel")
-        while True:
-            msg = await self.recv_queue.get()
-            logger.debug(
-                f"Received from XPeel queue: {msg}, attempting to receive command with {cmd_type}"
-            )
-
-            if msg.type == cmd_type:
-                return msg
-
-    async def flush_msgs(self) -> None:
         """
-        Flush messages from the queue. Should be called before sending a command,
-        since the XPeel may send random ready/ack messages.
-        :return: None
+        Wait for the next message of `cmd_type`. Messages of other types go to their own waiters.
         """
-        while not self.recv_queue.empty():
-            await self.recv_queue.get()
+        logger.debug(f"Attempting to receive command of type {cmd_type} from XPeel")
+        future = self.dispatcher.expect(cmd_type)
+        try:
+            return await future
+        finally:
+            self.dispatcher.discard(cmd_type, future)
 
     async def execute_command(
         self, command: str, return_cmd_type: str = "ready"
@@ -110,33 +108,37 @@ class XPeelConnector(AbstractConnector):
         logger.debug(
             f"Attempting to execute command of type {return_cmd_type} from XPeel"
         )
-        await self.flush_msgs()
-        await self.send(command)
-        return (await self.recv_type(return_cmd_type)).to_dict()
+        async with self.command_lock:
+            # Wait for the reply before sending, so it can't arrive unnoticed
+            reply = self.dispatcher.expect(return_cmd_type)
+            try:
+                await self.send(command)
+                return (await asyncio.wait_for(reply, XPEEL_COMMAND_TIMEOUT)).to_dict()
+            finally:
+                self.dispatcher.discard(return_cmd_type, reply)
 
     async def reset(self) -> XPeelMessageDict:
         return await self.execute_command("*reset")
 
+    @shared()
+    @cacheable(XPEEL_CACHE_TTL)
     async def status(self) -> XPeelMessageDict:
         return await self.execute_command("*stat")
 
     async def peel(self, param: int, adhere: int) -> XPeelMessageDict:
         return await self.execute_command(f"*xpeel:{param}{adhere}")
 
+    @shared()
+    @cacheable(XPEEL_CACHE_TTL)
     async def seal_check(self) -> XPeelMessageDict:
         return await self.execute_command("*sealcheck")
 
+    @shared()
+    @cacheable(XPEEL_TAPE_CACHE_TTL)
     async def tape_remaining(self) -> XPeelMessageDict:
         return await self.execute_command("*tapeleft", "tape")
 
 
-class XPeelMessageDict(TypedDict):
-    raw_msg: str
-    type: str
-    raw_payload: str
-    payload: list[str]
-
-
 def xpeel_message_dict_to_xpeel_status_response(
     message: XPeelMessageDict,
 ) -> XPeelStatusResponse:
@@ -149,29 +151,3 @@ def xpeel_message_dict_to_xpeel_status_response(
         error_code_2=int_payload[1],
         error_code_3=int_payload[2],
     )
-
-
-class XPeelMessage:
-    def __init__(self, msg):
-
-        self.raw_msg: str = msg
-        split_msg = msg[1:].split(":")
-        self.type = split_msg[0]
-
-        if len(split_msg) == 2:
-            self.raw_payload = split_msg[1]
-            self.payload: list[str] = self.raw_payload.split(",")
-        else:
-            self.raw_payload = ""
-            self.payload = []
-
-    def to_dict(self) -> XPeelMessageDict:
-        return {
-            "raw_msg": self.raw_msg,
-            "type": self.type,
-            "raw_payload": self.raw_payload,
-            "payload": self.payload,
-        }
-
-    def __repr__(self) -> str:
-        return f"<XPeelMessage type={self.type} payload=({self.payload})>"
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import TypedDict
+
+logger = logging.getLogger(__name__)
+
+# Longest frame accepted. Anything longer without a CRLF is line noise and is dropped.
+MAX_FRAME_LENGTH = 1024
+
+
+class XPeelMessageDict(TypedDict):
+    raw_msg: str
+    type: str
+    raw_payload: str
+    payload: list[str]
+
+
+class XPeelMessage:
+    def __init__(self, msg):
+
+        self.raw_msg: str = msg
+        split_msg = msg[1:].split(":")
+        self.type = split_msg[0]
+
+        if len(split_msg) == 2:
+            self.raw_payload = split_msg[1]
+            self.payload: list[str] = self.raw_payload.split(",")
+        else:
+            self.raw_payload = ""
+            self.payload = []
+
+    def to_dict(self) -> XPeelMessageDict:
+        return {
+            "raw_msg": self.raw_msg,
+            "type": self.type,
+            "raw_payload": self.raw_payload,
+            "payload": self.payload,
+        }
+
+    def __repr__(self) -> str:
+        return f"<XPeelMessage type={self.type} payload=({self.payload})>"
+
+
+class XPeelFramer:
+    """
+    Splits the byte stream from an XPeel into CRLF-terminated messages.
+
+    Bytes are buffered across reads, so a message split over several reads (or several messages in one read) is
+    framed correctly. A partial message stays in the buffer until the rest of it arrives.
+    """
+
+    def __init__(self, max_frame_length: int = MAX_FRAME_LENGTH):
+        self.buffer = bytearray()
+        self.max_frame_length = max_frame_length
+        # frames dropped for being too long
+        self.overflows = 0
+
+    def feed(self, data: bytes) -> list[XPeelMessage]:
+        """
+        Add received bytes, and return the messages they complete.
+        """
+        buffer = self.buffer
+        buffer += data
+        messages = []
+        start = 0
+        while True:
+            end = buffer.find(b"\r\n", start)
+            if end < 0:
+                break
+            frame = buffer[start:end].strip()
+            start = end + 2
+            if frame:
+                messages.append(XPeelMessage(frame.decode("ascii", "replace")))
+        if start:
+            del buffer[:start]
+
+        if len(buffer) > self.max_frame_length:
+            self.overflows += 1
+            logger.warning(
+                f"Dropping {len(buffer)} bytes from XPeel without a line ending"
+            )
+            buffer.clear()
+        return messages
+
+    def reset(self) -> None:
+        """
+        Drop a partial message, e.g. after reconnecting.
+        """
+        self.buffer.clear()
+
+
+class XPeelDispatcher:
+    """
+    Routes messages from an XPeel to the coroutines waiting for them, by message type.
+
+    A waiter registers for a type (`expect`) before its command is sent, so its reply can't be missed, and each
+    message resolves the oldest waiter for its type. Messages of other types are left for their own waiters, and a
+    message nobody waits for (e.g. a ready the XPeel sends on its own) is dropped instead of being handed to a
+    later command.
+    """
+
+    def __init__(self):
+        # key: message type, value: futures waiting for it, oldest first
+        self.waiters: dict[str, deque[asyncio.Future[XPeelMessage]]] = {}
+        self.dispatched = 0
+        self.unsolicited = 0
+
+    def expect(self, msg_type: str) -> asyncio.Future[XPeelMessage]:
+        """
+        Register for the next message of `msg_type`.
+
+        :return: Future resolving to the message. Cancel it (or call `discard`) if it's no longer wanted.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(msg_type, deque()).append(future)
+        return future
+
+    def discard(self, msg_type: str, future: asyncio.Future) -> None:
+        waiters = self.waiters.get(msg_type)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+
+    def dispatch(self, msg: XPeelMessage) -> bool:
+        """
+        Hand `msg` to the oldest waiter for its type.
+
+        :return: Whether anyone was waiting for it
+        """
+        waiters = self.waiters.get(msg.type)
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(msg)
+                self.dispatched += 1
+                return True
+        self.unsolicited += 1
+        logger.debug(f"Dropping XPeel message nobody waits for: {msg}")
+        return False
+
+    def fail_all(self, exc: BaseException) -> None:
+        """
+        Fail every waiter, e.g. when the connection is lost.
+        """
+        for waiters in self.waiters.values():
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    future.set_exception(exc)
+
+    def __len__(self) -> int:
+        return sum(
+            1 for waiters in self.waiters.values() for f in waiters if not f.done()
+        )
@@ -0,0 +1,347 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from os import getenv
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from backend.db.instruments import Instrument
+
+logger = logging.getLogger(__name__)
+
+# Seconds of waiting worth one priority level. A NodeRun that has waited this long is admitted
+# ahead of one queued just now with a priority one higher, so low priorities can't starve.
+DISPATCH_AGING_SECONDS = float(getenv("DISPATCH_AGING_SECONDS", "30"))
+# NodeRuns whose deadline is less than this many seconds away are admitted first, earliest deadline first
+DISPATCH_DEADLINE_HORIZON = float(getenv("DISPATCH_DEADLINE_HORIZON", "10"))
+
+
+class Admission:
+    """
+    Metadata describing how a NodeRun was admitted to an instrument.
+    """
+
+    def __init__(
+        self,
+        node_run_id: int,
+        queue_position: int,
+        wait_time: float,
+        previous_holder: int | None,
+    ):
+        self.node_run_id = node_run_id
+        # Number of NodeRuns ahead of this one (including the holder) when it was queued
+        self.queue_position = queue_position
+        # Seconds between being queued and being admitted
+        self.wait_time = wait_time
+        # NodeRun that held the instrument before this one, if any
+        self.previous_holder = previous_holder
+
+    def __repr__(self) -> str:
+        return (
+            f"<Admission node_run={self.node_run_id} queue_position={self.queue_position} "
+            f"wait_time={self.wait_time:.3f}s previous_holder={self.previous_holder}>"
+        )
+
+
+class AdmissionTicket:
+    """
+    Ticket handed out when a NodeRun is queued for an instrument.
+
+    Awaiting the ticket resolves to an `Admission` exactly when the NodeRun is admitted.
+    """
+
+    def __init__(
+        self,
+        node_run_id: int,
+        queue_position: int,
+        priority: int = 0,
+        deadline: float | None = None,
+        flow_run_id: int | None = None,
+        shared: bool = False,
+    ):
+        self.node_run_id = node_run_id
+        self.queue_position = queue_position
+        # Higher is more urgent
+        self.priority = priority
+        # time.monotonic() by which the NodeRun should be admitted, if any
+        self.deadline = deadline
+        self.flow_run_id = flow_run_id
+        # Whether the NodeRun may hold the instrument together with other shared holders
+        self.shared = shared
+        # Whether the ticket is counted as waiting by its dispatcher
+        self.queued = True
+        self.queued_at = time.monotonic()
+        self.future: asyncio.Future[Admission] = (
+            asyncio.get_running_loop().create_future()
+        )
+
+    @property
+    def rank(self) -> float:
+        """
+        Sort key in the priority heap (lower is admitted first).
+
+        Aging adds 1 / DISPATCH_AGING_SECONDS to every waiting ticket's priority per second. All tickets age at the
+        same rate, so ordering by `priority + age / aging` is the same as ordering by this fixed key - which is what
+        lets the heap stay valid without re-keying.
+        """
+        return self.queued_at - self.priority * DISPATCH_AGING_SECONDS
+
+    @property
+    def admitted(self) -> bool:
+        return self.future.done() and not self.future.cancelled()
+
+    def __await__(self):
+        return self.future.__await__()
+
+    def __repr__(self) -> str:
+        return (
+            f"<AdmissionTicket node_run={self.node_run_id} priority={self.priority} "
+            f"shared={self.shared} queue_position={self.queue_position} admitted={self.admitted}>"
+        )
+
+
+class InstrumentDispatcher:
+    """
+    In-process dispatcher that hands an instrument to waiting NodeRuns.
+
+    The dispatcher is the source of truth for who is using an instrument. When the current NodeRun releases the
+    instrument, the next waiting NodeRun is admitted immediately. The database is only written to persist the new
+    holder (`instruments.in_use_by`), which the NodeRun's admit/finish transitions do; it is never polled to
+    detect a change.
+
+    Waiting NodeRuns are admitted in order of their FlowRun's priority, aged by time waited (see
+    `AdmissionTicket.rank`), except that NodeRuns whose deadline is within DISPATCH_DEADLINE_HORIZON go first,
+    earliest deadline first. Tickets are kept in two heaps (by rank and by deadline), so queueing and admitting
+    are O(log n). Withdrawn tickets are dropped lazily when they reach the top of a heap.
+
+    NodeRuns that call a shared function (see `AbstractConnector.access_mode_for`) may hold the instrument together:
+    every shared ticket at the front of the queue is admitted at once, as long as no exclusive NodeRun holds the
+    instrument. An exclusive ticket at the front waits for the shared holders to finish, and shared tickets queued
+    behind it wait for it in turn, so a steady stream of shared calls can't starve an exclusive one.
+    """
+
+    def __init__(self, db_instrument: Instrument):
+        self.db_instrument = db_instrument
+        # Exclusive holder
+        self.in_use_by: int | None = None
+        # Shared holders
+        self.shared_by: set[int] = set()
+        self.previous_holder: int | None = None
+        # (rank, seq, ticket)
+        self.waiting: list[tuple[float, int, AdmissionTicket]] = []
+        # (deadline, seq, ticket), only tickets with a deadline
+        self.deadlines: list[tuple[float, int, AdmissionTicket]] = []
+        # tie breaker, so equal keys are admitted first come, first served
+        self.seq = itertools.count()
+        self.num_waiting = 0
+
+    def qsize(self) -> int:
+        """
+        Number of NodeRuns waiting for the instrument, not counting the current holder.
+        """
+        return self.num_waiting
+
+    def enqueue(
+        self,
+        node_run_id: int,
+        priority: int = 0,
+        deadline: float | None = None,
+        flow_run_id: int | None = None,
+        shared: bool = False,
+    ) -> AdmissionTicket:
+        """
+        Queue a NodeRun for the instrument.
+
+        :param node_run_id: ID of the NodeRun that wants to use the instrument
+        :param priority: Priority of the NodeRun's FlowRun, higher is more urgent
+        :param deadline: time.monotonic() by which the NodeRun should be admitted, if any
+        :param flow_run_id: ID of the NodeRun's FlowRun, for inspecting the queue
+        :param shared: Whether the NodeRun may share the instrument with other shared holders
+        :return: AdmissionTicket that resolves to an Admission once the NodeRun holds the instrument
+        """
+        queue_position = (
+            self.num_waiting
+            + (0 if self.in_use_by is None else 1)
+            + len(self.shared_by)
+        )
+        ticket = AdmissionTicket(
+            node_run_id, queue_position, priority, deadline, flow_run_id, shared
+        )
+        seq = next(self.seq)
+        heapq.heappush(self.waiting, (ticket.rank, seq, ticket))
+        if deadline is not None:
+            heapq.heappush(self.deadlines, (deadline, seq, ticket))
+        self.num_waiting += 1
+
+        self._admit_next()
+
+        return ticket
+
+    async def acquire(
+        self,
+        node_run_id: int,
+        priority: int = 0,
+        deadline: float | None = None,
+        flow_run_id: int | None = None,
+        shared: bool = False,
+    ) -> Admission:
+        """
+        Queue a NodeRun for the instrument and wait until it is admitted.
+
+        If the waiting task is cancelled, the NodeRun is removed from the queue (or the instrument is released, if
+        it was admitted in the meantime).
+
+        :param node_run_id: ID of the NodeRun that wants to use the instrument
+        :param priority: Priority of the NodeRun's FlowRun, higher is more urgent
+        :param deadline: time.monotonic() by which the NodeRun should be admitted, if any
+        :param flow_run_id: ID of the NodeRun's FlowRun, for inspecting the queue
+        :param shared: Whether the NodeRun may share the instrument with other shared holders
+        :return: Admission metadata, once the NodeRun holds the instrument
+        """
+        ticket = self.enqueue(node_run_id, priority, deadline, flow_run_id, shared)
+        try:
+            return await ticket
+        except asyncio.CancelledError:
+            self.cancel(ticket)
+            raise
+
+    def cancel(self, ticket: AdmissionTicket) -> None:
+        """
+        Withdraw a ticket. A waiting NodeRun is removed from the queue; an admitted one releases the instrument.
+
+        :param ticket: Ticket returned by `enqueue`
+        :return: None
+        """
+        if ticket.admitted:
+            self.release(ticket.node_run_id)
+            return
+
+        if not ticket.queued:
+            return
+        # The ticket stays in the heaps until it reaches the top, see _pop
+        ticket.future.cancel()
+        self._forget(ticket)
+        logger.info(
+            f"NodeRun {ticket.node_run_id} withdrawn from instrument {self.db_instrument.id} queue"
+        )
+        # Don't let withdrawn tickets pile up in the heaps
+        if len(self.waiting) > 2 * self.num_waiting + 64:
+            self._compact()
+
+    def release(self, node_run_id: int) -> None:
+        """
+        Release the instrument held by `node_run_id` and hand it to the next waiting NodeRun.
+
+        :param node_run_id: ID of the NodeRun that currently holds the instrument
+        :return: None
+        """
+        if node_run_id in self.shared_by:
+            self.shared_by.discard(node_run_id)
+            self._admit_next()
+            return
+
+        if self.in_use_by != node_run_id:
+            logger.warning(
+                f"NodeRun {node_run_id} released instrument {self.db_instrument.id}, "
+                f"but it is held by {self.in_use_by}"
+            )
+            return
+
+        self.previous_holder = self.in_use_by
+        self.in_use_by = None
+        self._admit_next()
+
+    def _admit_next(self) -> None:
+        """
+        Admit the next waiting NodeRun, or every shared NodeRun at the front of the queue, if the instrument is free
+        for them, and resolve their tickets.
+        """
+        while self.in_use_by is None:
+            ticket = self._peek()
+            if ticket is None:
+                return
+            if not ticket.shared and self.shared_by:
+                # Wait for the shared holders; shared tickets behind this one wait too
+                return
+
+            self._forget(ticket)
+            if ticket.shared:
+                self.shared_by.add(ticket.node_run_id)
+            else:
+                self.in_use_by = ticket.node_run_id
+            logger.info(
+                f"Instrument {self.db_instrument.id} handed to NodeRun {ticket.node_run_id}"
+                f"{' (shared)' if ticket.shared else ''}"
+            )
+            # Resolving the future also drops the ticket from the heaps, see _peek
+            ticket.future.set_result(
+                Admission(
+                    ticket.node_run_id,
+                    ticket.queue_position,
+                    time.monotonic() - ticket.queued_at,
+                    self.previous_holder,
+                )
+            )
+
+    def _peek(self) -> AdmissionTicket | None:
+        """
+        Return the ticket to admit next, dropping withdrawn and already admitted tickets from the tops of the heaps.
+        """
+        now = time.monotonic()
+        while self.deadlines:
+            deadline, _, ticket = self.deadlines[0]
+            if ticket.future.done():
+                heapq.heappop(self.deadlines)
+                self._forget(ticket)
+            elif deadline - now <= DISPATCH_DEADLINE_HORIZON:
+                return ticket
+            else:
+                break
+
+        while self.waiting:
+            ticket = self.waiting[0][2]
+            if not ticket.future.done():
+                return ticket
+            heapq.heappop(self.waiting)
+            self._forget(ticket)
+        return None
+
+    def _forget(self, ticket: AdmissionTicket) -> None:
+        if ticket.queued:
+            ticket.queued = False
+            self.num_waiting -= 1
+
+    def _compact(self) -> None:
+        self.waiting = [entry for entry in self.waiting if not entry[2].future.done()]
+        heapq.heapify(self.waiting)
+        self.deadlines = [
+            entry for entry in self.deadlines if not entry[2].future.done()
+        ]
+        heapq.heapify(self.deadlines)
+
+    def snapshot(self) -> list[AdmissionTicket]:
+        """
+        Waiting tickets, in the order they would be admitted if none were added or withdrawn.
+        """
+        now = time.monotonic()
+        tickets = [entry[2] for entry in self.waiting if not entry[2].future.done()]
+
+        def order(ticket: AdmissionTicket):
+            if (
+                ticket.deadline is not None
+                and ticket.deadline - now <= DISPATCH_DEADLINE_HORIZON
+            ):
+                return 0, ticket.deadline
+            return 1, ticket.rank
+
+        return sorted(tickets, key=order)
+
+    def __repr__(self) -> str:
+        return (
+            f"<InstrumentDispatcher instrument={self.db_instrument.id} in_use_by={self.in_use_by} "
+            f"shared_by={sorted(self.shared_by)} waiting={self.num_waiting}>"
+        )
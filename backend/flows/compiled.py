@@ -0,0 +1,437 @@
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from weakref import WeakValueDictionary
+
+from backend.flows.types import RawNode
+
+# Node types to ignore. Nodes without wires are ignored by default
+IGNORE_NODE_TYPES = {"comment"}
+
+VESTRA_NODE_PREFIX = "vestra:"
+
+# Robot move nodes, and the config fields holding their waypoints (in the order they are visited)
+MOTION_NODE_WAYPOINT_FIELDS = {
+    "vestra:ur3-movetojointwaypoint": ("waypoint_number",),
+    "vestra:ur3-move": ("source_waypoint_number", "destination_waypoint_number"),
+}
+
+
+class MotionStep:
+    """
+    The part of a robot move node's config needed to blend consecutive moves into one path.
+    """
+
+    __slots__ = ("instrument_id", "waypoints", "delay", "blend_radius")
+
+    def __init__(
+        self,
+        instrument_id: int,
+        waypoints: tuple[int, ...],
+        delay: float = 0.0,
+        blend_radius: float | None = None,
+    ):
+        self.instrument_id = instrument_id
+        # Waypoint numbers visited by the node
+        self.waypoints = waypoints
+        # Seconds the robot pauses between the waypoints
+        self.delay = delay
+        # Blend radius (m) at the node's waypoints, or None for the robot's default
+        self.blend_radius = blend_radius
+
+    @classmethod
+    def from_raw_node(cls, node: RawNode) -> MotionStep | None:
+        fields = MOTION_NODE_WAYPOINT_FIELDS.get(node["type"])
+        if fields is None:
+            return None
+        try:
+            blend_radius = node.get("blend_radius")
+            return cls(
+                int(node["instrument_id"]),
+                tuple(int(node[field]) for field in fields),
+                float(node.get("delay_between_movements") or 0),
+                float(blend_radius) if blend_radius not in (None, "") else None,
+            )
+        except (KeyError, TypeError, ValueError):
+            # Misconfigured - the node fails when it runs, and is never blended
+            return None
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, MotionStep):
+            return NotImplemented
+        return (
+            self.instrument_id == other.instrument_id
+            and self.waypoints == other.waypoints
+            and self.delay == other.delay
+            and self.blend_radius == other.blend_radius
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.instrument_id, self.waypoints))
+
+    def __repr__(self) -> str:
+        return f"<MotionStep instrument={self.instrument_id} waypoints={self.waypoints} delay={self.delay}>"
+
+
+class Node:
+    """
+    Compiled, immutable node of a flows graph.
+
+    Only the fields the orchestrator needs are kept (id, type, tab, wires and, for robot moves, the motion) -
+    function bodies, UI config etc. from flows.json are dropped. Node ids are interned, and the next Vestra node for every output is precomputed, so
+    walking a flow never scans wires or allocates. Nodes hold no reference to their graph.
+    """
+
+    __slots__ = ("id", "node_type", "tab", "wires", "next_vestra_ids", "motion")
+
+    def __init__(
+        self,
+        id: str,
+        node_type: str,
+        tab: str | None,
+        wires: tuple[tuple[str, ...], ...],
+        next_vestra_ids: tuple[str | None, ...],
+        motion: MotionStep | None = None,
+    ):
+        self.id = id
+        self.node_type = node_type
+        # ID of the flow (tab) the node is on
+        self.tab = tab
+        # IDs of the nodes connected to each output
+        self.wires = wires
+        # ID of the first Vestra node connected to each output, or None
+        self.next_vestra_ids = next_vestra_ids
+        # Waypoints etc. of robot move nodes, None for other nodes
+        self.motion = motion
+
+    @property
+    def has_wires(self) -> bool:
+        return len(self.wires) > 0
+
+    @property
+    def is_vestra_node(self) -> bool:
+        return self.node_type.startswith(VESTRA_NODE_PREFIX)
+
+    def next_ids(self, output_index=0) -> tuple[str, ...]:
+        if output_index >= len(self.wires):
+            return ()
+        return self.wires[output_index]
+
+    def next_vestra_id(self, output_index=0) -> str | None:
+        if output_index >= len(self.next_vestra_ids):
+            return None
+        return self.next_vestra_ids[output_index]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Node):
+            return NotImplemented
+        return (
+            self.id == other.id
+            and self.node_type == other.node_type
+            and self.tab == other.tab
+            and self.wires == other.wires
+            and self.next_vestra_ids == other.next_vestra_ids
+            and self.motion == other.motion
+        )
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    def __repr__(self) -> str:
+        return f"<Node id={self.id} type={self.node_type}>"
+
+
+class CompiledGraph:
+    """
+    Immutable snapshot of flows.json, compiled into Nodes indexed by id.
+    """
+
+    __slots__ = ("version", "nodes", "input_ids", "no_input_nodes", "__weakref__")
+
+    def __init__(
+        self,
+        nodes: dict[str, Node],
+        input_ids: dict[str, tuple[str, ...]],
+        no_input_nodes: tuple[str, ...],
+        version: int = 0,
+    ):
+        # Increases with every reload of flows.json
+        self.version = version
+        self.nodes = nodes
+        # key: node id, value: ids of the nodes that forward to it
+        self.input_ids = input_ids
+        self.no_input_nodes = no_input_nodes
+
+    @classmethod
+    def compile(
+        cls,
+        json_file: list[RawNode],
+        previous: CompiledGraph | None = None,
+        version: int = 0,
+    ) -> CompiledGraph:
+        """
+        Compile parsed flows.json into a new graph.
+
+        :param json_file: Parsed flows.json
+        :param previous: Graph compiled from the previous flows.json. Nodes that did not change are reused from it
+            instead of being rebuilt.
+        :param version: Version number of the new graph
+        :return: The compiled graph
+        """
+        previous_nodes = previous.nodes if previous is not None else {}
+
+        # First pass: keep the ids and types of nodes that belong in the graph
+        raw_nodes: list[RawNode] = []
+        node_types: dict[str, str] = {}
+        for node in json_file:
+            if "wires" not in node or node["type"] in IGNORE_NODE_TYPES:
+                continue
+            raw_nodes.append(node)
+            node_types[sys.intern(node["id"])] = sys.intern(node["type"])
+
+        # Second pass: build nodes with precomputed next Vestra nodes
+        nodes: dict[str, Node] = {}
+        inputs: dict[str, list[str]] = {}
+        for node in raw_nodes:
+            node_id = sys.intern(node["id"])
+            node_type = node_types[node_id]
+            raw_wires = node["wires"] or ()
+            tab = node.get("z") or None
+            motion = MotionStep.from_raw_node(node)
+
+            previous_node = previous_nodes.get(node_id)
+            if (
+                previous_node is not None
+                and previous_node.node_type == node_type
+                and previous_node.tab == tab
+                and previous_node.wires == tuple(map(tuple, raw_wires))
+                and previous_node.motion == motion
+                # the node's next Vestra nodes also depend on the types of the nodes it's wired to
+                and previous_node.next_vestra_ids
+                == tuple(
+                    _first_vestra_id(output, node_types)
+                    for output in previous_node.wires
+                )
+            ):
+                nodes[node_id] = previous_node
+                wires = previous_node.wires
+            else:
+                wires = tuple(
+                    tuple(sys.intern(output_id) for output_id in output)
+                    for output in raw_wires
+                )
+                nodes[node_id] = Node(
+                    node_id,
+                    node_type,
+                    sys.intern(tab) if tab else None,
+                    wires,
+                    tuple(_first_vestra_id(output, node_types) for output in wires),
+                    motion,
+                )
+            for output in wires:
+                for output_id in output:
+                    inputs.setdefault(output_id, []).append(node_id)
+
+        # Reuse the previous graph's input tuples too where they are unchanged
+        previous_input_ids = previous.input_ids if previous is not None else {}
+        input_ids = {}
+        for node_id, ids in inputs.items():
+            ids = tuple(ids)
+            previous_ids = previous_input_ids.get(node_id)
+            input_ids[node_id] = previous_ids if previous_ids == ids else ids
+        no_input_nodes = tuple(node_id for node_id in nodes if node_id not in input_ids)
+        return cls(nodes, input_ids, no_input_nodes, version)
+
+    def get_node(self, node_id: str) -> Node | None:
+        return self.nodes.get(node_id)
+
+    def next_nodes(self, node: Node, output_index=0) -> list[Node] | None:
+        output_ids = node.next_ids(output_index)
+        if len(output_ids) == 0:
+            return None
+        return [
+            self.nodes[output_id] for output_id in output_ids if output_id in self.nodes
+        ]
+
+    def next_vestra_node(self, node: Node, output_index=0) -> Node | None:
+        next_id = node.next_vestra_id(output_index)
+        return None if next_id is None else self.nodes[next_id]
+
+    def index_size(self) -> int:
+        """
+        Approximate size in bytes of the graph's own indexes, not counting its Nodes or the input tuples,
+        which are mostly shared between versions.
+        """
+        return (
+            sys.getsizeof(self.nodes)
+            + sys.getsizeof(self.input_ids)
+            + sys.getsizeof(self.no_input_nodes)
+        )
+
+    def motion_run(self, node_id: str) -> list[Node]:
+        """
+        The run of robot moves starting at `node_id` that can be executed as one blended path: each node is wired
+        directly (and only) to the next, all move the same robot, and none pauses between its waypoints.
+
+        :param node_id: ID of the first move node
+        :return: The nodes of the run, or an empty list if `node_id` can't start one
+        """
+        node = self.nodes.get(node_id)
+        if node is None or node.motion is None or node.motion.delay > 0:
+            return []
+
+        run = [node]
+        while True:
+            current = run[-1]
+            if len(current.wires) != 1 or len(current.wires[0]) != 1:
+                break
+            next_node = self.nodes.get(current.wires[0][0])
+            if (
+                next_node is None
+                or next_node.motion is None
+                or next_node.motion.instrument_id != node.motion.instrument_id
+                or next_node.motion.delay > 0
+                or next_node in run
+            ):
+                break
+            run.append(next_node)
+        return run
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __repr__(self) -> str:
+        return (
+            f"<CompiledGraph version={self.version} num_nodes={len(self.nodes)}, "
+            f"no_input_nodes={len(self.no_input_nodes)}>"
+        )
+
+
+class GraphVersions:
+    """
+    Keeps every version of the graph that is still in use.
+
+    A FlowRun is pinned to the current version when it starts and keeps walking that version until it completes,
+    even if flows.json is redeployed in the meantime, and even if one of its nodes fails and is run again. Versions share unchanged Nodes (see CompiledGraph.compile),
+    so they cost only the nodes that changed plus their indexes. A version is dropped as soon as it is neither the
+    current one nor pinned by a FlowRun.
+
+    Pins live in memory only: after a restart, in-progress FlowRuns are pinned to the then current version the next
+    time one of their nodes runs. FlowRuns that never finish (e.g. abandoned by Node-RED) lose their pin once none of
+    their nodes has run for `pin_ttl` seconds; they are swept when a new version is published, which is the only time
+    a stale pin keeps an old version alive.
+    """
+
+    def __init__(self, pin_ttl: float | None = None):
+        """
+        :param pin_ttl: Seconds after its last use that a FlowRun's pin is dropped, or None to keep pins until unpinned
+        """
+        self.current = CompiledGraph({}, {}, ())
+        # Versions still referenced, by version number. Entries disappear when the last reference goes away.
+        self.live: WeakValueDictionary[int, CompiledGraph] = WeakValueDictionary()
+        # key: FlowRun id, value: graph version the FlowRun is pinned to
+        self.pins: dict[int, CompiledGraph] = {}
+        # key: FlowRun id, value: time.monotonic() the pin was last used
+        self.pin_used_at: dict[int, float] = {}
+        self.pin_ttl = pin_ttl
+        self.expired_pins = 0
+        self.lock = threading.Lock()
+
+    @property
+    def next_version(self) -> int:
+        return self.current.version + 1
+
+    def publish(self, graph: CompiledGraph) -> None:
+        """
+        Make `graph` the current version. FlowRuns started from now on are pinned to it.
+        """
+        with self.lock:
+            self.live[graph.version] = graph
+            self.current = graph
+            self._sweep()
+
+    def pin(self, flow_run_id: int) -> CompiledGraph:
+        """
+        Get the graph version a FlowRun runs on, pinning it to the current version if it isn't pinned yet.
+        """
+        with self.lock:
+            self.pin_used_at[flow_run_id] = time.monotonic()
+            return self.pins.setdefault(flow_run_id, self.current)
+
+    def unpin(self, flow_run_id: int) -> None:
+        """
+        Release a FlowRun's version, once the FlowRun completed.
+        """
+        with self.lock:
+            self.pins.pop(flow_run_id, None)
+            self.pin_used_at.pop(flow_run_id, None)
+
+    def _sweep(self) -> None:
+        # Drop the pins of FlowRuns that stopped running without completing. Called with the lock held.
+        if self.pin_ttl is None:
+            return
+        expire_before = time.monotonic() - self.pin_ttl
+        for flow_run_id, used_at in list(self.pin_used_at.items()):
+            if used_at < expire_before:
+                del self.pins[flow_run_id]
+                del self.pin_used_at[flow_run_id]
+                self.expired_pins += 1
+
+    def memory_report(self) -> list[dict]:
+        """
+        Report each live version's pinned FlowRuns and approximate memory.
+
+        `bytes` counts the version's indexes and the Nodes no other live version shares, i.e. roughly what
+        would be freed if only this version was dropped. `shared_nodes` are Nodes shared with another version.
+        """
+        with self.lock:
+            graphs = sorted(self.live.values(), key=lambda graph: graph.version)
+            pin_counts: dict[int, int] = {}
+            for graph in self.pins.values():
+                pin_counts[graph.version] = pin_counts.get(graph.version, 0) + 1
+
+        node_counts: dict[int, int] = {}
+        for graph in graphs:
+            for node in graph.nodes.values():
+                node_counts[id(node)] = node_counts.get(id(node), 0) + 1
+
+        report = []
+        for graph in graphs:
+            unique_nodes = [
+                node for node in graph.nodes.values() if node_counts[id(node)] == 1
+            ]
+            report.append(
+                {
+                    "version": graph.version,
+                    "current": graph is self.current,
+                    "flow_runs": pin_counts.get(graph.version, 0),
+                    "nodes": len(graph.nodes),
+                    "shared_nodes": len(graph.nodes) - len(unique_nodes),
+                    "bytes": graph.index_size()
+                    + sum(node_size(node) for node in unique_nodes),
+                }
+            )
+        return report
+
+
+def node_size(node: Node) -> int:
+    """
+    Approximate size in bytes of a Node and the tuples it owns. Ids are interned, so they are not counted.
+    """
+    return (
+        sys.getsizeof(node)
+        + sys.getsizeof(node.wires)
+        + sum(sys.getsizeof(output) for output in node.wires)
+        + sys.getsizeof(node.next_vestra_ids)
+        + (sys.getsizeof(node.motion) if node.motion is not None else 0)
+    )
+
+
+def _first_vestra_id(output: tuple[str, ...], node_types: dict[str, str]) -> str | None:
+    for output_id in output:
+        node_type = node_types.get(output_id)
+        if node_type is not None and node_type.startswith(VESTRA_NODE_PREFIX):
+            return output_id
+    return None
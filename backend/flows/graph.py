@@ -1,151 +1,225 @@
 from __future__ import annotations
 
+import hashlib
 import logging
 import json
+import threading
+import time
 from os import path, getenv
 from pathlib import Path
 
-from watchdog.events import FileSystemEventHandler, DirMovedEvent, FileMovedEvent
+from watchdog.events import (
+    FileSystemEvent,
+    FileSystemEventHandler,
+    DirMovedEvent,
+    FileMovedEvent,
+)
 from watchdog.observers import Observer
 
-from backend.flows.types import RawNode
-
-# Node types to ignore. Nodes without wires are ignored by default
-IGNORE_NODE_TYPES = {"comment"}
+from backend.flows.compiled import CompiledGraph, GraphVersions, Node
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait after the last change to flows.json before reloading it. Node-RED
+# deploys produce several filesystem events, which are coalesced into one reload.
+FLOWS_RELOAD_DEBOUNCE = float(getenv("FLOWS_RELOAD_DEBOUNCE", "0.25"))
+# Hours after its last node ran that a FlowRun which never finished stops holding on to its graph version
+# (0 keeps it until the FlowRun completes)
+FLOW_RUN_PIN_TTL_HOURS = float(getenv("FLOW_RUN_PIN_TTL_HOURS", "24"))
+
 observer = Observer()
 
 
+class ReloadMetrics:
+    """
+    Counters and timings for flows.json reloads.
+    """
+
+    def __init__(self):
+        self.reloads = 0
+        # reloads skipped because flows.json had not changed
+        self.unchanged = 0
+        # reloads that failed, e.g. because flows.json was mid-write or invalid
+        self.failures = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        # number of nodes rebuilt (not reused from the previous graph) by the last reload
+        self.last_nodes_rebuilt = 0
+        self.last_reload_at: float | None = None
+
+    def record(self, duration: float, nodes_rebuilt: int) -> None:
+        self.reloads += 1
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.total_duration += duration
+        self.last_nodes_rebuilt = nodes_rebuilt
+        self.last_reload_at = time.time()
+
+    def as_dict(self) -> dict:
+        return {
+            "reloads": self.reloads,
+            "unchanged": self.unchanged,
+            "failures": self.failures,
+            "last_duration": self.last_duration,
+            "max_duration": self.max_duration,
+            "mean_duration": (
+                self.total_duration / self.reloads if self.reloads else 0.0
+            ),
+            "last_nodes_rebuilt": self.last_nodes_rebuilt,
+            "last_reload_at": self.last_reload_at,
+        }
+
+
 class FlowsGraph:
     class FlowsJsonEventListener(FileSystemEventHandler):
-        def __init__(self, on_flows_changed: callable[[dict], None]):
+        """
+        Schedules a reload when flows.json is written, created or moved into place.
+
+        Runs on the watchdog thread, so it only (re)starts the debounce timer - the reload itself
+        runs on the timer's thread.
+        """
+
+        def __init__(self, on_flows_changed: callable[[], None], debounce: float):
             self.on_flows_changed = on_flows_changed
+            self.debounce = debounce
+            self.timer: threading.Timer | None = None
+            self.lock = threading.Lock()
+
+        def schedule(self) -> None:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                self.timer = threading.Timer(self.debounce, self.on_flows_changed)
+                self.timer.daemon = True
+                self.timer.start()
+
+        def cancel(self) -> None:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+
+        def on_modified(self, event: FileSystemEvent) -> None:
+            if not event.is_directory and event.src_path.endswith("flows.json"):
+                self.schedule()
+
+        def on_created(self, event: FileSystemEvent) -> None:
+            if not event.is_directory and event.src_path.endswith("flows.json"):
+                self.schedule()
 
         def on_moved(self, event: DirMovedEvent | FileMovedEvent) -> None:
             if event.dest_path.endswith("flows.json"):
-                # print out the number of lines in flows.json
-                with open(event.dest_path) as f:
-                    json_file = json.load(f)
-                    self.on_flows_changed(json_file)
+                self.schedule()
 
     def __init__(self, node_red_dir: str):
-        # self.graph is a dictionary of RawNodes, indexed by their id
-        self.raw_graph: dict[str, RawNode] = {}
-        # key: node id, value: nodes that forward to it
-        self.input_graph: dict[str, list[RawNode]] = {}
-        self.no_input_nodes: dict[str, None] = {}
+        self.flows_path = path.join(node_red_dir, "flows.json")
+        # Compiled snapshots of flows.json. Never modified - a reload compiles a new graph and publishes
+        # it in one assignment, so readers always see either the old or the new graph.
+        self.versions = GraphVersions(
+            FLOW_RUN_PIN_TTL_HOURS * 3600 if FLOW_RUN_PIN_TTL_HOURS > 0 else None
+        )
+        self.metrics = ReloadMetrics()
+        # digest of the flows.json the current graph was compiled from
+        self.digest: bytes | None = None
+        # serializes reloads; readers never take it
+        self.reload_lock = threading.Lock()
 
         # read in the graph and process it
         logger.info("Reading and processing flows.json")
-        with open(path.join(node_red_dir, "flows.json")) as f:
-            json_file = json.load(f)
-            self._on_flows_changed(json_file)
-        logger.debug(f"no_input_nodes: {self.no_input_nodes}")
+        self.reload(raise_errors=True)
+        logger.debug(f"no_input_nodes: {self.compiled.no_input_nodes}")
         logger.info(
-            f"Successfully processed flows.json, {len(self.raw_graph)} nodes found"
+            f"Successfully processed flows.json, {len(self.compiled)} nodes found"
         )
 
-        self.listener = self.FlowsJsonEventListener(self._on_flows_changed)
+        self.listener = self.FlowsJsonEventListener(
+            self._on_flows_changed, FLOWS_RELOAD_DEBOUNCE
+        )
         observer.schedule(self.listener, path=node_red_dir, recursive=False)
         observer.start()
 
     def __del__(self):
+        self.listener.cancel()
         observer.stop()
         observer.join()
 
-    def _on_flows_changed(self, json_file: list[RawNode]):
+    def _on_flows_changed(self):
         logger.info("flows.json updated, processing")
+        if self.reload():
+            logger.debug(f"no_input_nodes: {self.compiled.no_input_nodes}")
+            logger.info(
+                f"flows.json update successful, {len(self.compiled)} nodes found, "
+                f"{self.metrics.last_nodes_rebuilt} rebuilt in {self.metrics.last_duration * 1000:.1f} ms"
+            )
+            for version in self.versions.memory_report():
+                logger.info(f"flows graph version: {version}")
+
+    def reload(self, raise_errors: bool = False) -> bool:
+        """
+        Read flows.json and swap in a newly compiled graph. Nodes that did not change are shared with
+        the previous graph. Does nothing if the file's contents did not change.
+
+        :param raise_errors: Raise if flows.json can't be read or parsed, instead of logging and keeping
+            the current graph
+        :return: Whether a new graph was swapped in
+        """
+        with self.reload_lock:
+            start = time.perf_counter()
+            try:
+                with open(self.flows_path, "rb") as f:
+                    contents = f.read()
+                digest = hashlib.blake2b(contents, digest_size=16).digest()
+                if digest == self.digest:
+                    self.metrics.unchanged += 1
+                    return False
+
+                previous = self.compiled
+                compiled = CompiledGraph.compile(
+                    json.loads(contents), previous, self.versions.next_version
+                )
+            except (OSError, ValueError) as e:
+                # Usually flows.json was read mid-write; the write's own event schedules another reload
+                self.metrics.failures += 1
+                if raise_errors:
+                    raise
+                logger.error(
+                    f"Failed to reload flows.json, keeping the current graph: {e}"
+                )
+                return False
+
+            nodes_rebuilt = sum(
+                1
+                for node_id, node in compiled.nodes.items()
+                if previous.nodes.get(node_id) is not node
+            )
+            self.versions.publish(compiled)
+            self.digest = digest
+            self.metrics.record(time.perf_counter() - start, nodes_rebuilt)
+            return True
 
-        # clear the graph
-        self.raw_graph = {}
-        self.input_graph = {}
-        self.no_input_nodes = {}
-        # parse all nodes into RawNodes
-        for node in json_file:
-            if "wires" not in node or node["type"] in IGNORE_NODE_TYPES:
-                continue
-
-            self.raw_graph[node["id"]] = node
-
-            if len(node["wires"]) > 0:
-                for output_id in node["wires"]:
-                    for input_id in output_id:
-                        if input_id not in self.input_graph:
-                            self.input_graph[input_id] = []
-
-                        self.input_graph[input_id].append(node)
-
-                        if input_id in self.no_input_nodes:
-                            del self.no_input_nodes[input_id]
-
-            # if the node has anything pointing into it,
-            # remove from no_input_nodes
-            if node["id"] in self.input_graph:
-                if node["id"] in self.no_input_nodes:
-                    del self.no_input_nodes[node["id"]]
-            else:
-                self.no_input_nodes[node["id"]] = None
-
-        logger.debug(f"no_input_nodes: {self.no_input_nodes}")
-        logger.info(f"flows.json update successful, {len(self.raw_graph)} nodes found")
+    @property
+    def compiled(self) -> CompiledGraph:
+        """
+        The current version of the graph
+        """
+        return self.versions.current
+
+    def pin(self, flow_run_id: int) -> CompiledGraph:
+        """
+        Get the graph version a FlowRun runs on. A FlowRun stays on the version it started on,
+        even if flows.json changes before it completes.
+        """
+        return self.versions.pin(flow_run_id)
+
+    def unpin(self, flow_run_id: int) -> None:
+        self.versions.unpin(flow_run_id)
 
     def get_node(self, node_id: str) -> Node | None:
-        if node_id not in self.raw_graph:
-            return None
-
-        return Node(self, self.raw_graph[node_id])
+        return self.compiled.get_node(node_id)
 
     def __repr__(self):
-        return f"<FlowsGraph num_nodes={len(self.raw_graph)}, no_input_nodes={self.no_input_nodes}>"
-
-
-class Node:
-    def __init__(self, graph: FlowsGraph, raw_node: RawNode):
-        self.graph = graph
-        self.raw_node = raw_node
-        self.id = self.raw_node["id"]
-        self.node_type = self.raw_node["type"]
-
-    @property
-    def has_wires(self) -> bool:
-        return "wires" in self.raw_node and len(self.raw_node["wires"]) > 0
-
-    def next_nodes(self, output_index=0) -> list[Node] | None:
-        if not self.has_wires:
-            return None
-
-        output_ids = self.raw_node["wires"][output_index]
-        if len(output_ids) == 0:
-            return None
-
-        return [
-            Node(self.graph, self.graph.raw_graph[output_id])
-            for output_id in output_ids
-        ]
-
-    def next_vestra_node(self, output_index=0) -> Node | None:
-        if not self.has_wires:
-            return None
-
-        output_ids = self.raw_node["wires"][output_index]
-        if len(output_ids) == 0:
-            return None
-
-        for output_id in output_ids:
-            node = Node(self.graph, self.graph.raw_graph[output_id])
-            if node.is_vestra_node:
-                return node
-
-        return None
-
-    @property
-    def is_vestra_node(self):
-        return self.node_type.startswith("vestra:")
-
-    def __repr__(self) -> str:
-        return f"<Node id={self.raw_node['id']} type={self.raw_node['type']}>"
+        return f"<FlowsGraph num_nodes={len(self.compiled)}, no_input_nodes={self.compiled.no_input_nodes}>"
 
 
 flows_graph = FlowsGraph(
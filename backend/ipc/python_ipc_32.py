@@ -1,24 +1,224 @@
+from __future__ import annotations
+
+import collections
+import json
+import logging
+import os
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
 
 # needs to run 32 bit python
+from backend.ipc.python_ipc_servicer import (
+    array_descriptors_from_proto,
+    array_descriptors_to_proto,
+)
+from backend.ipc.shared_arrays import (
+    ArrayDescriptorDict,
+    SharedArrayExporter,
+    SharedArrays,
+)
 from backend.node_connector_pb2 import ipc_template_pb2, ipc_template_pb2_grpc
 import grpc
 
+logger = logging.getLogger(__name__)
+
+# Results kept to answer commands that are sent again after a reconnect
+RESULT_HISTORY = 1024
+RECONNECT_INITIAL = 0.5
+RECONNECT_MAX = 10.0
+
+# Segments this process shares with the backend, freed when the backend releases them
+exporter = SharedArrayExporter()
+
+
+class ArrayResult:
+    """
+    Returned by a handler to send arrays back through shared memory, e.g. a plate read:
+
+        descriptors, views = exporter.allocate({"reads": ((384, 200, 2), "<f8")})
+        views["reads"][...] = ...  # filled in place, no copy
+        return ArrayResult({"cycles": 200}, descriptors)
+
+    `exporter.export(arrays)` copies arrays that already exist into shared memory instead.
+    """
+
+    def __init__(self, value: Any, descriptors: list[ArrayDescriptorDict]):
+        self.value = value
+        self.descriptors = descriptors
+
+
+class IpcClient:
+    """
+    Client side of `IpcCommunicationService.Connect`, run by the 32-bit process.
+
+    Commands are run one at a time, in order, by `handlers[function_name](function_input, **arguments)`, and their
+    results are sent back with the command's correlation id. A command with array arguments also gets
+    `arrays=SharedArrays`, valid until the handler returns; a handler returns arrays with an ArrayResult.
+
+    The stream is reopened with backoff when it drops. A command sent again after a reconnect is answered from the
+    results kept, or when it finishes if it's still running - it's never run twice.
+    """
+
+    def __init__(
+        self,
+        handlers: dict[str, Callable[..., Any]],
+        target: str = "localhost:50051",
+        client_pid: int | None = None,
+    ):
+        self.handlers = handlers
+        self.target = target
+        self.client_pid = os.getpid() if client_pid is None else client_pid
+        # Drivers are rarely thread-safe, so commands run on one thread
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="ipc-command")
+        self.lock = threading.Lock()
+        # key: correlation id, value: CommandResult
+        self.results: collections.OrderedDict[int, ipc_template_pb2.CommandResult] = (
+            collections.OrderedDict()
+        )
+        self.running: set[int] = set()
+        # Messages for the stream that is currently open
+        self.outgoing: queue.Queue | None = None
+        self.call = None
+        self.stopped = threading.Event()
+        self.executed = 0
+        self.connects = 0
+
+    def run(self) -> None:
+        """
+        Keep a stream to the backend open until `stop()`.
+        """
+        delay = RECONNECT_INITIAL
+        while not self.stopped.is_set():
+            try:
+                with grpc.insecure_channel(self.target) as channel:
+                    self._stream(
+                        ipc_template_pb2_grpc.IpcCommunicationServiceStub(channel)
+                    )
+                delay = RECONNECT_INITIAL
+            except grpc.RpcError as e:
+                if self.stopped.is_set():
+                    return
+                logger.warning(
+                    f"IPC stream failed ({e.code()}), reconnecting in {delay:.1f} s"
+                )
+                self.stopped.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.drop()
+        self.executor.shutdown(wait=False)
+        exporter.release_all()
+
+    def drop(self) -> None:
+        """
+        Close the current stream; `run` opens a new one.
+        """
+        with self.lock:
+            if self.call is not None:
+                self.call.cancel()
+
+    def report_status(self, status_message: str) -> None:
+        self._send(
+            ipc_template_pb2.ClientMessage(
+                status=ipc_template_pb2.StatusUpdate(
+                    client_pid=self.client_pid, status_message=status_message
+                )
+            )
+        )
+
+    def _stream(self, stub: ipc_template_pb2_grpc.IpcCommunicationServiceStub) -> None:
+        outgoing = queue.Queue()
+        outgoing.put(
+            ipc_template_pb2.ClientMessage(
+                hello=ipc_template_pb2.ClientHello(client_pid=self.client_pid)
+            )
+        )
+        with self.lock:
+            self.outgoing = outgoing
+            self.call = stub.Connect(self._messages(outgoing))
+            call = self.call
+        self.connects += 1
+        try:
+            for message in call:
+                if message.WhichOneof("message") == "release":
+                    exporter.release(message.release.segment)
+                else:
+                    self._on_command(message.command)
+        finally:
+            with self.lock:
+                if self.outgoing is outgoing:
+                    self.outgoing = None
+                    self.call = None
+            outgoing.put(None)
+
+    @staticmethod
+    def _messages(outgoing: queue.Queue):
+        while (message := outgoing.get()) is not None:
+            yield message
+
+    def _send(self, message: ipc_template_pb2.ClientMessage) -> None:
+        with self.lock:
+            outgoing = self.outgoing
+        # Results sent while disconnected are kept, and sent when the command is sent again
+        if outgoing is not None:
+            outgoing.put(message)
+
+    def _on_command(self, command: ipc_template_pb2.Command) -> None:
+        with self.lock:
+            result = self.results.get(command.correlation_id)
+            running = command.correlation_id in self.running
+            if result is None and not running:
+                self.running.add(command.correlation_id)
+        if result is not None:
+            self._send(ipc_template_pb2.ClientMessage(result=result))
+        elif not running:
+            self.executor.submit(self._execute, command)
+
+    def _execute(self, command: ipc_template_pb2.Command) -> None:
+        try:
+            handler = self.handlers[command.function_name]
+            arguments = json.loads(command.arguments_json or "{}")
+            if command.arrays:
+                with SharedArrays(
+                    array_descriptors_from_proto(command.arrays)
+                ) as arrays:
+                    value = handler(command.FunctionInput, arrays=arrays, **arguments)
+            else:
+                value = handler(command.FunctionInput, **arguments)
+            descriptors = []
+            if isinstance(value, ArrayResult):
+                value, descriptors = value.value, value.descriptors
+            result = ipc_template_pb2.CommandResult(
+                correlation_id=command.correlation_id,
+                success=True,
+                result_json=json.dumps(value),
+                arrays=array_descriptors_to_proto(descriptors),
+            )
+        except Exception as e:
+            result = ipc_template_pb2.CommandResult(
+                correlation_id=command.correlation_id, success=False, error=repr(e)
+            )
+        with self.lock:
+            self.executed += 1
+            self.running.discard(command.correlation_id)
+            self.results[command.correlation_id] = result
+            if len(self.results) > RESULT_HISTORY:
+                self.results.popitem(last=False)
+        self._send(ipc_template_pb2.ClientMessage(result=result))
 
-def run():
-    # NOTE(gRPC Python Team): .close() is possible on a channel and should be
-    # used in circumstances in which the with statement does not fit the needs
-    # of the code.
-    with grpc.insecure_channel("localhost:50051") as channel:
-        stub = ipc_template_pb2_grpc.IpcCommunicationServiceStub(channel)
 
-        request = ipc_template_pb2.CommandRequest(command="test command")
-        response = stub.ExecuteCommand(request)
-        stub.AnotherCommand
-        print("Received response from gRPC:")
-        print(response)
+def ping(function_input: ipc_template_pb2.GeneralizedFunctionInput, **arguments):
+    return {"pid": os.getpid(), "arguments": arguments}
 
 
-while True:
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     print("32 bit python running")
-    time.sleep(1)
+    # Set by the WorkerPool that started this process
+    IpcClient(
+        {"ping": ping}, target=os.environ.get("IPC_TARGET", "localhost:50051")
+    ).run()
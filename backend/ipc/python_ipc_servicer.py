@@ -1,100 +1,357 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
-import queue
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator
+
+import grpc
 
 if TYPE_CHECKING:
+    import numpy as np
+
     from backend.devices.device_abc import ABCRobotCommand
 
+from backend.ipc.shared_arrays import (
+    ArrayDescriptorDict,
+    SharedArrayExporter,
+    SharedArrays,
+)
 from backend.node_connector_pb2 import ipc_template_pb2, ipc_template_pb2_grpc
 
+logger = logging.getLogger(__name__)
 
-client_incoming_queues = {}  # key = pid,
-client_outgoing_queues = {}  # key = pid
+# Status messages kept per client
+STATUS_HISTORY = 100
 
+# Unique across restarts of the backend, so a client can't mistake a new command for one it already answered
+_correlation_ids = itertools.count(time.time_ns())
 
-class IpcConnectionServicer(ipc_template_pb2_grpc.IpcCommunicationServiceServicer):
-    def ReportStatus(self, request_iterator, context):
 
-        try:
-            for status_update in request_iterator:
-                client_pid = status_update.client_pid
-                status_message = status_update.status_message
+class IpcCommandError(Exception):
+    """
+    Raised when the 32-bit process reports that a command failed.
+    """
 
-                print(f"received status_update: {status_message}")
-                client_incoming_queues[client_pid].put(status_message)
-                # TODO do something
-        except Exception as e:
-            print(f"Error reading from client {e}")
-        response = ipc_template_pb2.StatusUpdateResponse()
-        return response
 
-    def GetCommand(self, request, context):
+class IpcArrayResult:
+    """
+    Result of a command that returned arrays: its value, and zero-copy views of the arrays (see SharedArrays).
 
-        client_pid = request.client_pid
-        print(f"Client {client_pid} connected.")
+    Close it (or use it as a context manager) once done with the arrays, so the process can free them.
+    """
 
-        # Create a dedicated queue for this client's outgoing messages.
-        response_queue = queue.Queue()
-        update_queue = queue.Queue()
-        client_incoming_queues[client_pid] = update_queue
-        client_outgoing_queues[client_pid] = response_queue
+    def __init__(self, value: Any, arrays: SharedArrays):
+        self.value = value
+        self.arrays = arrays
 
-        # Start a thread to process incoming messages from the client.
-        try:
-            print(f"Received from {client_pid}: {request}")
-        except Exception as e:
-            print(f"Error reading from client {client_pid}: {e}")
+    def close(self) -> None:
+        self.arrays.close()
+
+    def __enter__(self) -> IpcArrayResult:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"<IpcArrayResult value={self.value!r} arrays={self.arrays!r}>"
+
+
+class PendingCommand:
+    """
+    A command waiting for its result.
+    """
+
+    def __init__(self, message: ipc_template_pb2.ServerMessage):
+        self.message = message
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Whether the command was handed to a stream, so sending it again is a resend
+        self.sent = False
+
+
+class IpcSession:
+    """
+    Commands for one 32-bit process, kept across its connections.
+
+    Commands stay pending until their result arrives. While the process is disconnected they wait, and when it
+    (re)connects every pending command is sent again, in order - the process answers commands it already ran from
+    its own record of results, so none is lost or run twice. Everything runs on the event loop, so there are no locks.
+    """
+
+    def __init__(self, client_pid: int):
+        self.client_pid = client_pid
+        # key: correlation id, in the order the commands were made
+        self.pending: dict[int, PendingCommand] = {}
+        # Messages for the stream that is currently connected; None ends the stream
+        self.outbox: asyncio.Queue[ipc_template_pb2.ServerMessage | None] | None = None
+        self.connected = asyncio.Event()
+        self.statuses: collections.deque[str] = collections.deque(maxlen=STATUS_HISTORY)
+        # Segments holding array arguments of commands in flight
+        self.exporter = SharedArrayExporter()
+        # Segments of the process to release once it's connected again
+        self.releases: list[str] = []
+
+        self.connects = 0
+        self.resent = 0
+        self.duplicate_results = 0
+
+    def attach(self) -> asyncio.Queue:
+        """
+        Start a stream to the process (replacing the previous one, if it's still open) and queue the pending
+        commands on it.
+
+        :return: The stream's outbox
+        """
+        if self.outbox is not None:
+            self.outbox.put_nowait(None)
+        self.outbox = asyncio.Queue()
+        for segment in self.releases:
+            self.outbox.put_nowait(_release_message(segment))
+        self.releases.clear()
+        for pending in self.pending.values():
+            if pending.sent:
+                self.resent += 1
+            pending.sent = True
+            self.outbox.put_nowait(pending.message)
+        self.connects += 1
+        self.connected.set()
+        logger.info(
+            f"IPC client {self.client_pid} connected, {len(self.pending)} commands pending"
+        )
+        return self.outbox
+
+    def detach(self, outbox: asyncio.Queue) -> None:
+        if self.outbox is outbox:
+            self.outbox = None
+            self.connected.clear()
+            logger.info(
+                f"IPC client {self.client_pid} disconnected, {len(self.pending)} commands pending"
+            )
 
-        # def read_client_messages():
-        #     try:
-        #         print(f"Received from {client_id}: {request}")
-        #     except Exception as e:
-        #         print(f"Error reading from client {client_id}: {e}")
+    async def call(
+        self,
+        function_name: str,
+        arguments: dict | None = None,
+        function_input: ipc_template_pb2.GeneralizedFunctionInput | None = None,
+        timeout: float | None = None,
+        arrays: dict[str, np.ndarray] | None = None,
+    ) -> Any:
+        """
+        Run a function in the process and wait for its result. If the process isn't connected, the command waits
+        for it.
 
+        :param function_name: Name of the function to run
+        :param arguments: Keyword arguments, JSON-serializable
+        :param function_input: Arguments in the generalized form, for drivers that take it
+        :param timeout: Seconds to wait for the result, or None to wait as long as it takes
+        :param arrays: Array arguments, passed through shared memory
+        :return: The function's return value, or an IpcArrayResult if it returned arrays
+        :raises IpcCommandError: if the function failed in the process
+        """
+        correlation_id = next(_correlation_ids)
+        descriptors = self.exporter.export(arrays) if arrays else []
+        pending = PendingCommand(
+            ipc_template_pb2.ServerMessage(
+                command=ipc_template_pb2.Command(
+                    correlation_id=correlation_id,
+                    function_name=function_name,
+                    FunctionInput=function_input,
+                    arguments_json=json.dumps(arguments or {}),
+                    arrays=array_descriptors_to_proto(descriptors),
+                )
+            )
+        )
+        self.pending[correlation_id] = pending
+        if self.outbox is not None:
+            pending.sent = True
+            self.outbox.put_nowait(pending.message)
         try:
-            # Main loop: wait for messages in the response queue.
-            while True:
-                try:
-                    # Block until a message is available.
-                    message = response_queue.get(timeout=1.0)
-                    yield message
-                except queue.Empty:
-                    # Optionally, check for termination conditions here.
-                    pass
+            return await asyncio.wait_for(pending.future, timeout)
         finally:
-            # Cleanup when the client disconnects.
-            del client_outgoing_queues[client_pid]
-            print(f"Client {client_pid} disconnected.")
+            self.pending.pop(correlation_id, None)
+            if descriptors:
+                # The process is done reading them once it has answered
+                self.exporter.release(descriptors[0]["segment"])
+
+    def resolve(self, result: ipc_template_pb2.CommandResult) -> None:
+        pending = self.pending.pop(result.correlation_id, None)
+        if pending is None or pending.future.done():
+            # Answered already (before a reconnect), or given up on
+            self.duplicate_results += 1
+            if result.arrays:
+                self.release({descriptor.segment for descriptor in result.arrays})
+            return
+        if not result.success:
+            pending.future.set_exception(
+                IpcCommandError(f"IPC client {self.client_pid}: {result.error}")
+            )
+            return
+
+        value = json.loads(result.result_json) if result.result_json else None
+        if not result.arrays:
+            pending.future.set_result(value)
+            return
+        try:
+            arrays = SharedArrays(
+                array_descriptors_from_proto(result.arrays), self.release
+            )
+        except OSError as e:
+            pending.future.set_exception(
+                IpcCommandError(
+                    f"IPC client {self.client_pid}: couldn't map its arrays: {e}"
+                )
+            )
+            return
+        pending.future.set_result(IpcArrayResult(value, arrays))
 
+    def release(self, segments) -> None:
+        """
+        Tell the process it may free segments it shared.
+        """
+        for segment in segments:
+            if self.outbox is not None:
+                self.outbox.put_nowait(_release_message(segment))
+            else:
+                self.releases.append(segment)
 
-###
+    def fail_all(self, exc: Exception) -> None:
+        """
+        Fail every pending command, e.g. because the process exited and will never answer.
+        """
+        for pending in self.pending.values():
+            if not pending.future.done():
+                pending.future.set_exception(exc)
+        self.pending.clear()
+        self.releases.clear()
 
+    def report_status(self, status_message: str) -> None:
+        logger.info(f"IPC client {self.client_pid} status: {status_message}")
+        self.statuses.append(status_message)
 
-def send_message_to_client(client_id, general_input: ABCRobotCommand):
+    def __repr__(self) -> str:
+        return (
+            f"<IpcSession client={self.client_pid} connected={self.connected.is_set()} "
+            f"pending={len(self.pending)} resent={self.resent}>"
+        )
+
+
+class IpcSessions:
     """
-    Helper function to send a message to a specific client.
+    Sessions of the 32-bit processes, by the pid they report.
     """
-    if client_id in client_outgoing_queues:
 
-        function_input = generalized_function_input_helper(general_input)
-        response_message = ipc_template_pb2.CommandResponse(
-            FunctionInput=function_input
-        )
-        client_outgoing_queues[client_id].put(response_message)
-        print(f"Sent to {client_id}")
-    else:
-        print(f"Client {client_id} is not connected.")
+    def __init__(self):
+        self.sessions: dict[int, IpcSession] = {}
 
+    def get(self, client_pid: int) -> IpcSession:
+        session = self.sessions.get(client_pid)
+        if session is None:
+            session = self.sessions[client_pid] = IpcSession(client_pid)
+        return session
 
-def generalized_function_input_helper(general_input: ABCRobotCommand):
-    outgoing_message = ipc_template_pb2.GeneralizedFunctionInput()
+    def remove(self, client_pid: int) -> IpcSession | None:
+        """
+        Forget a process that exited, so its pid can be reused.
+        """
+        return self.sessions.pop(client_pid, None)
+
+    async def call(self, client_pid: int, function_name: str, **kwargs) -> Any:
+        """
+        Run a function in a 32-bit process, see `IpcSession.call`.
+        """
+        return await self.get(client_pid).call(function_name, **kwargs)
+
+
+ipc_sessions = IpcSessions()
+
+
+class IpcConnectionServicer(ipc_template_pb2_grpc.IpcCommunicationServiceServicer):
+    async def Connect(
+        self, request_iterator: AsyncIterator[ipc_template_pb2.ClientMessage], context
+    ) -> AsyncIterator[ipc_template_pb2.ServerMessage]:
+        requests = request_iterator.__aiter__()
+        try:
+            first = await requests.__anext__()
+        except StopAsyncIteration:
+            return
+        if first.WhichOneof("message") != "hello":
+            await context.abort(
+                grpc.StatusCode.FAILED_PRECONDITION,
+                "the first message must be a hello",
+            )
+
+        session = ipc_sessions.get(first.hello.client_pid)
+        outbox = session.attach()
+        # Results come in on their own task, while this one sends commands
+        reader = asyncio.create_task(self._read(session, requests, outbox))
+        try:
+            while (message := await outbox.get()) is not None:
+                yield message
+        finally:
+            reader.cancel()
+            session.detach(outbox)
+
+    async def _read(
+        self,
+        session: IpcSession,
+        requests: AsyncIterator[ipc_template_pb2.ClientMessage],
+        outbox: asyncio.Queue,
+    ) -> None:
+        try:
+            async for message in requests:
+                kind = message.WhichOneof("message")
+                if kind == "result":
+                    session.resolve(message.result)
+                elif kind == "status":
+                    session.report_status(message.status.status_message)
+        except Exception as e:
+            logger.warning(f"Error reading from IPC client {session.client_pid}: {e!r}")
+        finally:
+            # The process closed its side; end ours, so it can reconnect
+            outbox.put_nowait(None)
+
+
+def _release_message(segment: str) -> ipc_template_pb2.ServerMessage:
+    return ipc_template_pb2.ServerMessage(
+        release=ipc_template_pb2.ReleaseSegment(segment=segment)
+    )
+
+
+def array_descriptors_to_proto(
+    descriptors: list[ArrayDescriptorDict],
+) -> list[ipc_template_pb2.ArrayDescriptor]:
+    return [
+        ipc_template_pb2.ArrayDescriptor(**descriptor) for descriptor in descriptors
+    ]
+
+
+def array_descriptors_from_proto(
+    descriptors,
+) -> list[ArrayDescriptorDict]:
+    return [
+        ArrayDescriptorDict(
+            name=descriptor.name,
+            segment=descriptor.segment,
+            dtype=descriptor.dtype,
+            shape=list(descriptor.shape),
+            offset=descriptor.offset,
+        )
+        for descriptor in descriptors
+    ]
 
-    outgoing_message.x_position = general_input.x_position
-    outgoing_message.y_position = general_input.y_position
-    outgoing_message.waypoint_number = general_input.waypoint_number
-    outgoing_message.string_input = general_input.string_input
-    outgoing_message.ip_add = general_input.ip_add
-    outgoing_message.sub_function_name = general_input.sub_function_name
 
-    return outgoing_message
+def generalized_function_input_helper(
+    general_input: ABCRobotCommand,
+) -> ipc_template_pb2.GeneralizedFunctionInput:
+    return ipc_template_pb2.GeneralizedFunctionInput(
+        x_position=general_input.get("x_position", 0),
+        y_position=general_input.get("y_position", 0),
+        waypoint_number=general_input.get("waypoint_number", 0),
+        string_input=general_input.get("string_input", ""),
+        ip_add=general_input.get("ip_add", ""),
+        sub_function_name=general_input.get("sub_function_name", ""),
+    )
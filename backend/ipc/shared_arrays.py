@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import logging
+import os
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, TypedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Byte alignment of arrays in a segment
+ALIGNMENT = 64
+
+
+class ArrayDescriptorDict(TypedDict):
+    """
+    Where to find an array in shared memory. This is all that goes over gRPC (see ArrayDescriptor).
+    """
+
+    name: str
+    # Name of the shared memory segment holding the array
+    segment: str
+    # NumPy dtype string, e.g. "<f8"
+    dtype: str
+    shape: list[int]
+    # Byte offset of the array in the segment
+    offset: int
+
+
+def _attach(segment: str) -> shared_memory.SharedMemory:
+    """
+    Open a segment created by another process, without taking ownership of it.
+    """
+    try:
+        # Python 3.13+
+        return shared_memory.SharedMemory(name=segment, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=segment)
+        if os.name == "posix":
+            # Otherwise this process's resource tracker unlinks the segment when the process exits
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class SharedArrayExporter:
+    """
+    Shares arrays with another process through shared memory segments owned by this process.
+
+    The process that creates a segment keeps it until the reader releases it (see `release`), so it stays valid
+    however long the reader takes to attach - on Windows, a segment disappears when its last handle closes.
+    """
+
+    def __init__(self):
+        # key: segment name
+        self.segments: dict[str, shared_memory.SharedMemory] = {}
+
+    def allocate(
+        self, specs: dict[str, tuple[tuple[int, ...], str | np.dtype]]
+    ) -> tuple[list[ArrayDescriptorDict], dict[str, np.ndarray]]:
+        """
+        Create a segment holding uninitialized arrays, to be filled in place (without another copy).
+
+        :param specs: key: array name, value: (shape, dtype)
+        :return: Descriptors to send to the reader, and writable views of the arrays
+        """
+        layout = []
+        size = 0
+        for name, (shape, dtype) in specs.items():
+            dtype = np.dtype(dtype)
+            size = -(-size // ALIGNMENT) * ALIGNMENT
+            layout.append((name, tuple(shape), dtype, size))
+            size += int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.segments[shm.name] = shm
+        descriptors = []
+        views = {}
+        for name, shape, dtype, offset in layout:
+            views[name] = np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+            descriptors.append(
+                ArrayDescriptorDict(
+                    name=name,
+                    segment=shm.name,
+                    dtype=dtype.str,
+                    shape=list(shape),
+                    offset=offset,
+                )
+            )
+        return descriptors, views
+
+    def export(self, arrays: dict[str, np.ndarray]) -> list[ArrayDescriptorDict]:
+        """
+        Copy arrays into a new segment.
+
+        :return: Descriptors to send to the reader
+        """
+        descriptors, views = self.allocate(
+            {name: (array.shape, array.dtype) for name, array in arrays.items()}
+        )
+        for name, array in arrays.items():
+            np.copyto(views[name], array)
+        return descriptors
+
+    def release(self, segment: str) -> None:
+        """
+        Free a segment once the reader is done with it. Views from `allocate` must not be used afterwards.
+        """
+        shm = self.segments.pop(segment, None)
+        if shm is None:
+            return
+        try:
+            shm.close()
+        except BufferError:
+            # A view is still alive; the mapping goes away with it
+            logger.warning(f"Segment {segment} released while its arrays are in use")
+        if os.name == "posix":
+            shm.unlink()
+
+    def release_all(self) -> None:
+        for segment in list(self.segments):
+            self.release(segment)
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+
+class SharedArrays:
+    """
+    Read-only, zero-copy NumPy views of arrays shared by another process.
+
+    Use as a context manager (or call `close`): closing unmaps the segments and tells the owner it may free them
+    (`on_release`). The views must not be kept past that; copy what you need to keep.
+    """
+
+    def __init__(
+        self,
+        descriptors: list[ArrayDescriptorDict],
+        on_release: Callable[[list[str]], None] | None = None,
+    ):
+        self.on_release = on_release
+        # key: segment name
+        self.segments: dict[str, shared_memory.SharedMemory] = {}
+        self.arrays: dict[str, np.ndarray] = {}
+        for descriptor in descriptors:
+            shm = self.segments.get(descriptor["segment"])
+            if shm is None:
+                shm = self.segments[descriptor["segment"]] = _attach(
+                    descriptor["segment"]
+                )
+            view = np.ndarray(
+                tuple(descriptor["shape"]),
+                np.dtype(descriptor["dtype"]),
+                buffer=shm.buf,
+                offset=descriptor["offset"],
+            )
+            view.flags.writeable = False
+            self.arrays[descriptor["name"]] = view
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.arrays
+
+    def keys(self):
+        return self.arrays.keys()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def close(self) -> None:
+        self.arrays.clear()
+        for segment, shm in self.segments.items():
+            try:
+                shm.close()
+            except BufferError:
+                logger.warning(
+                    f"Arrays of segment {segment} are still in use after close"
+                )
+        if self.on_release is not None and self.segments:
+            self.on_release(list(self.segments))
+        self.segments.clear()
+
+    def __enter__(self) -> SharedArrays:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"<SharedArrays {list(self.arrays)} nbytes={self.nbytes}>"
@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from os import getenv
+from pathlib import Path
+from typing import Any
+
+from backend.ipc.python_ipc_servicer import IpcCommandError, IpcSession, ipc_sessions
+
+logger = logging.getLogger(__name__)
+
+# Python that runs the driver processes: the 32-bit one on Windows. Any Python 3 runs the stand-in driver.
+IPC_PYTHON = getenv("IPC_PYTHON") or (
+    r"C:\Program Files (x86)\Python313-32\python.exe"
+    if sys.platform == "win32"
+    else sys.executable
+)
+# Address of the backend's gRPC server, passed to the driver processes
+IPC_TARGET = getenv("IPC_TARGET", "localhost:50051")
+# Driver processes kept per IPC instrument
+IPC_WORKERS = int(getenv("IPC_WORKERS", "1"))
+# Seconds a driver process may take to connect (or reconnect) before it is killed and restarted
+IPC_WORKER_START_TIMEOUT = float(getenv("IPC_WORKER_START_TIMEOUT", "30"))
+# Seconds before restarting a driver process that exited; doubles after every crash, up to IPC_RESTART_MAX. A process
+# that ran for IPC_RESTART_MAX before exiting is restarted after IPC_RESTART_INITIAL again.
+IPC_RESTART_INITIAL = float(getenv("IPC_RESTART_INITIAL", "1"))
+IPC_RESTART_MAX = float(getenv("IPC_RESTART_MAX", "60"))
+# Seconds between health checks of each driver process
+IPC_HEALTH_INTERVAL = float(getenv("IPC_HEALTH_INTERVAL", "0.5"))
+
+
+class WorkerError(Exception):
+    """
+    A driver process exited, or didn't connect in time.
+    """
+
+
+class Worker:
+    """
+    One driver process, identified by its real pid - the pid it reports when it connects.
+    """
+
+    def __init__(self, slot: int, process: subprocess.Popen):
+        self.slot = slot
+        self.process = process
+        self.pid = process.pid
+        self.session: IpcSession = ipc_sessions.get(process.pid)
+        # "starting", "idle", "busy" or "exited"
+        self.state = "starting"
+        self.started_at = time.monotonic()
+        self.calls = 0
+
+    def __repr__(self) -> str:
+        return f"<Worker slot={self.slot} pid={self.pid} state={self.state} calls={self.calls}>"
+
+
+class WorkerPool:
+    """
+    Keeps `size` persistent driver processes for an IPC instrument, and routes each call to an idle one.
+
+    Every slot is supervised by its own task: it starts a process, waits for it to connect to the IPC service with
+    its pid, and then checks every IPC_HEALTH_INTERVAL that it's still running and connected. A process that exits,
+    doesn't connect within IPC_WORKER_START_TIMEOUT or stays disconnected that long is killed, the calls it was
+    running fail with IpcCommandError (they aren't retried - they may have moved the instrument), and it is
+    restarted with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        command: list[str],
+        size: int = IPC_WORKERS,
+        env: dict[str, str] | None = None,
+        cwd: str | None = str(Path(__file__).parents[2]),
+    ):
+        """
+        :param name: Name used in logs
+        :param command: Starts a driver process, which connects to the IPC service at IPC_TARGET
+        :param size: Number of driver processes
+        :param env: Extra environment variables for the driver processes
+        :param cwd: Working directory of the driver processes, the root of the repository by default
+        """
+        self.name = name
+        self.command = command
+        self.size = size
+        self.env = {"IPC_TARGET": IPC_TARGET, **(env or {})}
+        self.cwd = cwd
+
+        # key: slot
+        self.workers: dict[int, Worker] = {}
+        self.tasks: list[asyncio.Task] = []
+        self.idle: asyncio.Queue[Worker] = asyncio.Queue()
+        self.ready = asyncio.Event()
+
+        self.starts = 0
+        self.connects = 0
+        self.restarts = 0
+        self.failed_starts = 0
+        self.crashes = 0
+        self.last_error: str | None = None
+
+    async def start(self, timeout: float = IPC_WORKER_START_TIMEOUT) -> None:
+        """
+        Start the driver processes (pre-warming the pool), and wait until one is ready.
+
+        :raises WorkerError: if none is ready in time. The processes keep being started in the background.
+        """
+        if not self.tasks:
+            self.tasks = [
+                asyncio.create_task(self._supervise(slot)) for slot in range(self.size)
+            ]
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise WorkerError(
+                f"{self.name}: no driver process ready after {timeout} s: {self.last_error}"
+            ) from None
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.ready.clear()
+
+    async def call(
+        self, function_name: str, timeout: float | None = None, **kwargs
+    ) -> Any:
+        """
+        Run a function in an idle driver process, see `IpcSession.call`.
+
+        :param function_name: Name of the function to run
+        :param timeout: Seconds to wait for an idle process and the result, or None to wait as long as it takes
+        :return: The function's return value
+        """
+        async with asyncio.timeout(timeout):
+            while True:
+                worker = await self.idle.get()
+                # Processes that exited while idle are still queued
+                if worker.state == "idle":
+                    break
+            worker.state = "busy"
+            worker.calls += 1
+            try:
+                return await worker.session.call(function_name, **kwargs)
+            finally:
+                if worker.state == "busy":
+                    worker.state = "idle"
+                    self.idle.put_nowait(worker)
+
+    async def _supervise(self, slot: int) -> None:
+        delay = IPC_RESTART_INITIAL
+        while True:
+            try:
+                worker = self._spawn(slot)
+            except OSError as e:
+                self.failed_starts += 1
+                self.last_error = f"couldn't start: {e}"
+                logger.error(f"{self.name}: {self.last_error}")
+            else:
+                try:
+                    await self._run(worker)
+                except WorkerError as e:
+                    self.last_error = str(e)
+                    logger.warning(f"{self.name}: driver process {worker.pid} {e}")
+                finally:
+                    # Also when the pool is stopped
+                    self._retire(worker)
+                if time.monotonic() - worker.started_at >= IPC_RESTART_MAX:
+                    delay = IPC_RESTART_INITIAL
+
+            # Jitter, so processes that crashed together don't restart together
+            wait = delay * random.uniform(0.8, 1.2)
+            logger.info(
+                f"{self.name}: restarting driver process {slot} in {wait:.1f} s"
+            )
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, IPC_RESTART_MAX)
+            self.restarts += 1
+
+    def _spawn(self, slot: int) -> Worker:
+        process = subprocess.Popen(
+            self.command,
+            env={**os.environ, **self.env},
+            cwd=self.cwd,
+        )
+        self.starts += 1
+        worker = self.workers[slot] = Worker(slot, process)
+        logger.info(f"{self.name}: started driver process {worker.pid} in slot {slot}")
+        return worker
+
+    async def _run(self, worker: Worker) -> None:
+        """
+        Watch a driver process until it exits or has to be killed.
+        """
+        # Connected at least once; hand it out
+        connected = False
+        # time.monotonic() since when it has been disconnected
+        down_since = worker.started_at
+        while True:
+            returncode = worker.process.poll()
+            if returncode is not None:
+                if connected:
+                    self.crashes += 1
+                else:
+                    self.failed_starts += 1
+                raise WorkerError(f"exited with code {returncode}")
+
+            if worker.session.connected.is_set():
+                down_since = None
+                if not connected:
+                    connected = True
+                    self.connects += 1
+                    worker.state = "idle"
+                    self.idle.put_nowait(worker)
+                    self.ready.set()
+                    logger.info(
+                        f"{self.name}: driver process {worker.pid} ready after "
+                        f"{time.monotonic() - worker.started_at:.2f} s"
+                    )
+            else:
+                if down_since is None:
+                    down_since = time.monotonic()
+                if time.monotonic() - down_since > IPC_WORKER_START_TIMEOUT:
+                    if connected:
+                        self.crashes += 1
+                    else:
+                        self.failed_starts += 1
+                    raise WorkerError(
+                        f"not connected for {IPC_WORKER_START_TIMEOUT} s, killed"
+                    )
+
+            await asyncio.sleep(IPC_HEALTH_INTERVAL)
+
+    def _retire(self, worker: Worker) -> None:
+        worker.state = "exited"
+        if worker.process.poll() is None:
+            worker.process.kill()
+            try:
+                worker.process.wait(5)
+            except subprocess.TimeoutExpired:
+                logger.error(f"{self.name}: driver process {worker.pid} won't exit")
+        # Its commands will never be answered; its pid may be reused by another process
+        session = ipc_sessions.remove(worker.pid)
+        if session is not None:
+            session.fail_all(
+                IpcCommandError(f"{self.name}: driver process {worker.pid} exited")
+            )
+        if not any(w.state in ("idle", "busy") for w in self.workers.values()):
+            self.ready.clear()
+
+    def metrics(self) -> dict:
+        states = [worker.state for worker in self.workers.values()]
+        if "idle" in states or "busy" in states:
+            state = "connected"
+        elif "starting" in states:
+            state = "connecting"
+        elif self.tasks:
+            state = "backoff"
+        else:
+            state = "stopped"
+        return {
+            "state": state,
+            "connects": self.connects,
+            "reconnects": self.restarts,
+            "failed_attempts": self.failed_starts,
+            "disconnects": self.crashes,
+            "last_error": self.last_error,
+        }
+
+    def __repr__(self) -> str:
+        return f"<WorkerPool {self.name} workers={list(self.workers.values())}>"
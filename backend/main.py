@@ -11,6 +11,7 @@ load_dotenv()
 
 import logging
 import sys
+import time
 from concurrent import futures
 
 import grpc
@@ -28,8 +29,14 @@ from backend.node_connector_pb2 import (
 )
 from backend.db.flow_runs import FlowRun
 from backend.db.conn import conn
+from backend.db.migrate import migrate
+from backend.db.pool import open_pool, close_pool
+from backend.db.change_feed import change_feed
+from backend.db.write_behind import write_behind
 
 from backend.orchestrator import Orchestrator
+from backend.running_flows import running_flows
+from backend.telemetry import telemetry_archive
 
 from backend.ipc.python_ipc_servicer import IpcConnectionServicer
 
@@ -46,19 +53,101 @@ class NodeConnectorServicer(node_connector_pb2_grpc.NodeConnectorServicer):
             message=f"Pong ({request.message})", success=True
         )
 
-    def GetRunningFlows(
+    async def GetRunningFlows(
         self, request: ui_pb2.GetRunningFlowsRequest, context
     ) -> ui_pb2.GetRunningFlowsResponse:
-        flows = FlowRun.query(status="in-progress", order_by="id DESC")
+        flows = await running_flows.get()
         proto_flows = [run.to_proto() for run in flows]
 
         return ui_pb2.GetRunningFlowsResponse(flow_runs=proto_flows)
 
-    def StartFlow(self, request: node_connector_pb2.StartFlowRequest, context):
+    async def GetInstrumentQueues(
+        self, request: ui_pb2.GetInstrumentQueuesRequest, context
+    ) -> ui_pb2.GetInstrumentQueuesResponse:
+        now = time.monotonic()
+        queues = []
+        for (
+            instrument_id,
+            dispatcher,
+        ) in NodeConnectorServicer.orchestrator.dispatchers.items():
+            waiting = [
+                ui_pb2.QueuedNodeRun(
+                    node_run_id=ticket.node_run_id,
+                    flow_run_id=ticket.flow_run_id,
+                    priority=ticket.priority,
+                    waited_seconds=now - ticket.queued_at,
+                    seconds_to_deadline=(
+                        None if ticket.deadline is None else ticket.deadline - now
+                    ),
+                    shared=ticket.shared,
+                )
+                for ticket in dispatcher.snapshot()
+            ]
+            queues.append(
+                ui_pb2.InstrumentQueue(
+                    instrument_id=instrument_id,
+                    instrument_name=dispatcher.db_instrument.name,
+                    in_use_by=dispatcher.in_use_by,
+                    waiting=waiting,
+                    shared_by=sorted(dispatcher.shared_by),
+                )
+            )
+
+        return ui_pb2.GetInstrumentQueuesResponse(queues=queues)
+
+    async def GetInstrumentConnections(
+        self, request: ui_pb2.GetInstrumentConnectionsRequest, context
+    ) -> ui_pb2.GetInstrumentConnectionsResponse:
+        orchestrator = NodeConnectorServicer.orchestrator
+        connections = []
+        for instrument_id, instrument in orchestrator.instrument_dict.items():
+            connection = orchestrator.connections[instrument_id]
+            # Supervised connections report their own state once connected
+            metrics = (
+                instrument.connection_metrics() if connection.available else None
+            ) or connection.metrics()
+            connections.append(
+                ui_pb2.InstrumentConnection(
+                    instrument_id=instrument_id,
+                    instrument_name=orchestrator.dispatchers[
+                        instrument_id
+                    ].db_instrument.name,
+                    available=connection.available,
+                    connect_attempts=connection.attempts,
+                    **metrics,
+                )
+            )
+
+        return ui_pb2.GetInstrumentConnectionsResponse(connections=connections)
+
+    async def GetQueryCacheStats(
+        self, request: ui_pb2.GetQueryCacheStatsRequest, context
+    ) -> ui_pb2.GetQueryCacheStatsResponse:
+        query_cache = NodeConnectorServicer.orchestrator.query_cache
+        stats = [
+            ui_pb2.QueryCacheStats(
+                instrument_id=instrument_id,
+                function_name=function_name,
+                **function_stats.as_dict(),
+            )
+            for (
+                instrument_id,
+                function_name,
+            ), function_stats in query_cache.stats.items()
+        ]
+
+        return ui_pb2.GetQueryCacheStatsResponse(stats=stats)
+
+    async def StartFlow(self, request: node_connector_pb2.StartFlowRequest, context):
         logger.info("Received StartFlow request")
-        run = FlowRun.create(
-            name=request.flow_name, start_flow_node_id=request.start_node_id
+        run = await FlowRun.acreate(
+            name=request.flow_name,
+            start_flow_node_id=request.start_node_id,
+            priority=request.priority,
+            deadline_seconds=request.deadline_seconds or None,
         )
+        # Pin the run to the current version of the flows graph
+        flows_graph.pin(run.id)
         logger.info(f"Starting run: {run.id}")
         response = node_connector_pb2.StartFlowResponse(
             success=True, run_id=str(run.id)
@@ -187,8 +276,13 @@ async def serve():
     logger.info(f"Starting gRPC server on port {port}")
     server = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=10))
 
+    await open_pool()
+    # Subscribes to the change feed, which starts listening
+    running_flows.start()
+    if write_behind.enabled:
+        write_behind_task = asyncio.create_task(write_behind.run())
+
     ncs = NodeConnectorServicer()
-    await ncs.orchestrator.connect_instruments()
     node_connector_pb2_grpc.add_NodeConnectorServicer_to_server(ncs, server)
 
     ipc_template_pb2_grpc.add_IpcCommunicationServiceServicer_to_server(
@@ -197,22 +291,28 @@ async def serve():
     server.add_insecure_port(f"[::]:{port}")
     await server.start()
     logger.info("gRPC server started")
-
-    asyncio.create_task(NodeConnectorServicer.orchestrator.check_queues())
+    # After the server started: IPC driver processes connect to it
+    await ncs.orchestrator.connect_instruments()
 
     await server.wait_for_termination()
     logger.info("gRPC server stopped")
+    await ncs.orchestrator.connections.stop()
+    await running_flows.stop()
+    change_feed.stop()
+    if write_behind.enabled:
+        write_behind_task.cancel()
+        await write_behind.flush()
+    await asyncio.to_thread(telemetry_archive.flush)
+    await close_pool()
 
 
 if __name__ == "__main__":
     logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
-    logger.info(f"Connecting to database")
-    logger.info(f"Connected to database")
-    logger.info(f"Making test query")
-    with conn.cursor() as cur:
-        data = cur.execute("SELECT * FROM test_table").fetchall()
-        print(data)
-        logger.info(f"Test query successful")
+    logger.info(f"Applying database migrations")
+    migrate(conn)
 
+    if sys.platform == "win32":
+        # psycopg's async connections can't run on the default Proactor event loop
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     asyncio.run(serve())
@@ -1,11 +1,22 @@
 import asyncio
+import inspect
 import logging
+import time
 
+from backend.connections import InstrumentConnections
 from backend.db.flow_runs import FlowRun
 from backend.db.instruments import Instrument
 from backend.db.node_runs import NodeRun
+from backend.db.plate_locations import PlateLocation
 from backend.devices.devices import device_dict
+from backend.devices.device_abc import AbstractConnector
+from backend.dispatcher import InstrumentDispatcher
+from backend.flows.compiled import CompiledGraph, Node
 from backend.flows.graph import flows_graph
+from backend.plate_reads import PlateRead, plate_read_store
+from backend.query_cache import QueryCache
+from backend.reservations import ReservationManager
+from backend.telemetry import telemetry_archive
 
 logger = logging.getLogger(__name__)
 
@@ -22,9 +33,18 @@ class Orchestrator:
         """
         This constructor initializes the Orchestrator object and creates instances of all instruments.
         """
-        self.sleep_time = 1  # Set async sleep time to 5 seconds
-
         self.instrument_dict = {}  # Dictionary to hold instrument instances
+        self.dispatchers: dict[int, InstrumentDispatcher] = {}
+        # Connects the instruments, and knows which are available
+        self.connections = InstrumentConnections()
+        # key: instrument id, value: ids of the plate locations that belong to the instrument
+        self.instrument_plate_locations: dict[int, list[str]] = {}
+        # Reserves an instrument together with the plate locations a node touches
+        self.reservations = ReservationManager()
+        # Results of read-only instrument queries, see AbstractConnector.cache_ttl_for
+        self.query_cache = QueryCache()
+        # key: flow run id, value: ids of move nodes that already ran as part of a blended path
+        self.blended_moves: dict[int, set[str]] = {}
         for (
             db_instrument
         ) in Instrument.fetch_all():  # For each instrument in the database
@@ -41,43 +61,26 @@ class Orchestrator:
                 new_instance = class_obj(connection_info["ip"], connection_info["port"])
                 # Add the new instance to the instrument dictionary
                 self.instrument_dict[db_instrument.id] = new_instance
+                self.connections.add(db_instrument.id, db_instrument.name, new_instance)
+                # Create a dispatcher to hand the instrument to waiting node runs
+                self.dispatchers[db_instrument.id] = InstrumentDispatcher(db_instrument)
+                self.instrument_plate_locations[db_instrument.id] = [
+                    plate_location.id
+                    for plate_location in PlateLocation.fetch_from_instrument_id(
+                        db_instrument.id
+                    )
+                ]
 
         logger.info(f"Orchestrator object created")
 
     async def connect_instruments(self):
         """
-        Connect to all instruments in the instrument dictionary.
-        """
-        # Connect to all instruments
-        for instr in self.instrument_dict.values():
-            await instr.connect_device()
+        Connect to all instruments in the instrument dictionary, concurrently.
 
-    async def check_queues(self):
+        Returns once every instrument has had its first attempt (or at once, with INSTRUMENT_LAZY_CONNECT).
+        Instruments that couldn't be reached are unavailable until a background attempt succeeds.
         """
-        Check the queues of all instruments and call the next node run if the instrument is not in use.
-        """
-        # NOTE: Infinite loop
-        while True:
-            # For each instrument
-            for instr_id, instr in self.instrument_dict.items():
-
-                db_instr = Instrument.fetch_from_id(
-                    instr_id
-                )  # Get the instrument from the database
-                user = db_instr.get_user()  # Get the instrument user from the database
-                logger.info(
-                    f"Instrument {instr_id} user: {user.id if user is not None else None}, status: {user.status if user is not None else None}"
-                )
-
-                # Get the first item from the queue if the instrument is not in use
-                if user is None or user.status == "completed":
-                    if instr.q.qsize() > 0:
-                        logger.info("Calling next item from queue...")
-                        next_noderun_id = instr.q.get()
-                        db_instr.set_in_use_by(next_noderun_id)
-
-            # Wait before trying to get things from the queue again
-            await asyncio.sleep(self.sleep_time)
+        await self.connections.connect_all()
 
     async def run_node(
         self,
@@ -92,10 +95,15 @@ class Orchestrator:
         Run the functionality of a node on a specified instrument.
 
         Using the flow_run_id and executing_node_id, this method will create a new NodeRun object representing the
-        current node run. It will then add the NodeRun to the correct instrument queue using instrument_id, and it will
-        wait for the NodeRun to be called by the check_queues() loop. Once the NodeRun is called, it will check the
-        plate locations associated with the node and wait for any required locations to free up. Then, it executes the
-        function on the instrument, completes the NodeRun, and returns the function result from the instrument.
+        current node run. It will then wait for the instrument's dispatcher (using instrument_id) to hand the instrument
+        to the NodeRun. Once the NodeRun is admitted, it executes the function on the instrument, completes the NodeRun,
+        releases the instrument to the next waiting NodeRun, and returns the function result from the instrument.
+
+        Shared functions (see AbstractConnector.access_mode_for) hold the instrument together with other shared calls
+        rather than exclusively, and passive ones don't wait for the instrument at all.
+
+        Read-only queries (see AbstractConnector.cache_ttl_for) are answered from a fresh cached result or an
+        identical query already in flight when possible, without waiting for the instrument.
 
         :param flow_run_id: ID of the FlowRun to which the executing node belongs
         :param executing_node_id: ID of the node to be executed
@@ -107,24 +115,30 @@ class Orchestrator:
         """
         logger.info(f"Running flow {flow_run_id}@{executing_node_id} in orchestrator")
 
-        flowrun = FlowRun.fetch_from_id(flow_run_id)
+        # Get the instrument associated with the node
+        instrument = self.instrument_dict.get(instrument_id)
+        if instrument is None:
+            raise ValueError(f"Couldn't find an instrument with ID {instrument_id}")
+        # Connects the instrument on its first use, or fails fast if it's unavailable
+        await self.connections.ensure(instrument_id)
+
+        flowrun = await FlowRun.afetch_from_id(flow_run_id)
 
         if flowrun.status == "completed":
             raise Exception(f"Flow run {flowrun.id} is marked as completed.")
+        # Walk the version of the graph the flow run started on, even if flows.json was deployed since
+        graph = flows_graph.pin(flowrun.id)
         # Ensure that this node is next in the flow and should run.
         # If not, we'll just skip this node and return the last run's payload.
-        last_flowrun_node = flows_graph.get_node(flowrun.current_node_id)
-        if (
-            last_flowrun_node.next_vestra_node() is not None
-            and executing_node_id != last_flowrun_node.next_vestra_node().id
-        ):
+        next_node_id = graph.get_node(flowrun.current_node_id).next_vestra_id()
+        if next_node_id is not None and executing_node_id != next_node_id:
             # Skip this node, and return the value of the previous run.
             # Get value of previous node run
             logger.info(
                 f"This node ({executing_node_id}) is not next from the FlowRun current node ({flowrun.current_node_id}). "
                 f"Attempting to return the result from the previous run."
             )
-            prev_noderun = NodeRun.fetch_from_flowrun_and_node(
+            prev_noderun = await NodeRun.afetch_from_flowrun_and_node(
                 flow_run_id, executing_node_id
             )
             if prev_noderun is None:
@@ -133,57 +147,310 @@ class Orchestrator:
                 )
 
             if prev_noderun.status == "completed":
+                # Loaded from the blob store if it was too large for the row
+                output_data = await prev_noderun.aload_output()
                 logger.info(
-                    f"Found previous return value of type {type(prev_noderun.output_data)}, returning that"
+                    f"Found previous return value of type {type(output_data)} "
+                    f"({prev_noderun.output_size} bytes), returning that"
                 )
 
-                return prev_noderun.output_data
+                return output_data
 
             # If the previous run status isn't complete, then we'll re-run this node.
             logger.info(
                 f"Re-running node {executing_node_id} in flow {flow_run_id} because it didn't complete previously"
             )
             noderun = prev_noderun
+            await noderun.arequeue(flowrun)
         else:
-            # Using the noderun_id, fetch a NodeRun object
-            noderun = NodeRun.create(flow_run_id, executing_node_id)
-
-        flowrun.update_node(executing_node_id, "waiting")
+            # Create a waiting NodeRun and point the FlowRun at it
+            noderun = await NodeRun.aenqueue(flowrun, executing_node_id)
+
+        ttl = instrument.cache_ttl_for(function_name)
+        if ttl is None:
+            return await self._run_on_instrument(
+                flowrun,
+                noderun,
+                graph,
+                instrument,
+                instrument_id,
+                executing_node_id,
+                function_name,
+                function_args,
+                movement,
+            )
 
-        # Get the instrument associated with the node
-        instrument = self.instrument_dict.get(instrument_id)
-        if instrument is None:
-            raise ValueError(f"Couldn't find an instrument with ID {instrument}")
+        # Read-only query: use a fresh result, or share the request already in flight, instead of queueing for the
+        # instrument. Only the call that makes the request queues, and its NodeRun is completed by the request.
+        requested = False
+
+        def request():
+            nonlocal requested
+            requested = True
+            return self._run_on_instrument(
+                flowrun,
+                noderun,
+                graph,
+                instrument,
+                instrument_id,
+                executing_node_id,
+                function_name,
+                function_args,
+                movement,
+            )
 
-        # Add node_run_id to instrument queue
-        instrument.q.put(noderun.id)
+        try:
+            function_result = await self.query_cache.get(
+                QueryCache.key(instrument_id, function_name, function_args),
+                ttl,
+                request,
+            )
+        except BaseException:
+            if not requested:
+                await noderun.afail(instrument_id)
+            raise
+        if not requested:
+            logger.info(f"NodeRun {noderun.id} answered without the instrument")
+            await self._complete(
+                flowrun,
+                noderun,
+                graph,
+                instrument_id,
+                executing_node_id,
+                function_result,
+            )
+        return function_result
 
-        # Set status of this node in the database to "waiting"
-        noderun.set_status("waiting")
+    async def _run_on_instrument(
+        self,
+        flowrun: FlowRun,
+        noderun: NodeRun,
+        graph: CompiledGraph,
+        instrument: AbstractConnector,
+        instrument_id: int,
+        executing_node_id: str,
+        function_name: str,
+        function_args: dict,
+        movement: bool,
+    ):
+        """
+        Run a node's function once its NodeRun holds the instrument and plate locations, see `run_node`.
+        """
+        dispatcher = self.dispatchers[instrument_id]
+        access_mode = instrument.access_mode_for(function_name)
 
-        # Wait for the node_run_id to be called from the queue
-        db_instrument = Instrument.fetch_from_id(instrument_id)
-        while db_instrument.in_use_by != noderun.id:
-            logger.info(f"Waiting for node {executing_node_id} to run in {flow_run_id}")
-            await asyncio.sleep(self.sleep_time)
-            db_instrument = Instrument.fetch_from_id(instrument_id)
+        if access_mode == "passive":
+            logger.info(f"NodeRun {noderun.id} doesn't need to hold the instrument")
+        else:
+            # Wait for the dispatcher to hand the instrument to this node run.
+            # If the gRPC call goes away while waiting, the node run is withdrawn from the queue.
+            logger.info(f"Waiting for node {executing_node_id} to run in {flowrun.id}")
+            seconds_to_deadline = flowrun.seconds_to_deadline()
+            try:
+                admission = await dispatcher.acquire(
+                    noderun.id,
+                    priority=flowrun.priority,
+                    deadline=(
+                        None
+                        if seconds_to_deadline is None
+                        else time.monotonic() + seconds_to_deadline
+                    ),
+                    flow_run_id=flowrun.id,
+                    shared=access_mode == "shared",
+                )
+            except BaseException:
+                # Withdrawn from the queue: don't leave the NodeRun waiting, with its FlowRun pointing at it.
+                # Shielded, so the write finishes even if the task is cancelled again.
+                await asyncio.shield(noderun.afail(instrument_id))
+                raise
+            logger.info(f"NodeRun {noderun.id} admitted: {admission}")
+
+        # Robot moves may be merged into one blended path, or may have run already as part of one
+        function_name, function_args, blended_node_ids = self._plan_motion(
+            graph,
+            instrument,
+            flowrun.id,
+            executing_node_id,
+            function_name,
+            function_args,
+        )
+
+        # The instrument's own plate locations, plus the ones this call moves plates to or from.
+        # Shared and passive calls only read from the instrument, so they reserve nothing.
+        exclusive = access_mode == "exclusive"
+        plate_location_ids = (
+            self.instrument_plate_locations[instrument_id]
+            + instrument.plate_locations_for(function_name, function_args)
+            if exclusive
+            else []
+        )
+
+        # time.monotonic() when the instrument started moving, for the motion telemetry
+        motion_started_at = None
+        try:
+            if exclusive:
+                # Reserve the instrument and all of its plate locations at once, so e.g. a robot move and
+                # a peel that share a tray can't interleave
+                reservation = await self.reservations.reserve(
+                    noderun.id,
+                    ReservationManager.resources_for(instrument_id, plate_location_ids),
+                )
+                logger.info(f"NodeRun {noderun.id} reserved: {reservation}")
 
-        # Set Node Run status to "in-progress"
-        logger.info(f"Setting status of NodeRun {noderun.id} to in-progress")
-        noderun.set_status("in-progress")
-        flowrun.update_node(executing_node_id, "in-progress")
+                # Mark the node run in-progress and record it as the user of the instrument and plate locations
+                await noderun.aadmit(
+                    flowrun, instrument_id, reservation.plate_location_ids
+                )
+            else:
+                # instruments.in_use_by stays with the exclusive holder, if there is one
+                await noderun.aadmit(flowrun, None)
+
+            # Run function on instrument
+            if function_name is None:
+                logger.info(f"Node {executing_node_id} already ran in a blended path")
+                function_result = None
+            else:
+                motion_started_at = time.monotonic()
+                function_result = getattr(instrument, function_name)(**function_args)
+                # Passive functions may answer without awaiting anything
+                if inspect.isawaitable(function_result):
+                    function_result = await function_result
+                if isinstance(function_result, PlateRead):
+                    # Stored in a file; the NodeRun's output refers to it and holds the derived per-well values
+                    function_result = await plate_read_store.astore(
+                        noderun.id, function_result
+                    )
+        except BaseException:
+            # The following moves didn't run, so they must move on their own
+            self._forget_blended(flowrun.id, blended_node_ids)
+            # Mark the node run failed and release the instrument and plate locations
+            await noderun.afail(instrument_id, plate_location_ids)
+            raise
+        else:
+            # Complete Node Run, release the instrument and plate locations, and complete the flow run
+            # if this is the last node in the flow
+            await self._complete(
+                flowrun,
+                noderun,
+                graph,
+                instrument_id,
+                executing_node_id,
+                function_result,
+                plate_location_ids,
+            )
+        finally:
+            if movement and motion_started_at is not None:
+                # Archive the move's trajectory (also of failed moves), written in the background
+                trajectory = instrument.motion_trajectory(motion_started_at)
+                if trajectory is not None:
+                    telemetry_archive.record(noderun.id, trajectory)
+            if exclusive:
+                if instrument.cache_ttl_for(function_name) is None:
+                    # The call may have changed what the instrument's queries return
+                    self.query_cache.invalidate(instrument_id)
+                # Hand the plate locations to the next waiting node runs
+                self.reservations.release(noderun.id)
+            if access_mode != "passive":
+                # Hand the instrument to the next waiting node runs
+                dispatcher.release(noderun.id)
 
-        # Run function on instrument
-        function_result = await getattr(instrument, function_name)(**function_args)
+        return function_result
 
-        # Complete Node Run
-        noderun.complete(function_result)
+    async def _complete(
+        self,
+        flowrun: FlowRun,
+        noderun: NodeRun,
+        graph: CompiledGraph,
+        instrument_id: int,
+        executing_node_id: str,
+        function_result,
+        plate_location_ids: list[str] | None = None,
+    ) -> None:
+        """
+        Complete a NodeRun, and its FlowRun if this is the last node in the flow.
+        """
+        flow_completed = graph.get_node(executing_node_id).next_vestra_id() is None
+        await noderun.afinish(
+            flowrun,
+            instrument_id,
+            function_result,
+            flow_completed=flow_completed,
+            plate_location_ids=plate_location_ids,
+        )
         logger.info(f"NodeRun {noderun.id} completed")
+        if flow_completed:
+            # Let the flow run's graph version be dropped if no other run uses it
+            flows_graph.unpin(flowrun.id)
+            self.blended_moves.pop(flowrun.id, None)
 
-        # If this is the last node in the flow, complete the flow run
-        graph_node = flows_graph.get_node(executing_node_id)
-        if graph_node.next_vestra_node() is None:
-            # Flow run complete
-            flowrun.update_node(executing_node_id, "completed")
+    def _plan_motion(
+        self,
+        graph: CompiledGraph,
+        instrument: AbstractConnector,
+        flow_run_id: int,
+        node_id: str,
+        function_name: str,
+        function_args: dict,
+    ) -> tuple[str | None, dict, list[str]]:
+        """
+        Decide what a robot move node calls on its instrument.
 
-        return function_result
+        If the node starts a run of consecutive moves (see CompiledGraph.motion_run), the whole run is sent to the
+        robot as one blended path and the following nodes are remembered, so that when their own requests arrive
+        they complete without moving the robot again.
+
+        :return: Function name (None if the node's move already ran), its arguments, and the ids of the following
+            nodes merged into the call
+        """
+        blended = self.blended_moves.get(flow_run_id)
+        if blended is not None and node_id in blended:
+            blended.discard(node_id)
+            return None, {}, []
+
+        if not instrument.supports_blended_paths:
+            return function_name, function_args, []
+        run = graph.motion_run(node_id)
+        if len(run) < 2 or not _matches_motion(run[0], function_name, function_args):
+            # Not a run, or flows.json changed since the flow run started; move as requested
+            return function_name, function_args, []
+
+        waypoint_numbers = []
+        blend_radii = []
+        for node in run:
+            for waypoint_number in node.motion.waypoints:
+                waypoint_numbers.append(waypoint_number)
+                blend_radii.append(node.motion.blend_radius)
+
+        blended_node_ids = [node.id for node in run[1:]]
+        self.blended_moves.setdefault(flow_run_id, set()).update(blended_node_ids)
+        logger.info(
+            f"Blending moves of nodes {[node.id for node in run]} into one path through {waypoint_numbers}"
+        )
+        return (
+            "move_path",
+            {"waypoint_numbers": waypoint_numbers, "blend_radii": blend_radii},
+            blended_node_ids,
+        )
+
+    def _forget_blended(self, flow_run_id: int, node_ids: list[str]) -> None:
+        blended = self.blended_moves.get(flow_run_id)
+        if blended is not None:
+            blended.difference_update(node_ids)
+
+
+def _matches_motion(node: Node, function_name: str, function_args: dict) -> bool:
+    """
+    Whether a move request has the waypoints the compiled node has.
+    """
+    if function_name == "move_to_joint_waypoint":
+        waypoints = (function_args["waypoint_number"],)
+        delay = 0
+    elif function_name == "move":
+        waypoints = (
+            function_args["source_waypoint_number"],
+            function_args["destination_waypoint_number"],
+        )
+        delay = function_args["delay_between_movements"]
+    else:
+        return False
+    return node.motion.waypoints == waypoints and node.motion.delay == delay
@@ -0,0 +1,509 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import string
+import threading
+from os import getenv
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from backend.chunked_files import ChunkedFile, ChunkedFileFormat
+
+if TYPE_CHECKING:
+    from backend.ipc.python_ipc_servicer import IpcArrayResult
+
+logger = logging.getLogger(__name__)
+
+# Directory plate read files are stored in
+PLATE_READS_DIR = getenv("PLATE_READS_DIR") or str(
+    Path.home() / ".vestra" / "plate_reads"
+)
+# Wells per compressed chunk. Reading some wells decompresses only the chunks holding them.
+PLATE_READ_CHUNK_WELLS = int(getenv("PLATE_READ_CHUNK_WELLS", "24"))
+# Cycles in the sliding window the kinetic rates are fitted over
+PLATE_READ_RATE_WINDOW = int(getenv("PLATE_READ_RATE_WINDOW", "5"))
+
+# Plate read files (see backend.chunked_files for the layout they share with trajectories)
+#   header fields: wells, cycles, channels, wells per chunk
+#   chunk:         the chunk's wells, channel by channel (channel x well x cycle), in the read's dtype
+#   metadata:      the well and channel names, blank wells, dtype and cycle times
+#   index entry:   first well and number of wells of the chunk
+PLATE_READ_FORMAT = ChunkedFileFormat(
+    "plate read",
+    magic=b"VPLR",
+    version=2,
+    header_fields="IIII",
+    index_dtype=np.dtype(
+        [
+            ("well_start", "<u4"),
+            ("wells", "<u4"),
+            ("offset", "<u8"),
+            ("length", "<u4"),
+        ]
+    ),
+    suffix=".plate",
+)
+
+# Rows and columns of the standard plate formats, by number of wells
+PLATE_FORMATS = {
+    6: (2, 3),
+    12: (3, 4),
+    24: (4, 6),
+    48: (6, 8),
+    96: (8, 12),
+    384: (16, 24),
+    1536: (32, 48),
+}
+
+
+def well_names(num_wells: int) -> list[str]:
+    """
+    Names of the wells of a standard plate, row by row (A1, A2, ..., B1, ...), or W1, W2, ... for other counts.
+    """
+    if num_wells not in PLATE_FORMATS:
+        return [f"W{i + 1}" for i in range(num_wells)]
+    rows, columns = PLATE_FORMATS[num_wells]
+    letters = string.ascii_uppercase
+    # A-Z, then AA-AF for 1536-well plates
+    row_names = [
+        letters[row] if row < 26 else letters[row // 26 - 1] + letters[row % 26]
+        for row in range(rows)
+    ]
+    return [f"{row}{column + 1}" for row in row_names for column in range(columns)]
+
+
+class PlateRead:
+    """
+    Readings of a plate: one value per well, cycle and channel (e.g. excitation/emission pair), as a typed array.
+
+    An endpoint read has one cycle; a kinetic read has one per measurement. The processing methods work on the whole
+    plate at once and return new PlateReads (or arrays indexed [well, channel]), so they can be chained:
+
+        read.subtract_blank().normalize(baseline_cycles=3).kinetics()
+    """
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        wells: list[str] | None = None,
+        times: np.ndarray | None = None,
+        channels: list[str] | None = None,
+        blank_wells: list[str] | None = None,
+    ):
+        """
+        :param values: shape (wells, cycles, channels); (wells, cycles) for one channel, (wells,) for an endpoint read
+        :param wells: Well names, in the order of `values`. Standard plate names by default.
+        :param times: Seconds since the start of the read of every cycle. The cycle numbers by default.
+        :param channels: Channel names. ch1, ch2, ... by default.
+        :param blank_wells: Wells holding blanks, used by `subtract_blank`
+        """
+        values = np.asarray(values)
+        if values.ndim == 1:
+            values = values[:, None, None]
+        elif values.ndim == 2:
+            values = values[:, :, None]
+        elif values.ndim != 3:
+            raise ValueError(
+                f"Plate read values must have 1 to 3 dimensions, not {values.ndim}"
+            )
+        # shape (wells, cycles, channels)
+        self.values = values
+        self.wells = list(wells) if wells is not None else well_names(values.shape[0])
+        self.times = (
+            np.asarray(times, dtype=np.float64)
+            if times is not None
+            else np.arange(values.shape[1], dtype=np.float64)
+        )
+        self.channels = (
+            list(channels)
+            if channels is not None
+            else [f"ch{i + 1}" for i in range(values.shape[2])]
+        )
+        self.blank_wells = list(blank_wells or [])
+        if len(self.wells) != values.shape[0] or len(self.times) != values.shape[1]:
+            raise ValueError(
+                f"Plate read of shape {values.shape} doesn't match its {len(self.wells)} wells "
+                f"and {len(self.times)} cycles"
+            )
+        if len(self.channels) != values.shape[2]:
+            raise ValueError(
+                f"Plate read of shape {values.shape} doesn't match its {len(self.channels)} channels"
+            )
+        self._well_index = {well: i for i, well in enumerate(self.wells)}
+
+    @classmethod
+    def from_ipc(
+        cls, result: IpcArrayResult, blank_wells: list[str] | None = None
+    ) -> PlateRead:
+        """
+        Build a plate read from a driver's result, and release its shared memory. The driver returns the arrays
+        "values" (wells x cycles x channels) and optionally "times", with a value that may name the "wells" and
+        "channels".
+
+        :raises TypeError: if the driver didn't return arrays (see ArrayResult in python_ipc_32)
+        :raises ValueError: if it returned no "values"
+        """
+        # Imported here, so reading stored plate reads doesn't need the IPC server
+        from backend.ipc.python_ipc_servicer import IpcArrayResult
+
+        if not isinstance(result, IpcArrayResult):
+            raise TypeError(
+                f"Expected the driver to return a plate read as arrays, got {result!r}"
+            )
+        with result:
+            if "values" not in result.arrays:
+                raise ValueError(
+                    f'Driver returned no "values" array for the plate read: {result!r}'
+                )
+            value = result.value or {}
+            times = result.arrays.get("times")
+            return cls(
+                # Copied out of shared memory, which the driver frees once released
+                np.array(result.arrays["values"]),
+                wells=value.get("wells"),
+                times=None if times is None else np.array(times),
+                channels=value.get("channels"),
+                blank_wells=blank_wells or value.get("blank_wells"),
+            )
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        return self.values.shape
+
+    def well_indices(self, wells: list[str]) -> np.ndarray:
+        """
+        :raises KeyError: if a well isn't on the plate
+        """
+        return np.array([self._well_index[well] for well in wells], dtype=np.intp)
+
+    def _with_values(self, values: np.ndarray) -> PlateRead:
+        return PlateRead(
+            values, self.wells, self.times, self.channels, self.blank_wells
+        )
+
+    def select(
+        self, wells: list[str] | None = None, channels: list[str] | None = None
+    ) -> PlateRead:
+        """
+        The readings of some wells and/or channels.
+        """
+        values = self.values
+        if wells is not None:
+            values = values[self.well_indices(wells)]
+        if channels is not None:
+            values = values[
+                :, :, [self.channels.index(channel) for channel in channels]
+            ]
+        return PlateRead(
+            values,
+            self.wells if wells is None else wells,
+            self.times,
+            self.channels if channels is None else channels,
+            [well for well in self.blank_wells if wells is None or well in wells],
+        )
+
+    def subtract_blank(self, blank_wells: list[str] | None = None) -> PlateRead:
+        """
+        Subtract the mean of the blank wells, per cycle and channel, from every well.
+
+        :param blank_wells: Wells holding blanks, the read's own blank wells by default
+        """
+        blank_wells = blank_wells or self.blank_wells
+        if not blank_wells:
+            raise ValueError("No blank wells to subtract")
+        blank = self.values[self.well_indices(blank_wells)].mean(
+            axis=0, dtype=np.float64
+        )
+        return self._with_values(self.values - blank)
+
+    def normalize(self, baseline_cycles: int | None = None) -> PlateRead:
+        """
+        Scale every well and channel on its own.
+
+        :param baseline_cycles: Divide by the mean of the first `baseline_cycles` cycles (F/F0). By default, scale
+            each well from its minimum (0) to its maximum (1) instead.
+        """
+        values = self.values.astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if baseline_cycles is not None:
+                baseline = values[:, :baseline_cycles].mean(axis=1, keepdims=True)
+                return self._with_values(values / baseline)
+            low = values.min(axis=1, keepdims=True)
+            high = values.max(axis=1, keepdims=True)
+            return self._with_values((values - low) / (high - low))
+
+    def kinetics(self, window: int = PLATE_READ_RATE_WINDOW) -> dict[str, np.ndarray]:
+        """
+        Per-well kinetic parameters, each an array of shape (wells, channels):
+
+        - max_rate: steepest slope (per second) of a least-squares line over `window` consecutive cycles
+        - time_of_max_rate: middle of the window with the steepest slope
+        - lag_time: where the tangent at the steepest slope crosses the first reading (NaN if the well doesn't rise)
+        - endpoint, maximum: last and highest reading
+        - auc: area under the curve, by the trapezoidal rule
+        """
+        values = self.values.astype(np.float64)
+        num_cycles = values.shape[1]
+        window = max(2, min(window, num_cycles))
+        endpoint = values[:, -1]
+        maximum = values.max(axis=1)
+        if num_cycles < 2:
+            nan = np.full_like(endpoint, np.nan)
+            return {
+                "max_rate": nan,
+                "time_of_max_rate": nan,
+                "lag_time": nan,
+                "endpoint": endpoint,
+                "maximum": maximum,
+                "auc": np.zeros_like(endpoint),
+            }
+
+        # shape (windows, window): the times of every window, centered
+        window_times = sliding_window_view(self.times, window)
+        centered = window_times - window_times.mean(axis=1, keepdims=True)
+        # shape (wells, windows, channels, window), a view
+        window_values = sliding_window_view(values, window, axis=1)
+        # Least-squares slope of every window; the centered times sum to 0, so the values needn't be centered
+        slopes = (
+            np.einsum("wkcn,kn->wkc", window_values, centered)
+            / (centered**2).sum(axis=1)[None, :, None]
+        )
+
+        best = slopes.argmax(axis=1)[:, None, :]
+        max_rate = np.take_along_axis(slopes, best, axis=1)[:, 0]
+        time_of_max_rate = window_times.mean(axis=1)[best[:, 0]]
+        value_at_max_rate = np.take_along_axis(
+            window_values.mean(axis=3), best, axis=1
+        )[:, 0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lag_time = np.where(
+                max_rate > 0,
+                time_of_max_rate - (value_at_max_rate - values[:, 0]) / max_rate,
+                np.nan,
+            )
+        auc = (
+            (values[:, 1:] + values[:, :-1]) * np.diff(self.times)[None, :, None] / 2
+        ).sum(axis=1)
+        return {
+            "max_rate": max_rate,
+            "time_of_max_rate": time_of_max_rate,
+            "lag_time": lag_time,
+            "endpoint": endpoint,
+            "maximum": maximum,
+            "auc": auc,
+        }
+
+    def summary(self) -> dict:
+        """
+        JSON-serializable kinetics of every well (blank-subtracted if the read has blank wells), for the NodeRun's
+        output: {"wells": [...], "channels": [...], "kinetics": {metric: [[value per channel] per well]}}.
+        """
+        read = self.subtract_blank() if self.blank_wells else self
+        kinetics = read.kinetics()
+        return {
+            "wells": self.wells,
+            "channels": self.channels,
+            "blank_subtracted": bool(self.blank_wells),
+            "kinetics": {
+                # JSONB has no NaN
+                metric: np.where(np.isfinite(array), array, None).tolist()
+                for metric, array in kinetics.items()
+            },
+        }
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    def __repr__(self) -> str:
+        wells, cycles, channels = self.values.shape
+        return f"<PlateRead wells={wells} cycles={cycles} channels={channels} dtype={self.values.dtype}>"
+
+
+def write_plate_read(path: Path, node_run_id: int, plate_read: PlateRead) -> int:
+    """
+    Write a plate read file.
+
+    :return: Size of the file in bytes
+    """
+    num_wells, num_cycles, num_channels = plate_read.shape
+    # Little-endian, whatever the read's type
+    values = plate_read.values.astype(plate_read.values.dtype.newbyteorder("<"))
+    starts = range(0, num_wells, PLATE_READ_CHUNK_WELLS)
+
+    def chunks():
+        for start in starts:
+            chunk_values = values[start : start + PLATE_READ_CHUNK_WELLS]
+            # Channel by channel, each well's cycles in a row, so the compressor sees runs of similar values
+            data = np.ascontiguousarray(chunk_values.transpose(2, 0, 1)).tobytes()
+            yield data, {"well_start": start, "wells": len(chunk_values)}
+
+    return PLATE_READ_FORMAT.write(
+        path,
+        node_run_id,
+        (num_wells, num_cycles, num_channels, PLATE_READ_CHUNK_WELLS),
+        chunks(),
+        len(starts),
+        {
+            "wells": plate_read.wells,
+            "channels": plate_read.channels,
+            "blank_wells": plate_read.blank_wells,
+            "dtype": values.dtype.str,
+            "times": plate_read.times.tolist(),
+        },
+    )
+
+
+class PlateReadFile(ChunkedFile):
+    """
+    A plate read file, memory-mapped. Only the chunks holding the wells asked for are decompressed.
+    """
+
+    def __init__(self, path: Path):
+        super().__init__(path, PLATE_READ_FORMAT)
+        self.num_wells, self.num_cycles, self.num_channels, self.chunk_wells = (
+            self.header
+        )
+        self.wells: list[str] = self.metadata["wells"]
+        self.channels: list[str] = self.metadata["channels"]
+        self.blank_wells: list[str] = self.metadata["blank_wells"]
+        self.dtype = np.dtype(self.metadata["dtype"])
+        self.times = np.array(self.metadata["times"], dtype=np.float64)
+
+    def read(
+        self, wells: list[str] | None = None, channels: list[str] | None = None
+    ) -> PlateRead:
+        """
+        The readings of some wells and/or channels, or all of them.
+        """
+        if wells is None:
+            indices = np.arange(self.num_wells)
+        else:
+            well_index = {well: i for i, well in enumerate(self.wells)}
+            indices = np.array([well_index[well] for well in wells], dtype=np.intp)
+
+        values = np.empty(
+            (len(indices), self.num_cycles, self.num_channels), dtype=self.dtype
+        )
+        chunk_numbers = indices // self.chunk_wells
+        for chunk_number in np.unique(chunk_numbers):
+            entry = self.index[chunk_number]
+            raw = self.chunk(entry)
+            # shape (channels, wells, cycles) on disk
+            chunk = np.frombuffer(raw, self.dtype).reshape(
+                self.num_channels, int(entry["wells"]), self.num_cycles
+            )
+            wanted = chunk_numbers == chunk_number
+            values[wanted] = chunk[
+                :, indices[wanted] - int(entry["well_start"])
+            ].transpose(1, 2, 0)
+
+        plate_read = PlateRead(
+            values,
+            self.wells if wells is None else wells,
+            self.times,
+            self.channels,
+            [well for well in self.blank_wells if wells is None or well in wells],
+        )
+        return plate_read if channels is None else plate_read.select(channels=channels)
+
+
+class PlateReadStore:
+    """
+    Stores the plate reads instruments return, keyed by the NodeRun that made them.
+
+    A read is stored as a file of zlib-compressed chunks of wells (see `write_plate_read`), in its own dtype, and the
+    NodeRun's output_data holds only a reference to it and the derived per-well kinetics (see `PlateRead.summary`).
+    Reading some wells memory-maps the file and decompresses only the chunks holding them.
+    """
+
+    def __init__(self, directory: str = PLATE_READS_DIR):
+        self.directory = Path(directory)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.bytes_written = 0
+
+    def path_for(self, node_run_id: int) -> Path:
+        return PLATE_READ_FORMAT.path_for(self.directory, node_run_id)
+
+    def write(self, node_run_id: int, plate_read: PlateRead) -> dict:
+        """
+        Store a NodeRun's plate read. Blocks; see `astore`.
+
+        :return: The NodeRun's output: a reference to the read, and its summary
+        """
+        path = self.path_for(node_run_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        size = write_plate_read(path, node_run_id, plate_read)
+        with self.lock:
+            self.written += 1
+            self.bytes_written += size
+        num_wells, num_cycles, num_channels = plate_read.shape
+        logger.info(
+            f"Stored plate read of NodeRun {node_run_id}: {num_wells} wells, {num_cycles} cycles, "
+            f"{num_channels} channels, {size} bytes"
+        )
+        return {
+            "plate_read": {
+                "node_run_id": node_run_id,
+                "wells": num_wells,
+                "cycles": num_cycles,
+                "channels": num_channels,
+                "dtype": plate_read.values.dtype.str,
+                "size": size,
+            },
+            **plate_read.summary(),
+        }
+
+    async def astore(self, node_run_id: int, plate_read: PlateRead) -> dict:
+        """
+        Store a NodeRun's plate read on a thread, so the event loop doesn't wait for compression or the disk.
+
+        :return: The NodeRun's output: a reference to the read, and its summary
+        """
+        return await asyncio.to_thread(self.write, node_run_id, plate_read)
+
+    def open(self, node_run_id: int) -> PlateReadFile | None:
+        """
+        Open a NodeRun's plate read file, or return None if it has none.
+        """
+        path = self.path_for(node_run_id)
+        if not path.exists():
+            return None
+        return PlateReadFile(path)
+
+    def read(
+        self,
+        node_run_id: int,
+        wells: list[str] | None = None,
+        channels: list[str] | None = None,
+    ) -> PlateRead | None:
+        """
+        Read some wells and/or channels of a NodeRun's plate read, or all of it.
+
+        :return: The plate read, or None if the NodeRun has none
+        """
+        plate_read_file = self.open(node_run_id)
+        if plate_read_file is None:
+            return None
+        with plate_read_file:
+            return plate_read_file.read(wells, channels)
+
+    def read_output(self, output_data: dict | None, **kwargs) -> PlateRead | None:
+        """
+        Read the plate read a NodeRun's output_data refers to, see `read`.
+
+        :return: The plate read, or None if the output doesn't refer to one
+        """
+        if not isinstance(output_data, dict) or "plate_read" not in output_data:
+            return None
+        return self.read(output_data["plate_read"]["node_run_id"], **kwargs)
+
+    def __repr__(self) -> str:
+        return f"<PlateReadStore {self.directory} written={self.written} bytes={self.bytes_written}>"
+
+
+plate_read_store = PlateReadStore()
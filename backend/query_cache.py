@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+QueryKey = tuple[int, str, Hashable]
+
+
+class QueryStats:
+    """
+    Counters for one instrument function.
+    """
+
+    def __init__(self):
+        # answered from a fresh cached result
+        self.hits = 0
+        # went to the instrument
+        self.misses = 0
+        # shared a request already in flight
+        self.coalesced = 0
+        # requests to the instrument that failed (and weren't cached)
+        self.errors = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
+
+
+class QueryCache:
+    """
+    Caches the results of read-only instrument functions (see `cacheable`) for their TTL, and coalesces concurrent
+    identical calls into one request to the instrument.
+
+    The request runs in a task of its own, so a caller that goes away doesn't cancel it for the others. Failures
+    are passed to every caller waiting for the request, and aren't cached.
+    """
+
+    def __init__(self):
+        # key: query, value: (time.monotonic() the result expires, result)
+        self.results: dict[QueryKey, tuple[float, Any]] = {}
+        # key: query, value: the request in flight
+        self.in_flight: dict[QueryKey, asyncio.Task] = {}
+        # key: (instrument id, function name)
+        self.stats: dict[tuple[int, str], QueryStats] = {}
+
+    @staticmethod
+    def key(instrument_id: int, function_name: str, function_args: dict) -> QueryKey:
+        return (
+            instrument_id,
+            function_name,
+            tuple(sorted((name, repr(value)) for name, value in function_args.items())),
+        )
+
+    async def get(
+        self, key: QueryKey, ttl: float, fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Get the result of a query: cached if fresh, else from the request in flight, else from a new request.
+
+        :param key: See `key`
+        :param ttl: Seconds the result stays fresh
+        :param fetch: Makes the request to the instrument
+        :return: The result
+        """
+        stats = self.stats.setdefault(key[:2], QueryStats())
+        cached = self.results.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            stats.hits += 1
+            return cached[1]
+
+        task = self.in_flight.get(key)
+        if task is not None:
+            stats.coalesced += 1
+            return await asyncio.shield(task)
+
+        stats.misses += 1
+        task = asyncio.create_task(fetch())
+        self.in_flight[key] = task
+        task.add_done_callback(lambda t: self._store(key, ttl, t))
+        return await asyncio.shield(task)
+
+    def _store(self, key: QueryKey, ttl: float, task: asyncio.Task) -> None:
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        if task.cancelled() or task.exception() is not None:
+            self.stats[key[:2]].errors += 1
+            return
+        self.results[key] = (time.monotonic() + ttl, task.result())
+
+    def invalidate(self, instrument_id: int) -> None:
+        """
+        Drop the cached results of an instrument, e.g. after a command that changes its state.
+        """
+        for key in [key for key in self.results if key[0] == instrument_id]:
+            del self.results[key]
+
+    def __repr__(self) -> str:
+        return (
+            f"<QueryCache results={len(self.results)} in_flight={len(self.in_flight)}>"
+        )
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+
+def instrument_resource(instrument_id: int) -> str:
+    return f"instrument:{instrument_id}"
+
+
+def plate_location_resource(plate_location_id: str) -> str:
+    return f"plate_location:{plate_location_id}"
+
+
+class DeadlockError(Exception):
+    """
+    Raised for a reservation that would complete a cycle in the wait-for graph. The requester is the victim: it
+    gets nothing, and the reservations it would have waited for are unaffected.
+    """
+
+    def __init__(self, holder: int, cycle: list[int]):
+        self.holder = holder
+        self.cycle = cycle
+        super().__init__(
+            f"Reservation for {holder} would deadlock: "
+            + " -> ".join(str(h) for h in cycle)
+        )
+
+
+class Reservation:
+    """
+    A set of resources held by one holder (a NodeRun).
+    """
+
+    def __init__(self, holder: int, resources: tuple[str, ...]):
+        self.holder = holder
+        # Sorted, so every reservation lists (and persists) its resources in the same order
+        self.resources = resources
+        self.requested_at = time.monotonic()
+        self.granted_at: float | None = None
+        self.future: asyncio.Future[Reservation] = (
+            asyncio.get_running_loop().create_future()
+        )
+
+    @property
+    def plate_location_ids(self) -> list[str]:
+        prefix = plate_location_resource("")
+        return [r[len(prefix) :] for r in self.resources if r.startswith(prefix)]
+
+    @property
+    def wait_time(self) -> float:
+        if self.granted_at is None:
+            return time.monotonic() - self.requested_at
+        return self.granted_at - self.requested_at
+
+    def __repr__(self) -> str:
+        return f"<Reservation holder={self.holder} resources={self.resources} granted={self.granted_at is not None}>"
+
+
+class ReservationManager:
+    """
+    Reserves sets of resources (an instrument and the plate locations a node touches) all at once, or not at all.
+
+    A reservation is granted only when every resource in it is free, and then takes all of them in one step, so a
+    holder never holds part of what it needs while waiting for the rest. Waiting reservations are granted in arrival
+    order, but a later one whose resources are all free is not held back by an earlier one that is still blocked,
+    so flows contending for one plate location don't stall flows using others.
+
+    A holder can extend its reservation with more resources (e.g. a node that turns out to need another plate
+    location). It keeps what it already holds while the extension waits, which is the one way a deadlock can form,
+    so every waiting request adds edges to a wait-for graph (waiter -> holders of its busy resources), and a request
+    that would close a cycle is refused with a DeadlockError instead of waiting forever.
+
+    Reservations live in memory; persisting them (`instruments.in_use_by`, `plate_locations.in_use_by`) is left to
+    the NodeRun's admit/finish transitions.
+    """
+
+    def __init__(self):
+        # key: resource, value: holder
+        self.held: dict[str, int] = {}
+        # key: holder, value: its granted reservation
+        self.reservations: dict[int, Reservation] = {}
+        # waiting reservations, in arrival order
+        self.waiting: dict[int, Reservation] = {}
+        self.deadlocks = 0
+
+    @staticmethod
+    def resources_for(
+        instrument_id: int, plate_location_ids: Iterable[str] = ()
+    ) -> tuple[str, ...]:
+        return tuple(
+            sorted(
+                {instrument_resource(instrument_id)}
+                | {plate_location_resource(pl) for pl in plate_location_ids}
+            )
+        )
+
+    def request(self, holder: int, resources: Iterable[str]) -> Reservation:
+        """
+        Request resources for `holder`. The returned Reservation's future resolves once all of them are held.
+        If `holder` already holds a reservation, the new one extends it.
+
+        :param holder: ID of the NodeRun reserving the resources
+        :param resources: Resource keys, see `resources_for`
+        :return: The Reservation, possibly already granted
+        :raises DeadlockError: if waiting would deadlock
+        """
+        if holder in self.waiting:
+            raise ValueError(f"{holder} is already waiting for a reservation")
+
+        resources = set(resources)
+        if holder in self.reservations:
+            resources.update(self.reservations[holder].resources)
+        reservation = Reservation(holder, tuple(sorted(resources)))
+        if self._available(reservation):
+            self._grant(reservation)
+            return reservation
+
+        cycle = self._find_cycle(holder, reservation.resources)
+        if cycle is not None:
+            self.deadlocks += 1
+            raise DeadlockError(holder, cycle)
+
+        self.waiting[holder] = reservation
+        logger.info(
+            f"{holder} waiting for {[r for r in reservation.resources if self.held.get(r, holder) != holder]}"
+        )
+        return reservation
+
+    async def reserve(self, holder: int, resources: Iterable[str]) -> Reservation:
+        """
+        Reserve resources for `holder`, waiting until all of them are free.
+
+        If the waiting task is cancelled, the request is withdrawn. Resources `holder` held before are kept.
+
+        :param holder: ID of the NodeRun reserving the resources
+        :param resources: Resource keys, see `resources_for`
+        :return: The granted Reservation
+        :raises DeadlockError: if waiting would deadlock
+        """
+        reservation = self.request(holder, resources)
+        try:
+            return await reservation.future
+        except asyncio.CancelledError:
+            self.withdraw(holder)
+            raise
+
+    def withdraw(self, holder: int) -> None:
+        """
+        Withdraw `holder`'s waiting request, if any.
+        """
+        reservation = self.waiting.pop(holder, None)
+        if reservation is not None:
+            reservation.future.cancel()
+
+    def release(self, holder: int) -> None:
+        """
+        Release everything `holder` holds (and withdraw its waiting request), then grant waiting reservations that
+        can now proceed.
+        """
+        self.withdraw(holder)
+        reservation = self.reservations.pop(holder, None)
+        if reservation is None:
+            return
+        for resource in reservation.resources:
+            if self.held.get(resource) == holder:
+                del self.held[resource]
+        self._grant_waiting(reservation.resources)
+
+    def _available(self, reservation: Reservation) -> bool:
+        return all(
+            self.held.get(resource, reservation.holder) == reservation.holder
+            for resource in reservation.resources
+        )
+
+    def _grant(self, reservation: Reservation) -> None:
+        for resource in reservation.resources:
+            self.held[resource] = reservation.holder
+        self.reservations[reservation.holder] = reservation
+        reservation.granted_at = time.monotonic()
+        reservation.future.set_result(reservation)
+
+    def _grant_waiting(self, freed: tuple[str, ...]) -> None:
+        freed = set(freed)
+        for holder, reservation in list(self.waiting.items()):
+            if not freed.intersection(reservation.resources):
+                # Nothing it waits for changed
+                continue
+            if reservation.future.done():
+                del self.waiting[holder]
+            elif self._available(reservation):
+                del self.waiting[holder]
+                self._grant(reservation)
+
+    def _find_cycle(self, holder: int, resources: tuple[str, ...]) -> list[int] | None:
+        """
+        Find a path in the wait-for graph from the holders of `resources` back to `holder`.
+        """
+        blockers = {
+            self.held[r] for r in resources if self.held.get(r, holder) != holder
+        }
+        stack = [(blocker, [holder, blocker]) for blocker in blockers]
+        seen = set()
+        while stack:
+            current, path = stack.pop()
+            if current == holder:
+                return path
+            if current in seen:
+                continue
+            seen.add(current)
+            waiting = self.waiting.get(current)
+            if waiting is None:
+                continue
+            for resource in waiting.resources:
+                next_holder = self.held.get(resource)
+                if next_holder is not None and next_holder != current:
+                    stack.append((next_holder, path + [next_holder]))
+        return None
+
+    def wait_for_graph(self) -> dict[int, set[int]]:
+        """
+        key: waiting holder, value: holders it waits for
+        """
+        return {
+            holder: {
+                self.held[r]
+                for r in reservation.resources
+                if self.held.get(r, holder) != holder
+            }
+            for holder, reservation in self.waiting.items()
+        }
+
+    def __repr__(self) -> str:
+        return f"<ReservationManager held={len(self.held)} reservations={len(self.reservations)} waiting={len(self.waiting)}>"
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from backend.db.change_feed import ChangeEvent, change_feed
+from backend.db.flow_runs import FlowRun
+
+logger = logging.getLogger(__name__)
+
+# Status of the FlowRuns GetRunningFlows lists
+RUNNING_STATUS = "in-progress"
+# Seconds to wait before loading the set again after an error
+RELOAD_DELAY = 1.0
+
+
+class RunningFlows:
+    """
+    The in-progress FlowRuns, kept up to date from the change feed, so GetRunningFlows doesn't query flow_runs on
+    every call.
+
+    The set is loaded once the feed is listening, then follows the feed's flow_runs events: a FlowRun that leaves
+    in-progress is dropped, a known one is updated from the event, and an unknown one is fetched (the event only
+    holds its id, current node and status). After the feed reconnected, the set is loaded again with the next
+    event, since FlowRuns that finished meanwhile sent no event it received. Until then, and while the feed isn't
+    connected, `get` queries flow_runs.
+    """
+
+    def __init__(self):
+        # key: FlowRun id
+        self.flow_runs: dict[int, FlowRun] = {}
+        self.task: asyncio.Task | None = None
+        # set once the set matches flow_runs and follows the feed
+        self.ready = asyncio.Event()
+        # change_feed.reconnects when the set was last loaded
+        self.reconnects: int | None = None
+        self.reloads = 0
+        self.events = 0
+        self.fallbacks = 0
+
+    def start(self) -> None:
+        """
+        Start following the change feed. Must be called from the event loop.
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.ready.clear()
+
+    @property
+    def live(self) -> bool:
+        # After a reconnect, the set is stale until it's loaded again
+        return (
+            self.ready.is_set()
+            and change_feed.connected.is_set()
+            and self.reconnects == change_feed.reconnects
+        )
+
+    async def get(self) -> list[FlowRun]:
+        """
+        :return: The in-progress FlowRuns, newest first
+        """
+        if not self.live:
+            self.fallbacks += 1
+            return await FlowRun.aquery(status=RUNNING_STATUS, order_by="id DESC")
+        return sorted(
+            self.flow_runs.values(), key=lambda flow_run: flow_run.id, reverse=True
+        )
+
+    async def _run(self) -> None:
+        subscription = change_feed.subscribe({"flow_runs"})
+        try:
+            while True:
+                try:
+                    if (
+                        self.reconnects != change_feed.reconnects
+                        or not self.ready.is_set()
+                    ):
+                        # LISTEN is active before the set is loaded, so no change can fall in between
+                        self.ready.clear()
+                        await change_feed.connected.wait()
+                        self.reconnects = change_feed.reconnects
+                        await self._reload()
+                        self.ready.set()
+                    event = await subscription.get()
+                    # The resync after a reconnect is covered by reloading the set
+                    if not event.resync:
+                        await self._apply(event)
+                except Exception:
+                    # Load the set again rather than keep one that missed a change
+                    logger.exception(
+                        f"Running flows failed to follow the change feed, reloading in {RELOAD_DELAY} s"
+                    )
+                    self.ready.clear()
+                    await asyncio.sleep(RELOAD_DELAY)
+        finally:
+            subscription.close()
+
+    async def _reload(self) -> None:
+        flow_runs = await FlowRun.aquery(status=RUNNING_STATUS)
+        self.flow_runs = {flow_run.id: flow_run for flow_run in flow_runs}
+        self.reloads += 1
+        logger.debug(f"Running flows loaded: {len(self.flow_runs)}")
+
+    async def _apply(self, event: ChangeEvent) -> None:
+        self.events += 1
+        flow_run_id = event.data["id"]
+        if event.data["status"] != RUNNING_STATUS:
+            self.flow_runs.pop(flow_run_id, None)
+            return
+        flow_run = self.flow_runs.get(flow_run_id)
+        if flow_run is not None:
+            flow_run.current_node_id = event.data["current_node_id"]
+            flow_run.status = event.data["status"]
+            return
+        # A new FlowRun, or one that was resumed. Fetched, so a stale event can't bring back a finished FlowRun.
+        flow_run = await FlowRun.afetch_from_id(flow_run_id)
+        if flow_run.status == RUNNING_STATUS:
+            self.flow_runs[flow_run_id] = flow_run
+
+    def __repr__(self) -> str:
+        return (
+            f"<RunningFlows flow_runs={len(self.flow_runs)} live={self.live} reloads={self.reloads} "
+            f"events={self.events} fallbacks={self.fallbacks}>"
+        )
+
+
+running_flows = RunningFlows()
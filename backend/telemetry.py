@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import getenv
+from pathlib import Path
+
+import numpy as np
+
+from backend.chunked_files import ChunkedFile, ChunkedFileFormat
+
+logger = logging.getLogger(__name__)
+
+# Directory trajectory files are stored in
+TELEMETRY_DIR = getenv("TELEMETRY_DIR") or str(Path.home() / ".vestra" / "telemetry")
+# Trajectories older than this many days are deleted (0 keeps them forever)
+TELEMETRY_RETENTION_DAYS = float(getenv("TELEMETRY_RETENTION_DAYS", "30"))
+# Oldest trajectories are deleted once the archive is larger than this many megabytes (0 for no limit)
+TELEMETRY_MAX_MB = float(getenv("TELEMETRY_MAX_MB", "2048"))
+# Samples per compressed chunk. A time window query decompresses only the chunks it overlaps.
+TELEMETRY_CHUNK_SAMPLES = int(getenv("TELEMETRY_CHUNK_SAMPLES", "256"))
+
+# Seconds between retention sweeps
+PRUNE_INTERVAL = 3600
+
+# Trajectory files (see backend.chunked_files for the layout they share with plate reads)
+#   header fields: samples per chunk, total samples
+#   chunk:         the chunk's times (float64), then joint positions (float32 x6), then TCP poses (float32 x6)
+#   index entry:   time span and number of samples of the chunk
+TRAJECTORY_FORMAT = ChunkedFileFormat(
+    "trajectory",
+    magic=b"VTRJ",
+    version=2,
+    header_fields="IQ",
+    index_dtype=np.dtype(
+        [
+            ("t_start", "<f8"),
+            ("t_end", "<f8"),
+            ("offset", "<u8"),
+            ("length", "<u4"),
+            ("samples", "<u4"),
+        ]
+    ),
+    suffix=".traj",
+)
+
+
+class Trajectory:
+    """
+    Joint positions and TCP poses of a robot over time.
+    """
+
+    def __init__(self, times: np.ndarray, q: np.ndarray, tcp: np.ndarray):
+        # Seconds since the epoch
+        self.times = times
+        # shape (n, 6), rad
+        self.q = q
+        # shape (n, 6), m and rad
+        self.tcp = tcp
+
+    @classmethod
+    def from_monotonic(
+        cls, times: np.ndarray, q: np.ndarray, tcp: np.ndarray
+    ) -> Trajectory:
+        """
+        Build a trajectory from samples timed with time.monotonic()
+        """
+        return cls(times + (time.time() - time.monotonic()), q, tcp)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def __repr__(self) -> str:
+        if len(self) == 0:
+            return "<Trajectory empty>"
+        return f"<Trajectory samples={len(self)} from={self.times[0]:.3f} to={self.times[-1]:.3f}>"
+
+
+def write_trajectory(path: Path, node_run_id: int, trajectory: Trajectory) -> int:
+    """
+    Write a trajectory file.
+
+    :return: Size of the file in bytes
+    """
+    starts = range(0, len(trajectory), TELEMETRY_CHUNK_SAMPLES)
+
+    def chunks():
+        for start in starts:
+            end = start + TELEMETRY_CHUNK_SAMPLES
+            times = trajectory.times[start:end]
+            # Column by column, so the compressor sees runs of similar values
+            data = (
+                times.astype("<f8").tobytes()
+                + trajectory.q[start:end].astype("<f4").tobytes()
+                + trajectory.tcp[start:end].astype("<f4").tobytes()
+            )
+            yield data, {"t_start": times[0], "t_end": times[-1], "samples": len(times)}
+
+    return TRAJECTORY_FORMAT.write(
+        path,
+        node_run_id,
+        (TELEMETRY_CHUNK_SAMPLES, len(trajectory)),
+        chunks(),
+        len(starts),
+    )
+
+
+class TrajectoryFile(ChunkedFile):
+    """
+    A trajectory file, memory-mapped. Only the chunks a query overlaps are decompressed.
+    """
+
+    def __init__(self, path: Path):
+        super().__init__(path, TRAJECTORY_FORMAT)
+        self.chunk_samples, self.samples = self.header
+
+    def read(self, start: float | None = None, end: float | None = None) -> Trajectory:
+        """
+        Samples taken between `start` and `end` (seconds since the epoch, inclusive), or all of them.
+        """
+        chunks = self.index
+        if start is not None:
+            chunks = chunks[chunks["t_end"] >= start]
+        if end is not None:
+            chunks = chunks[chunks["t_start"] <= end]
+
+        times, q, tcp = [], [], []
+        for entry in chunks:
+            n = int(entry["samples"])
+            raw = self.chunk(entry)
+            times.append(np.frombuffer(raw, "<f8", n, 0))
+            q.append(np.frombuffer(raw, "<f4", n * 6, n * 8).reshape(n, 6))
+            tcp.append(np.frombuffer(raw, "<f4", n * 6, n * 32).reshape(n, 6))
+        if not times:
+            return Trajectory(np.empty(0), np.empty((0, 6)), np.empty((0, 6)))
+
+        times = np.concatenate(times)
+        keep = np.ones(len(times), dtype=bool)
+        if start is not None:
+            keep &= times >= start
+        if end is not None:
+            keep &= times <= end
+        return Trajectory(
+            times[keep],
+            np.concatenate(q)[keep].astype(np.float64),
+            np.concatenate(tcp)[keep].astype(np.float64),
+        )
+
+
+class TelemetryArchive:
+    """
+    Stores the trajectory of each robot move, keyed by the NodeRun that made it.
+
+    Each NodeRun's trajectory is one file of zlib-compressed chunks with an index of their time spans, so a time
+    window is read by memory-mapping the file and decompressing only the chunks it overlaps. Joint positions and
+    TCP poses are stored as float32, times as float64.
+
+    Files are written and old ones pruned (TELEMETRY_RETENTION_DAYS, TELEMETRY_MAX_MB) on a thread of the archive's
+    own, so recording a trajectory never waits for the disk and never delays the next move.
+    """
+
+    def __init__(self, directory: str = TELEMETRY_DIR):
+        self.directory = Path(directory)
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="telemetry"
+        )
+        self.last_prune = 0.0
+        self.lock = threading.Lock()
+        self.written = 0
+        self.bytes_written = 0
+        self.write_errors = 0
+        self.pruned = 0
+
+    def path_for(self, node_run_id: int) -> Path:
+        return TRAJECTORY_FORMAT.path_for(self.directory, node_run_id)
+
+    def record(self, node_run_id: int, trajectory: Trajectory) -> Future | None:
+        """
+        Store a NodeRun's trajectory in the background.
+
+        :return: Future of the write, None if there was nothing to write
+        """
+        if len(trajectory) == 0:
+            return None
+        future = self.executor.submit(self._write, node_run_id, trajectory)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def _write(self, node_run_id: int, trajectory: Trajectory) -> None:
+        path = self.path_for(node_run_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        size = write_trajectory(path, node_run_id, trajectory)
+        with self.lock:
+            self.written += 1
+            self.bytes_written += size
+        if time.monotonic() - self.last_prune >= PRUNE_INTERVAL:
+            self.prune()
+
+    def _log_failure(self, future: Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            with self.lock:
+                self.write_errors += 1
+            logger.error(f"Failed to store trajectory: {future.exception()}")
+
+    def open(self, node_run_id: int) -> TrajectoryFile | None:
+        """
+        Open a NodeRun's trajectory file, or return None if it has none.
+        """
+        path = self.path_for(node_run_id)
+        if not path.exists():
+            return None
+        return TrajectoryFile(path)
+
+    def read(
+        self, node_run_id: int, start: float | None = None, end: float | None = None
+    ) -> Trajectory | None:
+        """
+        Read a NodeRun's trajectory between `start` and `end` (seconds since the epoch), or all of it.
+
+        :return: The trajectory, or None if the NodeRun has none
+        """
+        trajectory_file = self.open(node_run_id)
+        if trajectory_file is None:
+            return None
+        with trajectory_file:
+            return trajectory_file.read(start, end)
+
+    def prune(self) -> None:
+        """
+        Delete trajectories past the retention period, then the oldest ones until the archive fits in its size
+        limit.
+        """
+        self.last_prune = time.monotonic()
+        files = []
+        for path in self.directory.glob("*/*.traj"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        now = time.time()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            expired = (
+                TELEMETRY_RETENTION_DAYS > 0
+                and now - mtime > TELEMETRY_RETENTION_DAYS * 86400
+            )
+            too_big = TELEMETRY_MAX_MB > 0 and total > TELEMETRY_MAX_MB * 1024 * 1024
+            if not expired and not too_big:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            self.pruned += 1
+        logger.info(f"Telemetry archive: {len(files)} trajectories, {total} bytes")
+
+    def flush(self) -> None:
+        """
+        Wait for pending writes. Blocks; call from a thread or at shutdown.
+        """
+        self.executor.submit(lambda: None).result()
+
+    def __repr__(self) -> str:
+        return (
+            f"<TelemetryArchive {self.directory} written={self.written} bytes={self.bytes_written} "
+            f"errors={self.write_errors} pruned={self.pruned}>"
+        )
+
+
+telemetry_archive = TelemetryArchive()
@@ -4,6 +4,8 @@ import { BaseNode, BaseNodeDef, OrchestratorMessageInFlow } from "../nodeAPI";
 
 interface StartFlowNodeDef extends BaseNodeDef {
   flow_name: string;
+  priority: string;
+  deadline_seconds: string;
 }
 
 class StartFlowNode extends BaseNode<StartFlowNodeDef> {
@@ -23,6 +25,8 @@ class StartFlowNode extends BaseNode<StartFlowNodeDef> {
     const startRequest = new StartFlowRequest({
       start_node_id: this.node.id,
       flow_name: this.config.flow_name,
+      priority: parseInt(this.config.priority) || 0,
+      deadline_seconds: parseFloat(this.config.deadline_seconds) || 0,
     });
 
     const response = await this.grpcClient.StartFlow(startRequest);
@@ -0,0 +1,113 @@
+"""
+Benchmark event-loop lag and per-node RPC latency with the synchronous global connection vs the async pool.
+
+Simulates 50 concurrent flows. Each node does the same database work as `Orchestrator.run_node` and a short
+instrument call. The "sync" run uses the blocking model methods from async code (the old behaviour), the
+"async" run uses the pool-backed `a*` methods.
+
+Requires DATABASE_URL to point at a database with Vestra's tables. Rows are written to flow_runs and node_runs.
+
+Run from the root of the repository:
+    python -m test_scripts.bench_db_pool
+"""
+
+from __future__ import annotations
+
+import asyncio
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from backend.db.flow_runs import FlowRun
+from backend.db.node_runs import NodeRun
+from backend.db.pool import open_pool, close_pool
+
+NUM_FLOWS = 50
+NODES_PER_FLOW = 10
+INSTRUMENT_CALL = 0.01  # seconds
+LAG_INTERVAL = 0.005  # seconds between event-loop lag samples
+
+
+async def sync_node(flowrun: FlowRun, node_id: str):
+    noderun = NodeRun.create(flowrun.id, node_id)
+    flowrun.update_node(node_id, "waiting")
+    noderun.set_status("waiting")
+    noderun.set_status("in-progress")
+    flowrun.update_node(node_id, "in-progress")
+    await asyncio.sleep(INSTRUMENT_CALL)
+    noderun.complete({"ok": True})
+
+
+async def sync_flow(i: int, latencies: list[float]):
+    flowrun = FlowRun.create(f"bench-sync-{i}", "bench-start")
+    for n in range(NODES_PER_FLOW):
+        start = time.perf_counter()
+        await sync_node(flowrun, f"bench-node-{n}")
+        latencies.append(time.perf_counter() - start)
+    flowrun.update_node(flowrun.current_node_id, "completed")
+
+
+async def async_node(flowrun: FlowRun, node_id: str):
+    noderun = await NodeRun.acreate(flowrun.id, node_id)
+    await flowrun.aupdate_node(node_id, "waiting")
+    await noderun.aset_status("waiting")
+    await noderun.aset_status("in-progress")
+    await flowrun.aupdate_node(node_id, "in-progress")
+    await asyncio.sleep(INSTRUMENT_CALL)
+    await noderun.acomplete({"ok": True})
+
+
+async def async_flow(i: int, latencies: list[float]):
+    flowrun = await FlowRun.acreate(f"bench-async-{i}", "bench-start")
+    for n in range(NODES_PER_FLOW):
+        start = time.perf_counter()
+        await async_node(flowrun, f"bench-node-{n}")
+        latencies.append(time.perf_counter() - start)
+    await flowrun.aupdate_node(flowrun.current_node_id, "completed")
+
+
+async def measure_lag(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(time.perf_counter() - start - LAG_INTERVAL)
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(name: str, flow):
+    latencies, lags = [], []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(lags, stop))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(flow(i, latencies) for i in range(NUM_FLOWS)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await lag_task
+    print(
+        f"{name:>5}: node p50 {percentile(latencies, 0.5) * 1000:8.2f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:8.2f} ms | "
+        f"loop lag mean {statistics.mean(lags) * 1000:7.2f} ms, "
+        f"max {max(lags) * 1000:8.2f} ms | total {elapsed:.2f} s"
+    )
+
+
+async def main():
+    await open_pool()
+    try:
+        await run("sync", sync_flow)
+        await run("async", async_flow)
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""
+Benchmark the instrument handoff latency between back-to-back nodes on one instrument.
+
+Compares the old polling approach (`Orchestrator.check_queues` + the `in_use_by` poll in `run_node`)
+with `InstrumentDispatcher`. No database or instrument is needed - the database is simulated by a fake
+instrument that counts queries.
+
+Run from the root of the repository:
+    python -m test_scripts.bench_dispatch_handoff
+"""
+
+from __future__ import annotations
+
+import asyncio
+import statistics
+import time
+from queue import Queue
+
+from backend.dispatcher import InstrumentDispatcher
+
+NUM_NODES = 20
+NODE_DURATION = 0.05  # seconds the instrument is busy per node
+SLEEP_TIME = 1  # polling interval used by the old orchestrator
+
+
+class FakeDbInstrument:
+    def __init__(self):
+        self.id = 1
+        self.in_use_by = None
+        self.queries = 0
+
+    def set_in_use_by(self, node_run_id):
+        self.queries += 1
+        self.in_use_by = node_run_id
+
+    async def aset_in_use_by(self, node_run_id):
+        self.set_in_use_by(node_run_id)
+
+
+async def polling_run(db_instrument: FakeDbInstrument) -> list[float]:
+    q = Queue()
+    completed = set()
+    released_at = {}
+    handoffs = []
+
+    async def check_queues():
+        while True:
+            db_instrument.queries += 2  # Instrument.fetch_from_id + get_user()
+            user = db_instrument.in_use_by
+            if user is None or user in completed:
+                if q.qsize() > 0:
+                    db_instrument.set_in_use_by(q.get())
+            await asyncio.sleep(SLEEP_TIME)
+
+    async def node(node_run_id):
+        q.put(node_run_id)
+        db_instrument.queries += 1
+        while db_instrument.in_use_by != node_run_id:
+            await asyncio.sleep(SLEEP_TIME)
+            db_instrument.queries += 1
+        if node_run_id - 1 in released_at:
+            handoffs.append(time.perf_counter() - released_at[node_run_id - 1])
+        await asyncio.sleep(NODE_DURATION)
+        completed.add(node_run_id)
+        released_at[node_run_id] = time.perf_counter()
+
+    checker = asyncio.create_task(check_queues())
+    await asyncio.gather(*(node(i) for i in range(NUM_NODES)))
+    checker.cancel()
+    return handoffs
+
+
+async def dispatcher_run(db_instrument: FakeDbInstrument) -> list[float]:
+    dispatcher = InstrumentDispatcher(db_instrument)
+    released_at = {}
+    handoffs = []
+
+    async def node(node_run_id):
+        await dispatcher.acquire(node_run_id)
+        # NodeRun.aadmit records the holder
+        await db_instrument.aset_in_use_by(node_run_id)
+        if node_run_id - 1 in released_at:
+            handoffs.append(time.perf_counter() - released_at[node_run_id - 1])
+        await asyncio.sleep(NODE_DURATION)
+        released_at[node_run_id] = time.perf_counter()
+        dispatcher.release(node_run_id)
+
+    await asyncio.gather(*(node(i) for i in range(NUM_NODES)))
+    return handoffs
+
+
+def report(name: str, handoffs: list[float], queries: int, elapsed: float):
+    handoffs_ms = sorted(h * 1000 for h in handoffs)
+    print(
+        f"{name:>10}: mean handoff {statistics.mean(handoffs_ms):9.3f} ms, "
+        f"max {handoffs_ms[-1]:9.3f} ms, "
+        f"{queries} DB queries, total {elapsed:.2f} s for {NUM_NODES} nodes"
+    )
+
+
+async def main():
+    for name, run in (("polling", polling_run), ("dispatcher", dispatcher_run)):
+        db_instrument = FakeDbInstrument()
+        start = time.perf_counter()
+        handoffs = await run(db_instrument)
+        report(name, handoffs, db_instrument.queries, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""
+Benchmark admission wait times for high-priority flows on a busy instrument.
+
+One simulated instrument serves an open-loop stream of NodeRuns, mostly low-priority with some high-priority
+ones, at ~85% utilization. The same arrival sequence is run through the dispatcher with every NodeRun at the same
+priority (plain FIFO) and with priorities, and the wait-time percentiles of both classes are reported. No database
+or instrument is needed.
+
+Run from the root of the repository:
+    python -m test_scripts.bench_dispatch_priority
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import statistics
+import time
+
+from backend import dispatcher as dispatcher_module
+from backend.dispatcher import InstrumentDispatcher
+
+NUM_NODE_RUNS = 1500
+HIGH_PRIORITY_SHARE = 0.1
+HIGH_PRIORITY = 5
+MEAN_SERVICE_TIME = 0.01  # seconds the instrument is busy per NodeRun
+UTILIZATION = 0.85
+# Scaled down from the default so aging has an effect within the benchmark's run time
+AGING_SECONDS = 0.2
+
+
+class FakeDbInstrument:
+    def __init__(self):
+        self.id = 1
+        self.name = "bench"
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+async def run(
+    arrivals: list[tuple[float, bool, float]], use_priority: bool
+) -> dict[bool, list[float]]:
+    dispatcher = InstrumentDispatcher(FakeDbInstrument())
+    waits: dict[bool, list[float]] = {True: [], False: []}
+
+    async def node_run(node_run_id: int, high: bool, service_time: float):
+        priority = HIGH_PRIORITY if high and use_priority else 0
+        admission = await dispatcher.acquire(node_run_id, priority=priority)
+        waits[high].append(admission.wait_time)
+        await asyncio.sleep(service_time)
+        dispatcher.release(node_run_id)
+
+    tasks = []
+    start = time.monotonic()
+    for node_run_id, (arrival, high, service_time) in enumerate(arrivals):
+        delay = start + arrival - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(node_run(node_run_id, high, service_time)))
+    await asyncio.gather(*tasks)
+    return waits
+
+
+def report(label: str, waits: dict[bool, list[float]]):
+    print(label)
+    for high, name in ((True, "high priority"), (False, "low priority")):
+        ms = [w * 1000 for w in waits[high]]
+        print(
+            f"  {name:<14} n={len(ms):5d}  p50 {statistics.median(ms):8.1f} ms  p95 {percentile(ms, 95):8.1f} ms  "
+            f"p99 {percentile(ms, 99):8.1f} ms  max {max(ms):8.1f} ms"
+        )
+
+
+def main():
+    dispatcher_module.DISPATCH_AGING_SECONDS = AGING_SECONDS
+    rng = random.Random(0)
+    arrivals = []
+    t = 0.0
+    for _ in range(NUM_NODE_RUNS):
+        t += rng.expovariate(UTILIZATION / MEAN_SERVICE_TIME)
+        arrivals.append(
+            (
+                t,
+                rng.random() < HIGH_PRIORITY_SHARE,
+                rng.expovariate(1 / MEAN_SERVICE_TIME),
+            )
+        )
+
+    report(
+        "FIFO (all NodeRuns at the same priority):", asyncio.run(run(arrivals, False))
+    )
+    report(
+        f"Priority {HIGH_PRIORITY} vs 0, aging {AGING_SECONDS}s per level:",
+        asyncio.run(run(arrivals, True)),
+    )
+
+
+if __name__ == "__main__":
+    main()
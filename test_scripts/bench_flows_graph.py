@@ -0,0 +1,242 @@
+"""
+Benchmark flows graph lookups and memory on a generated 50k-node flows.json.
+
+Compares the old graph (raw flows.json dicts wrapped in a new Node on every lookup) with the compiled graph from
+backend.flows.compiled, times recompiling after a one-node change with and without the previous graph, and
+measures the memory of graph versions pinned by FlowRuns across several deploys. Run from the root of the repository:
+    python -m test_scripts.bench_flows_graph
+"""
+
+from __future__ import annotations
+
+import gc
+import json
+import random
+import timeit
+import tracemalloc
+
+from backend.flows.compiled import CompiledGraph, GraphVersions, IGNORE_NODE_TYPES
+
+NUM_NODES = 50_000
+NUM_TABS = 50
+LOOKUPS = 200_000
+DEPLOYS = 10
+RUNS_PER_DEPLOY = 5
+
+
+def generate_flows(num_nodes: int) -> list[dict]:
+    """
+    Build a flows.json-like list: chains of Vestra nodes with function/debug nodes in between,
+    including the function bodies and UI config that Node-RED stores for every node.
+    """
+    rng = random.Random(0)
+    ids = [f"{rng.getrandbits(64):016x}" for _ in range(num_nodes)]
+    tabs = [f"tab{i:04d}" for i in range(NUM_TABS)]
+    flows: list[dict] = [{"id": tab, "type": "tab", "label": tab} for tab in tabs]
+    for i, node_id in enumerate(ids):
+        node_type = rng.choice(
+            [
+                "vestra:xpeel",
+                "vestra:ur3",
+                "vestra:fluostar",
+                "function",
+                "debug",
+                "change",
+            ]
+        )
+        wires = []
+        if i + 1 < num_nodes:
+            # the first output goes to the next 1-3 nodes, so next-vestra-node has to skip non-Vestra nodes
+            wires.append(ids[i + 1 : i + 1 + rng.randint(1, 3)])
+        flows.append(
+            {
+                "id": node_id,
+                "type": node_type,
+                "z": tabs[i % NUM_TABS],
+                "name": f"node {i}",
+                "func": "const value = msg.payload;\n" * 20,
+                "outputs": 1,
+                "x": rng.randint(0, 2000),
+                "y": rng.randint(0, 2000),
+                "wires": wires,
+            }
+        )
+    return flows
+
+
+class LegacyGraph:
+    """
+    Copy of the pre-compilation FlowsGraph's data layout: every raw node is kept as-is.
+    """
+
+    def __init__(self, json_file: list[dict]):
+        self.raw_graph = {}
+        for node in json_file:
+            if "wires" not in node or node["type"] in IGNORE_NODE_TYPES:
+                continue
+            self.raw_graph[node["id"]] = node
+
+    def get_node(self, node_id: str) -> LegacyNode | None:
+        if node_id not in self.raw_graph:
+            return None
+        return LegacyNode(self, self.raw_graph[node_id])
+
+
+class LegacyNode:
+    def __init__(self, graph: LegacyGraph, raw_node: dict):
+        self.graph = graph
+        self.raw_node = raw_node
+        self.id = self.raw_node["id"]
+        self.node_type = self.raw_node["type"]
+
+    @property
+    def has_wires(self) -> bool:
+        return "wires" in self.raw_node and len(self.raw_node["wires"]) > 0
+
+    def next_vestra_node(self, output_index=0) -> LegacyNode | None:
+        if not self.has_wires:
+            return None
+        output_ids = self.raw_node["wires"][output_index]
+        if len(output_ids) == 0:
+            return None
+        for output_id in output_ids:
+            node = LegacyNode(self.graph, self.graph.raw_graph[output_id])
+            if node.node_type.startswith("vestra:"):
+                return node
+        return None
+
+
+def measure_memory(build) -> tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    print(f"Generating flows.json with {NUM_NODES} nodes")
+    text = json.dumps(generate_flows(NUM_NODES))
+    print(f"flows.json size: {len(text) / 1e6:.1f} MB")
+
+    # Memory is measured for what each graph keeps after the parsed json is dropped
+    legacy, legacy_bytes = measure_memory(lambda: LegacyGraph(json.loads(text)))
+    compiled, compiled_bytes = measure_memory(
+        lambda: CompiledGraph.compile(json.loads(text))
+    )
+    print(
+        f"Resident memory: legacy {legacy_bytes / 1e6:7.1f} MB, compiled {compiled_bytes / 1e6:7.1f} MB"
+    )
+
+    rng = random.Random(1)
+    node_ids = list(compiled.nodes)
+    sample = [rng.choice(node_ids) for _ in range(LOOKUPS)]
+
+    def legacy_lookup():
+        for node_id in sample:
+            legacy.get_node(node_id)
+
+    def compiled_lookup():
+        for node_id in sample:
+            compiled.get_node(node_id)
+
+    # What run_node does per node: look up a node and find the next Vestra node (twice)
+    def legacy_next():
+        for node_id in sample:
+            node = legacy.get_node(node_id)
+            next_node = node.next_vestra_node()
+            next_node = node.next_vestra_node()
+            next_node is not None and next_node.id
+
+    def compiled_next():
+        for node_id in sample:
+            node = compiled.get_node(node_id)
+            node.next_vestra_id()
+            node.next_vestra_id()
+
+    for name, legacy_fn, compiled_fn in (
+        ("get_node", legacy_lookup, compiled_lookup),
+        ("get_node + next vestra x2", legacy_next, compiled_next),
+    ):
+        legacy_time = min(timeit.repeat(legacy_fn, number=1, repeat=5)) / LOOKUPS * 1e9
+        compiled_time = (
+            min(timeit.repeat(compiled_fn, number=1, repeat=5)) / LOOKUPS * 1e9
+        )
+        print(
+            f"{name:<28} legacy {legacy_time:7.1f} ns/op, compiled {compiled_time:7.1f} ns/op "
+            f"({legacy_time / compiled_time:.1f}x)"
+        )
+
+    # Reload after a deploy that changed one node: compile from scratch vs reusing the previous graph
+    flows = json.loads(text)
+    flows[NUM_TABS + NUM_NODES // 2]["wires"] = [[]]
+    full = min(timeit.repeat(lambda: CompiledGraph.compile(flows), number=1, repeat=5))
+    incremental = min(
+        timeit.repeat(
+            lambda: CompiledGraph.compile(flows, compiled), number=1, repeat=5
+        )
+    )
+    reloaded = CompiledGraph.compile(flows, compiled)
+    shared = sum(
+        1 for node_id, node in reloaded.nodes.items() if compiled.nodes[node_id] is node
+    )
+    print(
+        f"{'recompile, 1 node changed':<28} full {full * 1000:7.1f} ms, incremental {incremental * 1000:7.1f} ms "
+        f"({shared}/{len(reloaded)} nodes shared)"
+    )
+
+    del legacy, compiled, reloaded
+    bench_versions(text)
+
+
+def bench_versions(text: str):
+    """
+    50 FlowRuns in progress across 10 deploys that each change 1% of the nodes.
+    """
+    rng = random.Random(2)
+    flows = json.loads(text)
+    flow_nodes = flows[NUM_TABS:]
+
+    def deploys():
+        for _ in range(DEPLOYS):
+            for node in rng.sample(flow_nodes, NUM_NODES // 100):
+                node["wires"] = [[]]
+            yield flows
+
+    def build_shared():
+        versions = GraphVersions()
+        run_id = 0
+        for deployed in deploys():
+            versions.publish(
+                CompiledGraph.compile(deployed, versions.current, versions.next_version)
+            )
+            for _ in range(RUNS_PER_DEPLOY):
+                run_id += 1
+                versions.pin(run_id)
+        return versions
+
+    def build_copies():
+        return [CompiledGraph.compile(deployed) for deployed in deploys()]
+
+    versions, shared_bytes = measure_memory(build_shared)
+    flows = json.loads(text)
+    flow_nodes = flows[NUM_TABS:]
+    rng.seed(2)
+    _, copies_bytes = measure_memory(build_copies)
+    print(
+        f"{DEPLOYS} versions, {DEPLOYS * RUNS_PER_DEPLOY} pinned runs: full copies {copies_bytes / 1e6:7.1f} MB, "
+        f"shared {shared_bytes / 1e6:7.1f} MB"
+    )
+    for version in versions.memory_report():
+        print(f"  {version}")
+
+    # All runs but the ones on the current version complete
+    for run_id in range(1, (DEPLOYS - 1) * RUNS_PER_DEPLOY + 1):
+        versions.unpin(run_id)
+    print(f"Live versions after older runs completed: {sorted(versions.live.keys())}")
+
+
+if __name__ == "__main__":
+    main()
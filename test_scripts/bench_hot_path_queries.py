@@ -0,0 +1,134 @@
+"""
+Benchmark the hot-path queries at 1M node_runs, before and after the index migration.
+
+Everything happens in a scratch schema (`bench_hot_path`) that is dropped at the end, so the real tables are not
+touched. Migrations up to 0002 are applied first, the queries are timed, then the remaining migrations (the
+indexes) are applied and the queries are timed again.
+
+Requires DATABASE_URL. Run from the root of the repository:
+    python -m test_scripts.bench_hot_path_queries
+"""
+
+from __future__ import annotations
+
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from psycopg import connect
+
+from backend.db.conn import DATABASE_URL
+from backend.db.migrate import migrate
+
+SCHEMA = "bench_hot_path"
+NUM_FLOW_RUNS = 50_000
+NUM_NODE_RUNS = 1_000_000
+NUM_INSTRUMENTS = 20
+REPEAT = 50
+
+QUERIES = {
+    "NodeRun.fetch_from_flowrun_and_node": (
+        "SELECT * FROM node_runs WHERE flow_run_id = %s AND node_id = %s ORDER BY id DESC",
+        lambda i: (i % NUM_FLOW_RUNS + 1, f"node-{i % 20}"),
+    ),
+    "FlowRun.query(status='in-progress')": (
+        "SELECT * FROM flow_runs WHERE status = 'in-progress' ORDER BY id DESC LIMIT 100",
+        lambda i: (),
+    ),
+    "PlateLocation.fetch_from_instrument_id": (
+        "SELECT * FROM plate_locations WHERE instrument_id = %s",
+        lambda i: (i % NUM_INSTRUMENTS + 1,),
+    ),
+    "active node_runs": (
+        "SELECT id FROM node_runs WHERE status IN ('waiting', 'in-progress')",
+        lambda i: (),
+    ),
+}
+
+
+def load_data(conn):
+    print(f"Loading {NUM_FLOW_RUNS} flow runs and {NUM_NODE_RUNS} node runs...")
+    with conn.cursor() as cur:
+        # Don't send a change feed NOTIFY for every generated row
+        for table in ("flow_runs", "node_runs", "instruments"):
+            cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+
+        # Almost all history is completed; a handful of runs are active
+        cur.execute(
+            """
+            INSERT INTO flow_runs (name, start_flow_node_id, current_node_id, status)
+            SELECT 'bench', 'node-0', 'node-0',
+                   CASE WHEN g %% 1000 = 0 THEN 'in-progress' ELSE 'completed' END::run_status
+            FROM generate_series(1, %s) g
+            """,
+            (NUM_FLOW_RUNS,),
+        )
+        cur.execute(
+            """
+            INSERT INTO node_runs (flow_run_id, node_id, output_data, status)
+            SELECT g %% %s + 1, 'node-' || (g %% 20), '{"ok": true}',
+                   CASE WHEN g %% 10000 = 0 THEN 'waiting' ELSE 'completed' END::run_status
+            FROM generate_series(1, %s) g
+            """,
+            (NUM_FLOW_RUNS, NUM_NODE_RUNS),
+        )
+        cur.execute(
+            """
+            INSERT INTO instruments (name, type, connection_method, created_at)
+            SELECT 'bench-' || g, 'XPeel', 'tcp', NOW()::text FROM generate_series(1, %s) g
+            """,
+            (NUM_INSTRUMENTS,),
+        )
+        cur.execute(
+            """
+            INSERT INTO plate_locations (id, instrument_id)
+            SELECT 'loc-' || g, g %% %s + 1 FROM generate_series(1, 20000) g
+            """,
+            (NUM_INSTRUMENTS,),
+        )
+        for table in ("flow_runs", "node_runs", "instruments"):
+            cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+        cur.execute("ANALYZE")
+
+
+def time_queries(conn, label: str):
+    print(label)
+    with conn.cursor() as cur:
+        for name, (query, params) in QUERIES.items():
+            timings = []
+            for i in range(REPEAT):
+                start = time.perf_counter()
+                cur.execute(query, params(i))
+                cur.fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+            print(
+                f"  {name:<42} median {statistics.median(timings):8.3f} ms, "
+                f"max {max(timings):8.3f} ms"
+            )
+
+
+def main():
+    with connect(DATABASE_URL, autocommit=True) as conn:
+        conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.execute(f"CREATE SCHEMA {SCHEMA}")
+        conn.execute(f"SET search_path TO {SCHEMA}")
+        try:
+            migrate(conn, target=2)
+            load_data(conn)
+            time_queries(conn, "Without indexes:")
+
+            start = time.perf_counter()
+            migrate(conn)
+            conn.execute("ANALYZE")
+            print(f"Index migration took {time.perf_counter() - start:.1f} s")
+            time_queries(conn, "With indexes:")
+        finally:
+            conn.execute("SET search_path TO public")
+            conn.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+
+
+if __name__ == "__main__":
+    main()
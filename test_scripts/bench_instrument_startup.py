@@ -0,0 +1,146 @@
+"""
+Time instrument connection at startup with 1, 5 and 20 simulated instruments.
+
+Each simulated instrument takes CONNECT_TIME (+-50%) to connect, like an RTDE or TCP handshake. Unreachable ones
+never answer. Compared:
+
+- sequential: `connect_device()` awaited for each instrument in turn, as the orchestrator used to. With an
+  unreachable instrument it never finishes, so it is only run with every instrument reachable.
+- concurrent: InstrumentConnections.connect_all, with every instrument reachable, and with every fifth unreachable
+- lazy: INSTRUMENT_LAZY_CONNECT; startup doesn't connect anything, the first node on an instrument waits for it
+
+Also checks that a node on an unreachable instrument fails fast, and that an instrument that comes back is
+picked up by the background retries.
+
+No instrument is needed. Run from the root of the repository:
+    python -m test_scripts.bench_instrument_startup
+"""
+
+from __future__ import annotations
+
+import os
+
+# Short timeouts, so the benchmark runs in seconds
+os.environ.setdefault("INSTRUMENT_CONNECT_TIMEOUT", "1")
+os.environ.setdefault("INSTRUMENT_RECONNECT_INITIAL", "0.2")
+os.environ.setdefault("INSTRUMENT_RECONNECT_MAX", "1")
+
+import asyncio
+import logging
+import random
+import time
+
+from backend.connections import InstrumentConnections, InstrumentUnavailable
+
+CONNECT_TIME = 0.3
+SIZES = (1, 5, 20)
+
+
+class FakeInstrument:
+    def __init__(self, rng: random.Random, reachable: bool = True):
+        self.connect_time = CONNECT_TIME * rng.uniform(0.5, 1.5)
+        self.reachable = reachable
+
+    async def connect_device(self) -> None:
+        if not self.reachable:
+            # Like a TCP connect to a host that's gone: nothing comes back
+            await asyncio.Event().wait()
+        await asyncio.sleep(self.connect_time)
+
+
+def make_instruments(count: int, unreachable_every: int = 0) -> list[FakeInstrument]:
+    rng = random.Random(count)
+    return [
+        FakeInstrument(
+            rng, reachable=not unreachable_every or (i + 1) % unreachable_every != 0
+        )
+        for i in range(count)
+    ]
+
+
+def make_connections(instruments: list[FakeInstrument]) -> InstrumentConnections:
+    connections = InstrumentConnections()
+    for instrument_id, instrument in enumerate(instruments):
+        connections.add(instrument_id, f"instrument-{instrument_id}", instrument)
+    return connections
+
+
+async def sequential(count: int) -> float:
+    start = time.monotonic()
+    for instrument in make_instruments(count):
+        await instrument.connect_device()
+    return time.monotonic() - start
+
+
+async def concurrent(count: int, unreachable_every: int = 0) -> tuple[float, int]:
+    connections = make_connections(make_instruments(count, unreachable_every))
+    start = time.monotonic()
+    await connections.connect_all(lazy=False)
+    elapsed = time.monotonic() - start
+    available = sum(c.available for c in connections.connections.values())
+    await connections.stop()
+    return elapsed, available
+
+
+async def lazy(count: int) -> tuple[float, float]:
+    connections = make_connections(make_instruments(count))
+    start = time.monotonic()
+    await connections.connect_all(lazy=True)
+    startup = time.monotonic() - start
+    start = time.monotonic()
+    await connections.ensure(0)
+    first_use = time.monotonic() - start
+    await connections.stop()
+    return startup, first_use
+
+
+async def degraded() -> None:
+    instruments = make_instruments(5, unreachable_every=5)
+    connections = make_connections(instruments)
+    await connections.connect_all(lazy=False)
+
+    start = time.monotonic()
+    try:
+        await connections.ensure(4)
+    except InstrumentUnavailable as e:
+        print(
+            f"node on the unreachable instrument failed after "
+            f"{(time.monotonic() - start) * 1000:.2f} ms: {e}"
+        )
+
+    # The instrument comes back; a background retry picks it up
+    instruments[4].reachable = True
+    start = time.monotonic()
+    await connections[4].connected.wait()
+    print(
+        f"instrument back: connected by a background retry after "
+        f"{time.monotonic() - start:.2f} s, {connections[4].attempts} attempts"
+    )
+    await connections.stop()
+
+
+async def main():
+    print(
+        f"{'instruments':<13}{'sequential s':>14}{'concurrent s':>14}"
+        f"{'1/5 down s':>12}{'available':>11}{'lazy s':>9}{'first use s':>13}"
+    )
+    for count in SIZES:
+        sequential_time = await sequential(count)
+        concurrent_time, _ = await concurrent(count)
+        if count >= 5:
+            degraded_time, available = await concurrent(count, unreachable_every=5)
+            degraded_columns = f"{degraded_time:>12.2f}{f'{available}/{count}':>11}"
+        else:
+            degraded_columns = f"{'-':>12}{'-':>11}"
+        lazy_startup, first_use = await lazy(count)
+        print(
+            f"{count:<13}{sequential_time:>14.2f}{concurrent_time:>14.2f}"
+            f"{degraded_columns}{lazy_startup:>9.4f}{first_use:>13.2f}"
+        )
+    await degraded()
+
+
+if __name__ == "__main__":
+    # The failed attempts are expected
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main())
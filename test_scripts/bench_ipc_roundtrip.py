@@ -0,0 +1,132 @@
+"""
+Benchmark IPC command round trips over `IpcCommunicationService.Connect`, with a local stand-in for the 32-bit process.
+
+The backend side is IpcConnectionServicer on a grpc.aio server; the stand-in is `IpcClient` from
+backend/ipc/python_ipc_32.py, running in a thread with an echo handler. Reports:
+
+- sequential: latency of one call at a time
+- concurrent: throughput with CONCURRENCY calls in flight
+- reconnect: the stream is dropped while commands are in flight, and more are made while it's down. Every call must
+  get its own result, and no command may run twice.
+
+Needs grpcio and the generated protobuf code (`make protos` in backend/). Run from the root of the repository:
+    python -m test_scripts.bench_ipc_roundtrip
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import statistics
+import threading
+import time
+
+import grpc
+
+from backend.ipc.python_ipc_32 import IpcClient
+from backend.ipc.python_ipc_servicer import IpcConnectionServicer, ipc_sessions
+from backend.node_connector_pb2 import ipc_template_pb2_grpc
+
+CLIENT_PID = 4242
+SEQUENTIAL_CALLS = 2000
+CONCURRENCY = 64
+CONCURRENT_CALLS = 5000
+RECONNECT_CALLS = 200
+SLOW_COMMAND_TIME = 0.002
+
+
+def echo(function_input, **arguments):
+    return arguments
+
+
+def slow_echo(function_input, **arguments):
+    time.sleep(SLOW_COMMAND_TIME)
+    return arguments
+
+
+async def sequential(session) -> None:
+    latencies = []
+    for i in range(SEQUENTIAL_CALLS):
+        start = time.perf_counter()
+        result = await session.call("echo", {"i": i})
+        latencies.append(time.perf_counter() - start)
+        assert result == {"i": i}
+    latencies.sort()
+    print(
+        f"sequential: {SEQUENTIAL_CALLS} calls, p50 {statistics.median(latencies) * 1e6:.0f} us, "
+        f"p99 {latencies[int(0.99 * len(latencies))] * 1e6:.0f} us"
+    )
+
+
+async def concurrent(session) -> None:
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            assert await session.call("echo", {"i": i}) == {"i": i}
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(CONCURRENT_CALLS)))
+    elapsed = time.perf_counter() - start
+    print(
+        f"concurrent: {CONCURRENT_CALLS} calls, {CONCURRENCY} in flight, "
+        f"{CONCURRENT_CALLS / elapsed:,.0f} calls/s"
+    )
+
+
+async def reconnect(session, client: IpcClient) -> None:
+    executed = client.executed
+    resent = session.resent
+    in_flight = [
+        asyncio.create_task(session.call("slow_echo", {"i": i}))
+        for i in range(RECONNECT_CALLS)
+    ]
+    await asyncio.sleep(RECONNECT_CALLS * SLOW_COMMAND_TIME / 4)
+    client.drop()
+    while session.connected.is_set():
+        await asyncio.sleep(0.001)
+    # Made while the stream is down
+    while_down = [
+        asyncio.create_task(session.call("slow_echo", {"i": i}))
+        for i in range(RECONNECT_CALLS, RECONNECT_CALLS + 20)
+    ]
+    start = time.perf_counter()
+    results = await asyncio.gather(*in_flight, *while_down)
+    assert results == [{"i": i} for i in range(RECONNECT_CALLS + 20)]
+    print(
+        f"reconnect: {len(results)} calls all answered ({time.perf_counter() - start:.2f} s after the drop), "
+        f"{session.resent - resent} commands resent, {client.executed - executed} executed, "
+        f"{session.duplicate_results} duplicate results ignored"
+    )
+
+
+async def main():
+    server = grpc.aio.server()
+    ipc_template_pb2_grpc.add_IpcCommunicationServiceServicer_to_server(
+        IpcConnectionServicer(), server
+    )
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+
+    client = IpcClient(
+        {"echo": echo, "slow_echo": slow_echo},
+        target=f"127.0.0.1:{port}",
+        client_pid=CLIENT_PID,
+    )
+    thread = threading.Thread(target=client.run, daemon=True)
+    thread.start()
+
+    session = ipc_sessions.get(CLIENT_PID)
+    await session.connected.wait()
+    await sequential(session)
+    await concurrent(session)
+    await reconnect(session, client)
+    print(f"session: {session}, client connects: {client.connects}")
+
+    client.stop()
+    await server.stop(None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main())
@@ -0,0 +1,170 @@
+"""
+Benchmark moving 384-well x 200-cycle kinetic plate reads between the backend and a 32-bit driver process, both ways:
+
+- json: the reads go inside the gRPC messages, as JSON (like `StatusUpdate.status_message` would have carried them)
+- shared: the reads go through shared memory (backend/ipc/shared_arrays.py); only descriptors go over gRPC, and the
+  receiver gets zero-copy NumPy views
+
+The driver is a stand-in `IpcClient` in a separate process. Every transfer is checked on the receiving side.
+
+Needs grpcio and the generated protobuf code (`make protos` in backend/). Run from the root of the repository:
+    python -m test_scripts.bench_ipc_shared_arrays
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import statistics
+import subprocess
+import sys
+import time
+
+import grpc
+import numpy as np
+
+from backend.ipc.python_ipc_servicer import (
+    IpcArrayResult,
+    IpcConnectionServicer,
+    ipc_sessions,
+)
+from backend.node_connector_pb2 import ipc_template_pb2_grpc
+
+WELLS = 384
+CYCLES = 200
+CHANNELS = 2
+REPEATS = 20
+
+
+def plate_reads(seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # Fluorescence counts, well x cycle x channel
+    return np.round(rng.uniform(0, 100_000, (WELLS, CYCLES, CHANNELS)), 1)
+
+
+# Stand-in driver, run with --client
+
+
+def run_client(port: int) -> None:
+    from backend.ipc.python_ipc_32 import ArrayResult, IpcClient, exporter
+
+    reads = plate_reads(0)
+
+    def read_json(function_input):
+        return reads.tolist()
+
+    def read_shared(function_input):
+        descriptors, views = exporter.allocate({"reads": (reads.shape, reads.dtype)})
+        # A driver writes its reads straight into shared memory
+        np.copyto(views["reads"], reads)
+        return ArrayResult({"wells": WELLS, "cycles": CYCLES}, descriptors)
+
+    def write_json(function_input, reads):
+        return float(np.asarray(reads).sum())
+
+    def write_shared(function_input, arrays):
+        return float(arrays["reads"].sum())
+
+    def noop(function_input):
+        return None
+
+    IpcClient(
+        {
+            "read_json": read_json,
+            "read_shared": read_shared,
+            "write_json": write_json,
+            "write_shared": write_shared,
+            "noop": noop,
+        },
+        target=f"127.0.0.1:{port}",
+    ).run()
+
+
+# Backend
+
+
+async def timed(call, repeats: int = REPEATS) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await call()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+async def main():
+    options = [
+        ("grpc.max_receive_message_length", 64 << 20),
+        ("grpc.max_send_message_length", 64 << 20),
+    ]
+    server = grpc.aio.server(options=options)
+    ipc_template_pb2_grpc.add_IpcCommunicationServiceServicer_to_server(
+        IpcConnectionServicer(), server
+    )
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+
+    driver = subprocess.Popen(
+        [sys.executable, "-m", __spec__.name, "--client", str(port)]
+    )
+    session = ipc_sessions.get(driver.pid)
+    await session.connected.wait()
+
+    reads = plate_reads(0)
+    expected_sum = float(reads.sum())
+    print(
+        f"{WELLS} wells x {CYCLES} cycles x {CHANNELS} channels, "
+        f"{reads.nbytes / 1e6:.2f} MB per run, median of {REPEATS}"
+    )
+
+    async def noop():
+        await session.call("noop")
+
+    async def read_json():
+        received = np.asarray(await session.call("read_json"))
+        assert np.array_equal(received, reads)
+
+    async def read_shared():
+        result: IpcArrayResult = await session.call("read_shared")
+        with result:
+            assert np.array_equal(result.arrays["reads"], reads)
+
+    async def write_json():
+        assert (
+            await session.call("write_json", {"reads": reads.tolist()}) == expected_sum
+        )
+
+    async def write_shared():
+        assert (
+            await session.call("write_shared", arrays={"reads": reads}) == expected_sum
+        )
+
+    noop_time = await timed(noop)
+    print(f"{'round trip without data':<34}{noop_time * 1000:>9.2f} ms")
+    for name, call in (
+        ("driver -> backend, json", read_json),
+        ("driver -> backend, shared memory", read_shared),
+        ("backend -> driver, json", write_json),
+        ("backend -> driver, shared memory", write_shared),
+    ):
+        elapsed = await timed(call)
+        print(
+            f"{name:<34}{elapsed * 1000:>9.2f} ms{reads.nbytes / elapsed / 1e9:>8.2f} GB/s"
+        )
+    await asyncio.sleep(0.1)
+    print(
+        f"segments left: backend {len(session.exporter)}, "
+        f"releases queued {len(session.releases)}"
+    )
+
+    driver.terminate()
+    driver.wait()
+    await server.stop(None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    if sys.argv[1:2] == ["--client"]:
+        run_client(int(sys.argv[2]))
+    else:
+        asyncio.run(main())
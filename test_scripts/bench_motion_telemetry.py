@@ -0,0 +1,106 @@
+"""
+Benchmark the motion telemetry archive against storing trajectories as JSON.
+
+Records NUM_MOVES simulated UR3 moves (MOVE_SECONDS at the state sampler's rate), then reports:
+
+- time spent on the caller (the event loop) per record() vs writing the file itself
+- bytes per move, archive vs JSON (what JSONB output_data would hold)
+- time to read a 1 second window vs the whole trajectory
+- retention: pruning down to a size limit
+
+Writes to a temporary directory. Run from the root of the repository:
+    python -m test_scripts.bench_motion_telemetry
+"""
+
+from __future__ import annotations
+
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from backend import telemetry
+from backend.devices.ur_state import UR3_SAMPLE_RATE
+from backend.telemetry import TelemetryArchive, Trajectory
+
+NUM_MOVES = 200
+MOVE_SECONDS = 20.0
+NUM_QUERIES = 200
+
+
+def simulated_move(rng: np.random.Generator, started_at: float) -> Trajectory:
+    n = int(MOVE_SECONDS * UR3_SAMPLE_RATE)
+    times = started_at + np.arange(n) / UR3_SAMPLE_RATE
+    start, end = rng.uniform(-3, 3, (2, 6))
+    # Smooth joint motion with a little sensor noise
+    progress = (1 - np.cos(np.linspace(0, np.pi, n))) / 2
+    q = start + (end - start) * progress[:, None] + rng.normal(0, 1e-4, (n, 6))
+    tcp = np.column_stack(
+        [np.sin(q[:, 0]) * 0.3, np.cos(q[:, 0]) * 0.3, 0.2 + q[:, 1] * 0.01, q[:, 3:6]]
+    )
+    return Trajectory(times, q, tcp)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    moves = [simulated_move(rng, 1.7e9 + i * 60) for i in range(NUM_MOVES)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive = TelemetryArchive(directory)
+
+        caller = 0.0
+        start = time.perf_counter()
+        for node_run_id, move in enumerate(moves, 1):
+            call_start = time.perf_counter()
+            archive.record(node_run_id, move)
+            caller += time.perf_counter() - call_start
+        archive.flush()
+        total = time.perf_counter() - start
+        print(f"{NUM_MOVES} moves of {len(moves[0])} samples")
+        print(
+            f"record(): {caller / NUM_MOVES * 1e6:.0f} us on the caller, "
+            f"{total / NUM_MOVES * 1000:.2f} ms per move including the background write"
+        )
+
+        json_size = len(
+            json.dumps(
+                {
+                    "times": moves[0].times.tolist(),
+                    "q": moves[0].q.tolist(),
+                    "tcp": moves[0].tcp.tolist(),
+                }
+            )
+        )
+        print(
+            f"bytes per move: archive {archive.bytes_written / NUM_MOVES:.0f}, "
+            f"raw float64 {len(moves[0]) * 13 * 8}, JSON {json_size}"
+        )
+
+        ids = rng.integers(1, NUM_MOVES + 1, NUM_QUERIES)
+        start = time.perf_counter()
+        for node_run_id in ids:
+            archive.read(int(node_run_id))
+        full = (time.perf_counter() - start) / NUM_QUERIES
+        start = time.perf_counter()
+        for node_run_id in ids:
+            window_start = moves[node_run_id - 1].times[0] + MOVE_SECONDS / 2
+            window = archive.read(int(node_run_id), window_start, window_start + 1)
+        windowed = (time.perf_counter() - start) / NUM_QUERIES
+        print(
+            f"read: whole move {full * 1000:.2f} ms, 1 s window {windowed * 1000:.2f} ms "
+            f"({len(window)} samples)"
+        )
+
+        error = np.max(np.abs(archive.read(1).q - moves[0].q))
+        print(f"max joint error after float32 storage: {error:.2e} rad")
+
+        telemetry.TELEMETRY_MAX_MB = archive.bytes_written / 2 / 1024 / 1024
+        archive.prune()
+        remaining = len(list(archive.path_for(1).parent.parent.glob("*/*.traj")))
+        print(f"pruned to half the size: {archive.pruned} deleted, {remaining} kept")
+        print(archive)
+
+
+if __name__ == "__main__":
+    main()
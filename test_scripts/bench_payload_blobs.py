@@ -0,0 +1,113 @@
+"""
+Benchmark offloading large NodeRun payloads to the blob store (backend/db/blobs.py).
+
+Simulates NUM_RUNS node outputs: mostly small status results, and every LARGE_EVERY-th a large one (an exported
+plate layout or scan), half of which repeat an earlier one. Reports:
+
+- bytes kept in node_runs with and without offloading (what every `SELECT *` used to read)
+- bytes on disk in the blob store, and how many payloads were deduplicated
+- time to encode and store a payload, small and large
+- time to load a large payload on first access
+
+Writes to a temporary directory. Run from the root of the repository:
+    python -m test_scripts.bench_payload_blobs
+"""
+
+from __future__ import annotations
+
+import random
+import statistics
+import tempfile
+import time
+
+from backend.db import blobs
+from backend.db.blobs import PAYLOAD_BLOB_THRESHOLD, BlobStore, Payload, load_payload
+
+NUM_RUNS = 2000
+LARGE_EVERY = 20
+# Bytes in the row that refer to a blob: its digest and size
+REF_BYTES = 64 + 4
+
+
+def small_output(rng: random.Random) -> dict:
+    return {
+        "success": True,
+        "status": rng.choice(["ready", "busy"]),
+        "code": rng.randint(0, 9),
+    }
+
+
+def large_output(seed: int) -> dict:
+    rng = random.Random(seed)
+    return {
+        "success": True,
+        "wells": [
+            {
+                "well": f"{row}{column}",
+                "reads": [rng.uniform(0, 1e5) for _ in range(16)],
+            }
+            for row in "ABCDEFGHIJKLMNOP"
+            for column in range(1, 25)
+        ],
+    }
+
+
+def main():
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        blobs.blob_store = BlobStore(directory)
+
+        inline_bytes = 0
+        row_bytes = 0
+        small_times, large_times = [], []
+        refs = []
+        for i in range(NUM_RUNS):
+            if i % LARGE_EVERY == 0:
+                # Half of the large outputs repeat an earlier one
+                output = large_output(i if i % (2 * LARGE_EVERY) else 0)
+            else:
+                output = small_output(rng)
+            start = time.perf_counter()
+            payload = Payload(output).store()
+            elapsed = time.perf_counter() - start
+            (large_times if payload.offloaded else small_times).append(elapsed)
+            inline_bytes += payload.size
+            row_bytes += REF_BYTES if payload.offloaded else payload.size
+            if payload.ref is not None:
+                refs.append(payload.ref)
+
+        store = blobs.blob_store
+        disk_bytes = sum(
+            path.stat().st_size
+            for path in store.directory.glob("*/*")
+            if path.is_file()
+        )
+        load_times = []
+        for ref in refs[:50]:
+            start = time.perf_counter()
+            load_payload(ref)
+            load_times.append(time.perf_counter() - start)
+
+        print(
+            f"{NUM_RUNS} outputs, {len(refs)} above {PAYLOAD_BLOB_THRESHOLD} bytes "
+            f"({Payload(large_output(0)).size / 1000:.0f} kB each)"
+        )
+        print(f"{'node_runs payload bytes, inline':<38}{inline_bytes / 1e6:>10.2f} MB")
+        print(f"{'node_runs payload bytes, offloaded':<38}{row_bytes / 1e6:>10.2f} MB")
+        print(
+            f"{'blob store on disk':<38}{disk_bytes / 1e6:>10.2f} MB "
+            f"({store.written} blobs, {store.deduplicated} deduplicated)"
+        )
+        print(
+            f"{'store a small payload':<38}{statistics.median(small_times) * 1e6:>10.1f} us"
+        )
+        print(
+            f"{'store a large payload':<38}{statistics.median(large_times) * 1000:>10.2f} ms"
+        )
+        print(
+            f"{'load a large payload':<38}{statistics.median(load_times) * 1000:>10.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
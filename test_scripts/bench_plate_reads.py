@@ -0,0 +1,138 @@
+"""
+Benchmark the plate read store against keeping plate reads in JSON, as JSONB output_data would.
+
+A simulated 384-well kinetic read (CYCLES cycles, CHANNELS channels, integer counts like a plate reader's) is
+stored NUM_READS times, then compared on:
+
+- bytes per read, file vs JSON
+- time to store a read (compress and write) vs to serialize it to JSON
+- time to get one row of wells (24), and the whole plate, vs parsing the JSON
+- per-well kinetics of the blank-subtracted read: vectorized vs a loop over wells and channels
+
+Writes to a temporary directory. Run from the root of the repository:
+    python -m test_scripts.bench_plate_reads
+"""
+
+from __future__ import annotations
+
+import json
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from backend.plate_reads import PLATE_READ_RATE_WINDOW, PlateRead, PlateReadStore
+
+WELLS = 384
+CYCLES = 200
+CHANNELS = 2
+NUM_READS = 20
+REPEATS = 20
+
+
+def simulated_read(rng: np.random.Generator) -> PlateRead:
+    times = np.arange(CYCLES) * 30.0
+    # Sigmoid growth with a per-well rate, plateau and onset, over a background, with counting noise
+    onset = rng.uniform(1000, 4000, (WELLS, 1, CHANNELS))
+    plateau = rng.uniform(20_000, 60_000, (WELLS, 1, CHANNELS))
+    steepness = rng.uniform(150, 400, (WELLS, 1, CHANNELS))
+    signal = plateau / (1 + np.exp(-(times[None, :, None] - onset) / steepness))
+    blank_wells = ["P23", "P24"]
+    read = PlateRead(
+        np.zeros((WELLS, CYCLES, CHANNELS), dtype="<u4"),
+        times=times,
+        channels=["485/520", "544/590"],
+        blank_wells=blank_wells,
+    )
+    signal[read.well_indices(blank_wells)] = 0
+    read.values[...] = rng.poisson(500 + signal)
+    return read
+
+
+def timed(function, repeats: int = REPEATS) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def loop_kinetics(read: PlateRead) -> np.ndarray:
+    # What a flow would do with the JSON: fit every window of every well and channel
+    values = read.subtract_blank().values
+    max_rates = np.empty((WELLS, CHANNELS))
+    for well in range(WELLS):
+        for channel in range(CHANNELS):
+            series = values[well, :, channel]
+            max_rates[well, channel] = max(
+                np.polyfit(
+                    read.times[i : i + PLATE_READ_RATE_WINDOW],
+                    series[i : i + PLATE_READ_RATE_WINDOW],
+                    1,
+                )[0]
+                for i in range(CYCLES - PLATE_READ_RATE_WINDOW + 1)
+            )
+    return max_rates
+
+
+def main():
+    rng = np.random.default_rng(0)
+    reads = [simulated_read(rng) for _ in range(NUM_READS)]
+    row = [f"A{column}" for column in range(1, 25)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = PlateReadStore(directory)
+        start = time.perf_counter()
+        # Includes the kinetics summary that goes into output_data
+        outputs = [store.write(i, read) for i, read in enumerate(reads)]
+        write_time = (time.perf_counter() - start) / NUM_READS
+        file_bytes = statistics.mean(output["plate_read"]["size"] for output in outputs)
+        summary_bytes = statistics.mean(len(json.dumps(output)) for output in outputs)
+
+        start = time.perf_counter()
+        documents = [json.dumps(read.values.tolist()) for read in reads]
+        dumps_time = (time.perf_counter() - start) / NUM_READS
+        json_bytes = statistics.mean(len(document) for document in documents)
+
+        print(
+            f"{WELLS} wells x {CYCLES} cycles x {CHANNELS} channels, {NUM_READS} reads, "
+            f"median of {REPEATS}"
+        )
+        print(
+            f"{'bytes per read':<30}{file_bytes / 1000:>10.1f} kB file "
+            f"(+{summary_bytes / 1000:.1f} kB output_data){json_bytes / 1000:>12.1f} kB JSON"
+        )
+        print(
+            f"{'store one read':<30}{write_time * 1000:>10.2f} ms"
+            f"{dumps_time * 1000:>21.2f} ms json.dumps"
+        )
+
+        row_time = timed(lambda: store.read(3, wells=row))
+        plate_time = timed(lambda: store.read(3))
+        loads_time = timed(lambda: np.asarray(json.loads(documents[3])))
+        print(f"{'read one row (24 wells)':<30}{row_time * 1000:>10.2f} ms")
+        print(
+            f"{'read the whole plate':<30}{plate_time * 1000:>10.2f} ms"
+            f"{loads_time * 1000:>21.2f} ms json.loads"
+        )
+        assert np.array_equal(store.read(3).values, reads[3].values)
+        assert np.array_equal(
+            store.read(3, wells=row).values, reads[3].select(row).values
+        )
+
+        read = store.read(3)
+        vectorized_time = timed(lambda: read.subtract_blank().kinetics())
+        start = time.perf_counter()
+        expected = loop_kinetics(read)
+        loop_time = time.perf_counter() - start
+        error = np.abs(read.subtract_blank().kinetics()["max_rate"] - expected).max()
+        print(
+            f"{'kinetics of every well':<30}{vectorized_time * 1000:>10.2f} ms"
+            f"{loop_time * 1000:>21.2f} ms loop (max difference {error:.1e})"
+        )
+
+
+if __name__ == "__main__":
+    main()
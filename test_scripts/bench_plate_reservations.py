@@ -0,0 +1,112 @@
+"""
+Benchmark flow throughput when many flows share the plate hotel and the XPeel tray.
+
+Each simulated flow moves a plate from a hotel slot to a tray with a robot, processes it on the tray's instrument,
+and moves it back. Half of the flows use the XPeel and its tray, the other half a second instrument with its own
+tray, so they share only the robot and the hotel. Every node runs like `Orchestrator.run_node`: it waits for its
+instrument's dispatcher, then reserves the instrument and plate locations. Three strategies are compared:
+
+- none: plate locations are not reserved (the old behaviour; reports how often two nodes touched a location at once)
+- global lock: one lock around all plate locations
+- reservations: ReservationManager, all of a node's locations at once
+
+No database or instrument is needed. Run from the root of the repository:
+    python -m test_scripts.bench_plate_reservations
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import time
+
+from backend.dispatcher import InstrumentDispatcher
+from backend.reservations import ReservationManager
+
+NUM_FLOWS = 40
+NUM_HOTEL_SLOTS = 10
+MOVE_TIME = 0.02
+PROCESS_TIME = 0.05
+
+ROBOT, XPEEL, READER = 1, 2, 3
+TRAYS = {XPEEL: "xpeel-tray", READER: "reader-tray"}
+
+
+class FakeDbInstrument:
+    def __init__(self, instrument_id: int):
+        self.id = instrument_id
+        self.name = f"instrument-{instrument_id}"
+
+
+class Simulation:
+    def __init__(self, strategy: str):
+        self.strategy = strategy
+        self.dispatchers = {
+            i: InstrumentDispatcher(FakeDbInstrument(i)) for i in (ROBOT, XPEEL, READER)
+        }
+        self.reservations = ReservationManager()
+        self.global_lock = asyncio.Lock()
+        self.node_run_ids = itertools.count(1)
+        # plate location -> number of nodes currently touching it
+        self.in_use: dict[str, int] = {}
+        self.conflicts = 0
+
+    async def run_node(
+        self, instrument_id: int, plate_location_ids: list[str], duration: float
+    ):
+        node_run_id = next(self.node_run_ids)
+        dispatcher = self.dispatchers[instrument_id]
+        await dispatcher.acquire(node_run_id)
+        try:
+            if self.strategy == "reservations":
+                await self.reservations.reserve(
+                    node_run_id,
+                    ReservationManager.resources_for(instrument_id, plate_location_ids),
+                )
+                await self.touch(plate_location_ids, duration)
+            elif self.strategy == "global lock":
+                async with self.global_lock:
+                    await self.touch(plate_location_ids, duration)
+            else:
+                await self.touch(plate_location_ids, duration)
+        finally:
+            self.reservations.release(node_run_id)
+            dispatcher.release(node_run_id)
+
+    async def touch(self, plate_location_ids: list[str], duration: float):
+        for plate_location_id in plate_location_ids:
+            if self.in_use.get(plate_location_id, 0) > 0:
+                self.conflicts += 1
+            self.in_use[plate_location_id] = self.in_use.get(plate_location_id, 0) + 1
+        await asyncio.sleep(duration)
+        for plate_location_id in plate_location_ids:
+            self.in_use[plate_location_id] -= 1
+
+    async def flow(self, flow_number: int):
+        hotel = f"hotel-{flow_number % NUM_HOTEL_SLOTS}"
+        instrument_id = XPEEL if flow_number % 2 == 0 else READER
+        tray = TRAYS[instrument_id]
+        await self.run_node(ROBOT, [hotel, tray], MOVE_TIME)
+        await self.run_node(instrument_id, [tray], PROCESS_TIME)
+        await self.run_node(ROBOT, [tray, hotel], MOVE_TIME)
+
+
+async def run(strategy: str) -> tuple[float, int]:
+    simulation = Simulation(strategy)
+    start = time.perf_counter()
+    await asyncio.gather(*(simulation.flow(i) for i in range(NUM_FLOWS)))
+    return time.perf_counter() - start, simulation.conflicts
+
+
+def main():
+    print(f"{NUM_FLOWS} flows, {NUM_HOTEL_SLOTS} hotel slots, 2 trays, 1 robot")
+    for strategy in ("none", "global lock", "reservations"):
+        elapsed, conflicts = asyncio.run(run(strategy))
+        print(
+            f"  {strategy:<13} {NUM_FLOWS / elapsed:6.1f} flows/s  ({elapsed:5.2f} s, "
+            f"{conflicts} concurrent uses of a plate location)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark read-only XPeel queries with and without the query cache.
+
+DASHBOARDS callers poll the XPeel status every POLL_INTERVAL while a flow peels plates back to back. Every request to
+the (simulated) XPeel goes through its InstrumentDispatcher, like `Orchestrator.run_node`: a status query has to wait
+for the peel in progress to finish. With the cache, a fresh status is reused for the TTL and identical queries share
+the request in flight. Reports device calls and status latency.
+
+No database or XPeel is needed. Run from the root of the repository:
+    python -m test_scripts.bench_query_cache
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import statistics
+import time
+
+from backend.dispatcher import InstrumentDispatcher
+from backend.query_cache import QueryCache
+
+DASHBOARDS = 50
+POLL_INTERVAL = 0.1
+DURATION = 3.0
+PEEL_TIME = 0.5
+STATUS_TIME = 0.02
+TTL = 2.0
+INSTRUMENT_ID = 2
+
+
+class FakeDbInstrument:
+    id = INSTRUMENT_ID
+    name = "xpeel"
+
+
+class Simulation:
+    def __init__(self, use_cache: bool):
+        self.use_cache = use_cache
+        self.dispatcher = InstrumentDispatcher(FakeDbInstrument())
+        self.cache = QueryCache()
+        self.node_run_ids = itertools.count(1)
+        self.device_calls = 0
+        self.latencies: list[float] = []
+        self.peels = 0
+
+    async def exclusive(self, duration: float):
+        node_run_id = next(self.node_run_ids)
+        await self.dispatcher.acquire(node_run_id)
+        try:
+            self.device_calls += 1
+            await asyncio.sleep(duration)
+            return {"type": "ready", "payload": ["00", "00", "00"]}
+        finally:
+            self.dispatcher.release(node_run_id)
+
+    async def status(self):
+        if not self.use_cache:
+            return await self.exclusive(STATUS_TIME)
+        return await self.cache.get(
+            QueryCache.key(INSTRUMENT_ID, "status", {}),
+            TTL,
+            lambda: self.exclusive(STATUS_TIME),
+        )
+
+    async def dashboard(self, stop_at: float):
+        while time.monotonic() < stop_at:
+            start = time.monotonic()
+            await self.status()
+            self.latencies.append(time.monotonic() - start)
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def flow(self, stop_at: float):
+        while time.monotonic() < stop_at:
+            await self.exclusive(PEEL_TIME)
+            self.peels += 1
+            self.cache.invalidate(INSTRUMENT_ID)
+
+    async def run(self):
+        stop_at = time.monotonic() + DURATION
+        await asyncio.gather(
+            self.flow(stop_at), *(self.dashboard(stop_at) for _ in range(DASHBOARDS))
+        )
+
+
+def main():
+    print(
+        f"{'cache':<8}{'queries':>9}{'device calls':>14}{'peels':>7}{'p50 ms':>9}{'p99 ms':>9}"
+    )
+    for use_cache in (False, True):
+        simulation = Simulation(use_cache)
+        asyncio.run(simulation.run())
+        latencies = sorted(simulation.latencies)
+        print(
+            f"{str(use_cache):<8}{len(latencies):>9}{simulation.device_calls:>14}{simulation.peels:>7}"
+            f"{statistics.median(latencies) * 1000:>9.1f}"
+            f"{latencies[int(0.99 * len(latencies))] * 1000:>9.1f}"
+        )
+        if use_cache:
+            for (instrument_id, function_name), stats in simulation.cache.stats.items():
+                print(
+                    f"cache stats for {instrument_id}.{function_name}: {stats.as_dict()}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark shared and exclusive instrument access through InstrumentDispatcher.
+
+READERS callers query a (simulated) instrument back to back while a flow runs exclusive commands (a peel or a move)
+on it, like `Orchestrator.run_node`. The queries are run three ways:
+
+- exclusive: every call holds the instrument alone, as before access modes
+- shared: queries hold the instrument together (see `shared`); exclusive commands still run alone
+- passive: queries don't hold the instrument at all (`shared(passive=True)`, e.g. UR3 state from the sampler)
+
+Reports query latency, and how long the exclusive commands waited for the instrument: with READERS queries always
+in flight, they must not be starved.
+
+No database or instrument is needed. Run from the root of the repository:
+    python -m test_scripts.bench_shared_access
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import statistics
+import time
+
+from backend.dispatcher import InstrumentDispatcher
+
+READERS = 20
+DURATION = 3.0
+EXCLUSIVE_TIME = 0.3
+QUERY_TIME = 0.05
+
+
+class FakeDbInstrument:
+    id = 1
+    name = "instrument"
+
+
+class Simulation:
+    def __init__(self, access_mode: str):
+        self.access_mode = access_mode
+        self.dispatcher = InstrumentDispatcher(FakeDbInstrument())
+        self.node_run_ids = itertools.count(1)
+        self.query_latencies: list[float] = []
+        self.exclusive_waits: list[float] = []
+        self.max_shared = 0
+
+    async def hold(self, duration: float, shared: bool) -> float:
+        node_run_id = next(self.node_run_ids)
+        start = time.monotonic()
+        await self.dispatcher.acquire(node_run_id, shared=shared)
+        waited = time.monotonic() - start
+        try:
+            self.max_shared = max(self.max_shared, len(self.dispatcher.shared_by))
+            await asyncio.sleep(duration)
+        finally:
+            self.dispatcher.release(node_run_id)
+        return waited
+
+    async def query(self) -> None:
+        if self.access_mode == "passive":
+            await asyncio.sleep(QUERY_TIME)
+        else:
+            await self.hold(QUERY_TIME, self.access_mode == "shared")
+
+    async def reader(self, stop_at: float) -> None:
+        while time.monotonic() < stop_at:
+            start = time.monotonic()
+            await self.query()
+            self.query_latencies.append(time.monotonic() - start)
+
+    async def flow(self, stop_at: float) -> None:
+        while time.monotonic() < stop_at:
+            self.exclusive_waits.append(await self.hold(EXCLUSIVE_TIME, False))
+
+    async def run(self) -> None:
+        stop_at = time.monotonic() + DURATION
+        await asyncio.gather(
+            self.flow(stop_at), *(self.reader(stop_at) for _ in range(READERS))
+        )
+
+
+def main():
+    print(
+        f"{'queries':<11}{'count':>7}{'p50 ms':>9}{'p99 ms':>9}{'max shared':>12}"
+        f"{'commands':>10}{'cmd wait p50':>14}{'cmd wait max':>14}"
+    )
+    for access_mode in ("exclusive", "shared", "passive"):
+        simulation = Simulation(access_mode)
+        asyncio.run(simulation.run())
+        latencies = sorted(simulation.query_latencies)
+        waits = simulation.exclusive_waits
+        print(
+            f"{access_mode:<11}{len(latencies):>7}"
+            f"{statistics.median(latencies) * 1000:>9.1f}"
+            f"{latencies[int(0.99 * len(latencies))] * 1000:>9.1f}"
+            f"{simulation.max_shared:>12}{len(waits):>10}"
+            f"{statistics.median(waits) * 1000:>14.1f}{max(waits) * 1000:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Estimate the time saved by running consecutive UR3 moves as one blended path (UR3_PATH_MODE=1).
+
+A plate transfer flow (pick from a hotel slot, drop on the XPeel tray, return to a safe pose) is compiled with
+CompiledGraph, its run of move nodes is found with `motion_run`, and the path `UrRobot.move_path` would send is built
+with `build_joint_path`. A simulated RTDE control interface then times both ways of executing it:
+
+- point to point: one moveJ per waypoint, the robot accelerates from and decelerates to a stop at each of them
+- blended: one moveJ(path), the robot only stops at the last waypoint
+
+Joint moves follow a trapezoidal speed profile on the joint that moves furthest (UR3_SPEED, UR3_ACCELERATION), and
+each moveJ costs a fixed command overhead. No robot is needed. Run from the root of the repository:
+    python -m test_scripts.bench_ur3_blended_path
+"""
+
+from __future__ import annotations
+
+import math
+import time
+
+from backend.flows.compiled import CompiledGraph
+from backend.devices.ur_path import build_joint_path, UR3_SPEED, UR3_ACCELERATION
+
+# Seconds for the controller to accept a moveJ and start the move, and to report it done
+COMMAND_OVERHEAD = 0.1
+NUM_TRANSFERS = 20
+ROBOT = 1
+
+# The first waypoints of UrRobot.waypoints
+WAYPOINTS = [
+    [0.0, -1.3, 0.0, -1.3, 0.0, 0.0],
+    [
+        0.0016515760216861963,
+        -1.5747383276568812,
+        0.002468585968017578,
+        -1.5649493376361292,
+        0.007608110550791025,
+        0.0018253473099321127,
+    ],
+    [
+        4.058738708496094,
+        -0.9063304106341761,
+        -0.6854398886310022,
+        -6.27735418478121,
+        0.5326774716377258,
+        2.0456624031066895,
+    ],
+    [
+        3.423715353012085,
+        -0.3620103041278284,
+        -1.4064410368548792,
+        -0.7819817701922815,
+        -1.2245267073260706,
+        2.8527207374572754,
+    ],
+    [
+        1.570734977722168,
+        -1.5708444754229944,
+        -1.57080585161318,
+        -1.570820156727926,
+        -1.5708907286273401,
+        -1.5707791487323206,
+    ],
+]
+
+
+def stop_to_stop_time(distance: float, speed: float, acceleration: float) -> float:
+    """
+    Time for a trapezoidal (or, if too short to reach full speed, triangular) profile that starts and ends at rest.
+    """
+    if distance <= 0:
+        return 0.0
+    if distance >= speed * speed / acceleration:
+        return distance / speed + speed / acceleration
+    return 2 * math.sqrt(distance / acceleration)
+
+
+def joint_distance(a: list[float], b: list[float]) -> float:
+    return max(abs(x - y) for x, y in zip(a, b))
+
+
+class FakeControlInterface:
+    """
+    Stands in for rtde_control.RTDEControlInterface, adding up the time the robot would spend moving.
+    """
+
+    def __init__(self):
+        self.q = WAYPOINTS[0]
+        self.elapsed = 0.0
+        self.commands = 0
+
+    def moveJ(
+        self,
+        q_or_path,
+        speed: float = UR3_SPEED,
+        acceleration: float = UR3_ACCELERATION,
+    ) -> bool:
+        self.commands += 1
+        self.elapsed += COMMAND_OVERHEAD
+        if isinstance(q_or_path[0], list):
+            # A blended path is one continuous motion over the whole distance, stopping only at the end
+            distance = 0.0
+            for entry in q_or_path:
+                distance += joint_distance(self.q, entry[:6])
+                self.q = entry[:6]
+            self.elapsed += stop_to_stop_time(
+                distance, q_or_path[0][6], q_or_path[0][7]
+            )
+        else:
+            self.elapsed += stop_to_stop_time(
+                joint_distance(self.q, q_or_path), speed, acceleration
+            )
+            self.q = q_or_path
+        return True
+
+
+def plate_transfer_flow() -> list[dict]:
+    """
+    flows.json for: safe pose -> move hotel-2 to XPeel tray -> safe pose -> home, then a peel.
+    """
+    return [
+        {"id": "start", "type": "vestra:start-flow", "z": "tab", "wires": [["safe"]]},
+        {
+            "id": "safe",
+            "type": "vestra:ur3-movetojointwaypoint",
+            "z": "tab",
+            "wires": [["transfer"]],
+            "waypoint_number": "0",
+            "instrument_id": str(ROBOT),
+        },
+        {
+            "id": "transfer",
+            "type": "vestra:ur3-move",
+            "z": "tab",
+            "wires": [["retreat"]],
+            "source_waypoint_number": "1",
+            "destination_waypoint_number": "3",
+            "delay_between_movements": "0",
+            "instrument_id": str(ROBOT),
+        },
+        {
+            "id": "retreat",
+            "type": "vestra:ur3-movetojointwaypoint",
+            "z": "tab",
+            "wires": [["home"]],
+            "waypoint_number": "0",
+            "instrument_id": str(ROBOT),
+        },
+        {
+            "id": "home",
+            "type": "vestra:ur3-movetojointwaypoint",
+            "z": "tab",
+            "wires": [["peel"]],
+            "waypoint_number": "4",
+            "blend_radius": "0.02",
+            "instrument_id": str(ROBOT),
+        },
+        {
+            "id": "peel",
+            "type": "vestra:xpeel-xpeel",
+            "z": "tab",
+            "wires": [[]],
+            "instrument_id": "2",
+        },
+    ]
+
+
+def main():
+    graph = CompiledGraph.compile(plate_transfer_flow())
+
+    start = time.perf_counter()
+    run = graph.motion_run("safe")
+    waypoint_numbers = []
+    blend_radii = []
+    for node in run:
+        for waypoint_number in node.motion.waypoints:
+            waypoint_numbers.append(waypoint_number)
+            blend_radii.append(node.motion.blend_radius)
+    path = build_joint_path([WAYPOINTS[n] for n in waypoint_numbers], blend_radii)
+    planning = time.perf_counter() - start
+
+    print(f"Move nodes blended: {[node.id for node in run]}")
+    print(
+        f"Waypoints: {waypoint_numbers} -> {len(path)} path entries (planned in {planning * 1e6:.0f} us)"
+    )
+
+    point_to_point = FakeControlInterface()
+    blended = FakeControlInterface()
+    for _ in range(NUM_TRANSFERS):
+        for number in waypoint_numbers:
+            point_to_point.moveJ(WAYPOINTS[number])
+        blended.moveJ(path)
+
+    per_transfer_ptp = point_to_point.elapsed / NUM_TRANSFERS
+    per_transfer_blended = blended.elapsed / NUM_TRANSFERS
+    print(f"{'mode':<16}{'moveJ calls':>12}{'s/transfer':>12}")
+    print(
+        f"{'point to point':<16}{point_to_point.commands // NUM_TRANSFERS:>12}{per_transfer_ptp:>12.2f}"
+    )
+    print(
+        f"{'blended':<16}{blended.commands // NUM_TRANSFERS:>12}{per_transfer_blended:>12.2f}"
+    )
+    print(
+        f"Saved {per_transfer_ptp - per_transfer_blended:.2f} s per plate transfer "
+        f"({(1 - per_transfer_blended / per_transfer_ptp) * 100:.0f}%)"
+    )
+
+
+if __name__ == "__main__":
+    main()
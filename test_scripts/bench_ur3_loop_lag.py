@@ -0,0 +1,149 @@
+"""
+Measure event loop lag while a UR3 moves, with a fake RTDE control interface.
+
+A ticker task sleeps 1 ms at a time and records how late it wakes up while a 5 second move runs:
+
+- idle: no move, the lag the machine itself adds
+- blocking: moveJ called straight from the coroutine, as UrRobot used to
+- executor: UrMotionExecutor, the move started asynchronously on the robot's thread and awaited
+
+Then checks that cancelling a move and timing one out both stop the arm. No robot is needed. Run from the root
+of the repository:
+    python -m test_scripts.bench_ur3_loop_lag
+"""
+
+from __future__ import annotations
+
+import asyncio
+import statistics
+import threading
+import time
+
+from backend.devices.ur_motion import UrMotionExecutor
+
+MOVE_TIME = 5.0
+# Round trip of one RTDE call
+RTDE_LATENCY = 0.002
+Q = [0.0, -1.3, 0.0, -1.3, 0.0, 0.0]
+
+
+class FakeControlInterface:
+    """
+    Stands in for rtde_control.RTDEControlInterface. Every move takes MOVE_TIME.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.move_ends_at: float | None = None
+        self.move_started_at: float | None = None
+        self.stops = 0
+
+    def moveJ(self, q, speed=1.05, acceleration=1.4, asynchronous=False) -> bool:
+        if isinstance(speed, bool):
+            # moveJ(path, asynchronous)
+            asynchronous = speed
+        time.sleep(RTDE_LATENCY)
+        if not asynchronous:
+            time.sleep(MOVE_TIME)
+            return True
+        with self.lock:
+            self.move_started_at = time.monotonic()
+            self.move_ends_at = self.move_started_at + MOVE_TIME
+        return True
+
+    def getAsyncOperationProgress(self) -> int:
+        time.sleep(RTDE_LATENCY)
+        with self.lock:
+            if self.move_ends_at is None or time.monotonic() >= self.move_ends_at:
+                self.move_ends_at = None
+                return -1
+            return int((time.monotonic() - self.move_started_at) / MOVE_TIME * 100)
+
+    def stopJ(self, deceleration=2.0) -> None:
+        time.sleep(RTDE_LATENCY)
+        with self.lock:
+            self.move_ends_at = None
+            self.stops += 1
+
+
+async def measure_lag(move) -> list[float]:
+    lags = []
+    done = False
+
+    async def ticker():
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+    await move()
+    done = True
+    await task
+    return lags
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report(name: str, lags: list[float], elapsed: float) -> None:
+    print(
+        f"{name:<10}{elapsed:>10.2f}{len(lags):>8}{statistics.median(lags) * 1000:>12.2f}"
+        f"{percentile(lags, 0.99) * 1000:>12.2f}{max(lags) * 1000:>12.2f}"
+    )
+
+
+async def main():
+    print(
+        f"{'mode':<10}{'move (s)':>10}{'ticks':>8}{'median ms':>12}{'p99 ms':>12}{'max ms':>12}"
+    )
+
+    start = time.monotonic()
+    lags = await measure_lag(lambda: asyncio.sleep(MOVE_TIME))
+    report("idle", lags, time.monotonic() - start - 0.05)
+
+    fake = FakeControlInterface()
+
+    async def blocking_move():
+        fake.moveJ(Q, 1.0, 1.4)
+
+    start = time.monotonic()
+    lags = await measure_lag(blocking_move)
+    report("blocking", lags, time.monotonic() - start - 0.05)
+
+    motion = UrMotionExecutor("ur3-fake")
+    motion.control_interface = fake
+    start = time.monotonic()
+    lags = await measure_lag(lambda: motion.move_joint(Q, 1.0, 1.4))
+    report("executor", lags, time.monotonic() - start - 0.05)
+    print(f"executor p99 lag under 10 ms: {percentile(lags, 0.99) < 0.010}")
+
+    # Cancelling the awaiting task stops the arm
+    task = asyncio.create_task(motion.move_joint(Q, 1.0, 1.4))
+    await asyncio.sleep(1.0)
+    start = time.monotonic()
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    print(
+        f"cancelled after 1 s: stopJ called {fake.stops} time(s), "
+        f"in {(time.monotonic() - start) * 1000:.1f} ms"
+    )
+
+    # A move that takes longer than its timeout is stopped and fails
+    start = time.monotonic()
+    try:
+        await motion.move_joint(Q, 1.0, 1.4, timeout=0.5)
+    except TimeoutError as e:
+        print(f"timed out after {time.monotonic() - start:.2f} s: {e}")
+    print(f"stopJ called {fake.stops} time(s), {motion}")
+    motion.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""
+Compare robot state queries answered by the RTDE receive interface with ones answered from UrStateSampler, and
+wait for the arm to reach a waypoint with it.
+
+A fake receive interface moves its joints linearly from one waypoint to another over MOVE_TIME, and every call
+costs RTDE_LATENCY. No robot is needed. Run from the root of the repository:
+    python -m test_scripts.bench_ur3_state_sampler
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+import numpy as np
+
+from backend.devices.ur_state import UrStateSampler
+
+NUM_QUERIES = 2000
+MOVE_TIME = 2.0
+# Round trip of one RTDE call
+RTDE_LATENCY = 0.0005
+START = np.array([0.0, -1.3, 0.0, -1.3, 0.0, 0.0])
+END = np.array([1.5707, -1.5708, -1.5708, -1.5708, -1.5709, -1.5708])
+
+
+class FakeReceiveInterface:
+    """
+    Stands in for rtde_receive.RTDEReceiveInterface.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.calls = 0
+
+    def getActualQ(self) -> list[float]:
+        self.calls += 1
+        time.sleep(RTDE_LATENCY)
+        progress = min(1.0, (time.monotonic() - self.started_at) / MOVE_TIME)
+        return list(START + (END - START) * progress)
+
+    def getActualTCPPose(self) -> list[float]:
+        self.calls += 1
+        time.sleep(RTDE_LATENCY)
+        return [0.1, 0.2, 0.3, 0.0, 3.14, 0.0]
+
+
+async def main():
+    receive_interface = FakeReceiveInterface()
+
+    start = time.perf_counter()
+    for _ in range(NUM_QUERIES):
+        receive_interface.getActualQ()
+    direct = time.perf_counter() - start
+
+    sampler = UrStateSampler(
+        "ur3-fake",
+        lambda: (receive_interface.getActualQ(), receive_interface.getActualTCPPose()),
+    )
+    receive_interface.started_at = time.monotonic()
+    sampler.start()
+    await asyncio.sleep(0.1)
+
+    calls_before = receive_interface.calls
+    start = time.perf_counter()
+    for _ in range(NUM_QUERIES):
+        sampler.latest_q().tolist()
+    sampled = time.perf_counter() - start
+    sampled_calls = receive_interface.calls - calls_before
+
+    print(f"{'source':<10}{'us/query':>10}")
+    print(f"{'device':<10}{direct / NUM_QUERIES * 1e6:>10.1f}")
+    print(
+        f"{'sampler':<10}{sampled / NUM_QUERIES * 1e6:>10.1f}  (sampler made {sampled_calls} device calls meanwhile)"
+    )
+
+    # Wait for the end of the move instead of polling the robot
+    start = time.monotonic()
+    await sampler.wait_until_near(list(END), epsilon=0.01, timeout=MOVE_TIME * 2)
+    waited = time.monotonic() - start
+    arrived_at = receive_interface.started_at + MOVE_TIME * (
+        1 - 0.01 / np.max(np.abs(END - START))
+    )
+    print(
+        f"reached waypoint {waited:.2f} s into the wait, {(time.monotonic() - arrived_at) * 1000:.0f} ms after arrival"
+    )
+
+    times, q, _ = sampler.buffer.window(receive_interface.started_at)
+    print(
+        f"{len(times)} samples recorded over the move, {len(times) / (times[-1] - times[0]):.0f} Hz"
+    )
+    sampler.stop()
+    print(sampler)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+Fuzz and benchmark the XPeel CRLF framer and message dispatcher.
+
+- fuzz: random XPeel message streams cut into random fragments (down to single bytes, and between CR and LF) must
+  frame into exactly the messages sent. The old split-each-read approach is run on the same streams for comparison.
+- throughput: messages framed per second with 1024 byte reads.
+- dispatch: a peel waiting for its ready and a tape query waiting for its reply, with unsolicited messages mixed
+  in, each get their own message.
+
+No XPeel is needed. Run from the root of the repository:
+    python -m test_scripts.bench_xpeel_framer
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+
+from backend.devices.xpeel_protocol import XPeelDispatcher, XPeelFramer
+
+NUM_STREAMS = 2000
+MESSAGES_PER_STREAM = 50
+THROUGHPUT_MESSAGES = 200_000
+
+
+def random_message(rng: random.Random) -> str:
+    msg_type = rng.choice(["ready", "ack", "tape", "error", "homing"])
+    if msg_type in ("ack", "homing"):
+        return f"*{msg_type}"
+    count = 2 if msg_type == "tape" else 3
+    return f"*{msg_type}:" + ",".join(f"{rng.randrange(100):02d}" for _ in range(count))
+
+
+def fragment(rng: random.Random, data: bytes) -> list[bytes]:
+    fragments = []
+    i = 0
+    while i < len(data):
+        size = rng.choice([1, 1, 2, 3, rng.randrange(1, 64)])
+        fragments.append(data[i : i + size])
+        i += size
+    return fragments
+
+
+def old_split(fragments: list[bytes]) -> list[str]:
+    # What XPeelConnector._recv_loop used to do with every read
+    messages = []
+    for data in fragments:
+        for msg in data.decode().split("\r\n"):
+            if msg.strip():
+                messages.append(msg.strip())
+    return messages
+
+
+def fuzz(rng: random.Random) -> None:
+    framer_failures = 0
+    old_failures = 0
+    for _ in range(NUM_STREAMS):
+        sent = [random_message(rng) for _ in range(MESSAGES_PER_STREAM)]
+        fragments = fragment(rng, "".join(msg + "\r\n" for msg in sent).encode())
+
+        framer = XPeelFramer()
+        received = [msg.raw_msg for data in fragments for msg in framer.feed(data)]
+        if received != sent or framer.buffer:
+            framer_failures += 1
+        if old_split(fragments) != sent:
+            old_failures += 1
+    print(
+        f"fuzz: {NUM_STREAMS} fragmented streams of {MESSAGES_PER_STREAM} messages, "
+        f"framer wrong on {framer_failures}, old split wrong on {old_failures}"
+    )
+
+
+def throughput(rng: random.Random) -> None:
+    stream = "".join(
+        random_message(rng) + "\r\n" for _ in range(THROUGHPUT_MESSAGES)
+    ).encode()
+    reads = [stream[i : i + 1024] for i in range(0, len(stream), 1024)]
+    framer = XPeelFramer()
+    start = time.perf_counter()
+    count = sum(len(framer.feed(data)) for data in reads)
+    elapsed = time.perf_counter() - start
+    print(
+        f"throughput: {count / elapsed:,.0f} messages/s ({len(stream) / elapsed / 1e6:.1f} MB/s)"
+    )
+
+
+async def dispatch(rng: random.Random) -> None:
+    framer = XPeelFramer()
+    dispatcher = XPeelDispatcher()
+    peel_ready = dispatcher.expect("ready")
+    tape = dispatcher.expect("tape")
+    stream = b"*homing\r\n*ack\r\n*tape:05,07\r\n*ready:00,00,00\r\n*ready:99,99,99\r\n"
+    for data in fragment(rng, stream):
+        for msg in framer.feed(data):
+            dispatcher.dispatch(msg)
+    assert (await tape).payload == ["05", "07"]
+    assert (await peel_ready).payload == ["00", "00", "00"]
+    print(
+        f"dispatch: tape and ready routed to their waiters, {dispatcher.unsolicited} unsolicited "
+        f"messages dropped, {len(dispatcher)} waiters left"
+    )
+
+
+def main():
+    rng = random.Random(0)
+    fuzz(rng)
+    throughput(rng)
+    asyncio.run(dispatch(rng))
+
+
+if __name__ == "__main__":
+    main()
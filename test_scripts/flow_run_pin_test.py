@@ -0,0 +1,84 @@
+"""
+Check that a FlowRun stays on the graph version it started on (backend.flows.compiled.GraphVersions):
+
+1. a node of the FlowRun fails, flows.json is redeployed with the node rewired, and the node is run again: the
+   retry still walks the version the FlowRun started on, while a new FlowRun gets the new version
+2. once the FlowRun completes and is unpinned, its version is dropped
+3. a FlowRun that fails and is never run again loses its pin after the pin TTL, when the next version is published
+
+Nothing else is needed. Run from the root of the repository:
+    python -m test_scripts.flow_run_pin_test
+"""
+
+from __future__ import annotations
+
+import gc
+import time
+
+from backend.flows.compiled import CompiledGraph, GraphVersions
+
+PIN_TTL = 0.2
+
+
+def flows(next_after_move: str) -> list[dict]:
+    # start -> move -> <next_after_move>; both peel and read are Vestra nodes
+    return [
+        {"id": "tab", "type": "tab", "label": "flow"},
+        {"id": "start", "type": "vestra:start-flow", "z": "tab", "wires": [["move"]]},
+        {
+            "id": "move",
+            "type": "vestra:ur3",
+            "z": "tab",
+            "wires": [[next_after_move]],
+        },
+        {"id": "peel", "type": "vestra:xpeel", "z": "tab", "wires": [[]]},
+        {"id": "read", "type": "vestra:fluostar", "z": "tab", "wires": [[]]},
+    ]
+
+
+def publish(versions: GraphVersions, flows_json: list[dict]) -> CompiledGraph:
+    graph = CompiledGraph.compile(flows_json, versions.current, versions.next_version)
+    versions.publish(graph)
+    return graph
+
+
+def main():
+    versions = GraphVersions(PIN_TTL)
+    v1 = publish(versions, flows("peel"))
+    v1_version = v1.version
+    del v1
+
+    # 1. FlowRun 1 runs "move" on version 1; the node fails, which leaves the pin alone (see Orchestrator.run_node)
+    assert versions.pin(1).version == v1_version
+    # Deployed while the node is failed: "move" now leads to "read"
+    publish(versions, flows("read"))
+    retry = versions.pin(1)
+    assert retry.version == v1_version, retry.version
+    assert retry.get_node("move").next_vestra_id() == "peel"
+    new_run = versions.pin(2)
+    assert new_run.get_node("move").next_vestra_id() == "read"
+    print(
+        f"retry after redeploy: version {retry.version} (next node {retry.get_node('move').next_vestra_id()}), "
+        f"new FlowRun: version {new_run.version}"
+    )
+    del retry, new_run
+
+    # 2. FlowRun 1 completes
+    versions.unpin(1)
+    gc.collect()
+    assert v1_version not in versions.live, sorted(versions.live)
+    print(f"after completing: live versions {sorted(versions.live)}")
+
+    # 3. FlowRun 2 fails and is never run again
+    time.sleep(PIN_TTL * 1.5)
+    publish(versions, flows("peel"))
+    gc.collect()
+    assert 2 not in versions.pins and versions.expired_pins == 1
+    print(
+        f"after the pin TTL: pins {sorted(versions.pins)}, live versions {sorted(versions.live)}, "
+        f"{versions.expired_pins} expired"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Exercise the supervised pool of IPC driver processes (backend/ipc/worker_pool.py) against a real IPC service:
+
+- pre-warming: how long until the pool's processes are ready
+- routing: concurrent calls are spread over the processes
+- a process killed mid-command: the command fails, the process is replaced, and the pool keeps serving
+- a process that crashes at startup: it's restarted with exponential backoff
+
+The drivers are stand-in `IpcClient`s, run with --worker.
+
+Needs grpcio and the generated protobuf code (`make protos` in backend/). Run from the root of the repository:
+    python -m test_scripts.ipc_worker_pool_test
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+import os
+import signal
+import sys
+import time
+
+import grpc
+
+from backend.ipc import worker_pool
+from backend.ipc.python_ipc_servicer import IpcCommandError, IpcConnectionServicer
+from backend.ipc.worker_pool import WorkerPool
+from backend.node_connector_pb2 import ipc_template_pb2_grpc
+
+WORKERS = 4
+CALLS = 200
+
+
+# Stand-in driver, run with --worker
+
+
+def run_worker() -> None:
+    from backend.ipc.python_ipc_32 import IpcClient
+
+    def ping(function_input):
+        return os.getpid()
+
+    def sleep(function_input, seconds):
+        time.sleep(seconds)
+        return os.getpid()
+
+    IpcClient({"ping": ping, "sleep": sleep}, target=os.environ["IPC_TARGET"]).run()
+
+
+# Backend
+
+
+async def main():
+    server = grpc.aio.server()
+    ipc_template_pb2_grpc.add_IpcCommunicationServiceServicer_to_server(
+        IpcConnectionServicer(), server
+    )
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    env = {"IPC_TARGET": f"127.0.0.1:{port}"}
+    worker_pool.IPC_HEALTH_INTERVAL = 0.05
+    worker_pool.IPC_RESTART_INITIAL = 0.2
+
+    pool = WorkerPool(
+        "stand-in", [sys.executable, "-m", __spec__.name, "--worker"], WORKERS, env
+    )
+    start = time.perf_counter()
+    await pool.start()
+    first_ready = time.perf_counter() - start
+    while any(worker.state != "idle" for worker in pool.workers.values()):
+        await asyncio.sleep(0.01)
+    print(
+        f"pre-warm: first of {WORKERS} processes ready after {first_ready:.2f} s, "
+        f"all after {time.perf_counter() - start:.2f} s"
+    )
+
+    start = time.perf_counter()
+    pids = await asyncio.gather(
+        *(pool.call("sleep", arguments={"seconds": 0.01}) for _ in range(CALLS))
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"routing: {CALLS} calls of 10 ms in {elapsed:.2f} s "
+        f"({CALLS * 0.01 / elapsed:.1f}x a single process), "
+        f"per process {sorted(collections.Counter(pids).values())}"
+    )
+
+    # Kill a process in the middle of a command
+    in_flight = asyncio.create_task(pool.call("sleep", arguments={"seconds": 5}))
+    await asyncio.sleep(0.2)
+    victim = next(w for w in pool.workers.values() if w.state == "busy")
+    killed_at = time.perf_counter()
+    os.kill(victim.pid, signal.SIGKILL)
+    try:
+        await in_flight
+        print("kill: the command in flight succeeded - it should have failed")
+    except IpcCommandError as e:
+        print(
+            f"kill: command in flight failed after {time.perf_counter() - killed_at:.2f} s: {e}"
+        )
+    while (
+        pool.workers[victim.slot].pid == victim.pid
+        or pool.workers[victim.slot].state != "idle"
+    ):
+        await asyncio.sleep(0.01)
+    print(
+        f"kill: slot {victim.slot} back with pid {pool.workers[victim.slot].pid} "
+        f"after {time.perf_counter() - killed_at:.2f} s"
+    )
+    pids = await asyncio.gather(*(pool.call("ping") for _ in range(CALLS)))
+    print(f"kill: {CALLS} calls afterwards, on {len(set(pids))} processes")
+    print(f"metrics: {pool.metrics()}")
+    await pool.stop()
+
+    # A driver that crashes at startup
+    crashing = WorkerPool(
+        "crashing", [sys.executable, "-c", "raise SystemExit(3)"], 1, env
+    )
+    starts = []
+    crashing.tasks = [asyncio.create_task(crashing._supervise(0))]
+    while len(starts) < 6:
+        if crashing.starts > len(starts):
+            starts.append(time.perf_counter())
+        await asyncio.sleep(0.005)
+    gaps = [f"{b - a:.2f}" for a, b in zip(starts, starts[1:])]
+    print(f"crash loop: seconds between restarts {gaps}")
+    print(f"metrics: {crashing.metrics()}")
+    await crashing.stop()
+
+    await server.stop(None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    if sys.argv[1:2] == ["--worker"]:
+        run_worker()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,179 @@
+"""
+Exercise ConnectionSupervisor against a fake XPeel on localhost:
+
+1. the XPeel closes the connection (EOF): CPU use while it is gone, and reconnection once it's back
+2. a command waiting for its reply when the connection drops fails at once instead of hanging
+3. the XPeel stops answering: the heartbeat (*stat) notices and the supervisor reconnects
+4. the XPeel is unreachable: reconnect attempts back off exponentially, and sends fail fast meanwhile
+
+No XPeel is needed. Run from the root of the repository:
+    python -m test_scripts.xpeel_supervisor_test
+"""
+
+from __future__ import annotations
+
+import os
+
+# Short intervals, so the test runs in seconds
+os.environ.setdefault("INSTRUMENT_HEARTBEAT_INTERVAL", "0.5")
+os.environ.setdefault("INSTRUMENT_HEARTBEAT_TIMEOUT", "0.3")
+os.environ.setdefault("INSTRUMENT_RECONNECT_INITIAL", "0.1")
+os.environ.setdefault("INSTRUMENT_RECONNECT_MAX", "1.6")
+
+import asyncio
+import time
+
+from backend.devices.supervisor import ConnectionSupervisor
+from backend.devices.xpeel_protocol import XPeelDispatcher, XPeelFramer
+
+
+class FakeXPeel:
+    """
+    Answers *stat with a ready, *xpeel with an ack (and never the ready). Can close, go silent or go away.
+    """
+
+    def __init__(self):
+        self.server: asyncio.Server | None = None
+        self.port = 0
+        self.silent = False
+        self.writers: list[asyncio.StreamWriter] = []
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        self.close_connections()
+        await self.server.wait_closed()
+
+    def close_connections(self) -> None:
+        for writer in self.writers:
+            writer.close()
+        self.writers.clear()
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.writers.append(writer)
+        try:
+            while line := await reader.readline():
+                if self.silent:
+                    continue
+                if line.startswith(b"*stat"):
+                    writer.write(b"*ready:00,00,00\r\n")
+                elif line.startswith(b"*xpeel"):
+                    writer.write(b"*ack\r\n")
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+
+class Client:
+    """
+    The parts of XPeelConnector that use the supervisor.
+    """
+
+    def __init__(self, port: int):
+        self.framer = XPeelFramer()
+        self.dispatcher = XPeelDispatcher()
+        self.supervisor = ConnectionSupervisor(
+            "xpeel-fake", "127.0.0.1", port, self.on_data, self.on_down, self.heartbeat
+        )
+
+    def on_data(self, data: bytes) -> None:
+        for msg in self.framer.feed(data):
+            self.dispatcher.dispatch(msg)
+
+    def on_down(self, exc: ConnectionError) -> None:
+        self.framer.reset()
+        self.dispatcher.fail_all(exc)
+
+    async def heartbeat(self) -> None:
+        await self.execute("*stat")
+
+    async def execute(self, command: str, reply_type: str = "ready"):
+        reply = self.dispatcher.expect(reply_type)
+        try:
+            await self.supervisor.send((command + "\r\n").encode())
+            return await reply
+        finally:
+            self.dispatcher.discard(reply_type, reply)
+
+
+async def wait_for_state(client: Client, state: str, timeout: float = 10) -> float:
+    start = time.monotonic()
+    while client.supervisor.state != state:
+        if time.monotonic() - start > timeout:
+            raise TimeoutError(f"supervisor stuck in {client.supervisor.state}")
+        await asyncio.sleep(0.01)
+    return time.monotonic() - start
+
+
+async def main():
+    xpeel = FakeXPeel()
+    await xpeel.start()
+    client = Client(xpeel.port)
+    await client.supervisor.start()
+    print(f"connected: {(await client.execute('*stat')).payload}")
+
+    # 1. EOF, with the XPeel gone for a second
+    await xpeel.stop()
+    cpu_start = time.process_time()
+    await asyncio.sleep(1.0)
+    print(
+        f"1. EOF: {time.process_time() - cpu_start:.3f} s CPU in 1 s while the XPeel is gone"
+    )
+    await xpeel.start()
+    print(f"   reconnected after {await wait_for_state(client, 'connected'):.2f} s")
+
+    # 2. A pending command fails fast when the link drops
+    peel = asyncio.create_task(client.execute("*xpeel:41"))
+    await asyncio.sleep(0.1)
+    start = time.monotonic()
+    xpeel.close_connections()
+    try:
+        await peel
+    except ConnectionError as e:
+        print(
+            f"2. pending peel failed after {(time.monotonic() - start) * 1000:.0f} ms: {e}"
+        )
+    await wait_for_state(client, "connected")
+
+    # 3. The XPeel stops answering; only the heartbeat can tell
+    xpeel.silent = True
+    disconnects = client.supervisor.disconnects
+    start = time.monotonic()
+    while client.supervisor.disconnects == disconnects:
+        await asyncio.sleep(0.01)
+    print(
+        f"3. silent XPeel detected after {time.monotonic() - start:.2f} s, "
+        f"heartbeat failures: {client.supervisor.heartbeat_failures}"
+    )
+    xpeel.silent = False
+    await wait_for_state(client, "connected")
+
+    # 4. Unreachable: backoff, and sends fail fast
+    await xpeel.stop()
+    await wait_for_state(client, "backoff")
+    start = time.monotonic()
+    try:
+        await client.execute("*stat")
+    except ConnectionError as e:
+        print(
+            f"4. send while down failed after {(time.monotonic() - start) * 1000:.1f} ms: {e}"
+        )
+    attempts = client.supervisor.failed_attempts
+    await asyncio.sleep(3.0)
+    print(
+        f"   {client.supervisor.failed_attempts - attempts} connection attempts in 3 s of backoff"
+    )
+    await xpeel.start()
+    await wait_for_state(client, "connected")
+
+    print(f"metrics: {client.supervisor.metrics()}")
+    await client.supervisor.stop()
+    await xpeel.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())